@@ -8,30 +8,128 @@
 import getpass
 import click
 import time
+from click.core import ParameterSource
 from pathlib import Path
 from shapely import wkt
 
 import src.product_download_api as pda
-import src.geo_utility as gu
-from tempfile import TemporaryDirectory
-from src.config import PROJECT_DIR, MASK_DIR, PRODUCTS_DIR
+from src.config import (
+    PROJECT_DIR, DATA_DIR, MASK_DIR, PRODUCTS_DIR, PRODUCT_STORE_DIR, QUANTIZATIONS, STRIP_ROWS, TILE_CACHE_DIR
+)
 from src.api_functions import hyp3_login, grab_subscription
 import src.io_tools as io
+from src.mask_client import DEFAULT_URL, submit_mask_job
+from src.http_cache import ResponseCache
+from src.job_journal import JobJournal, job_settings, model_file_digest
+from src.mask_writer import COMPRESSIONS
+from src.product_catalog import ProductCatalog
+from src.product_store import ProductStore
+from src.spatial import minimum_coverage
+from src.subscription_stream import IncrementalRun, sub_pages
+
+from src.metadata_class import populate_cmr_product_shape, Product, triage_products_newest, MaskMetadata
+
+# TensorFlow, Keras and matplotlib are imported by the commands that use them,
+# so that commands like 'create-mask --remote' start without loading them
+
+class BatchSize(click.ParamType):
+    """A positive batch size or 'auto'"""
+    name = "batch_size"
+
+    def convert(self, value, param, ctx):
+        if value == 'auto' or isinstance(value, int):
+            return value
+        try:
+            size = int(value)
+        except ValueError:
+            self.fail(f"{value!r} is not a positive integer or 'auto'", param, ctx)
+        if size < 1:
+            self.fail(f"{value!r} is not a positive integer or 'auto'", param, ctx)
+        return size
+
+
+def mask_options(func):
+    """Options shared by the commands that create masks"""
+    options = [
+        click.option('--strip-rows', type=click.IntRange(min=1), default=STRIP_ROWS, show_default=True,
+                     help="Stream the scene in strips of this many rows of tiles to bound memory use"),
+        click.option('--batch-size', type=BatchSize(), default='auto', show_default=True,
+                     help="Tiles per prediction batch, or 'auto' to fit the batch to the available memory"),
+        click.option('--nodata-fraction', type=click.FloatRange(0, 1, min_open=True), default=1.0,
+                     show_default=True, help="Skip tiles where at least this fraction of pixels is nodata"),
+        click.option('--readers', type=click.IntRange(min=1), default=2, show_default=True,
+                     help="Threads reading strips while the model predicts"),
+        click.option('--queue-depth', type=click.IntRange(min=1), default=2, show_default=True,
+                     help="Strips buffered between the read, predict and write stages"),
+        click.option('--compress', type=click.Choice(COMPRESSIONS), default='DEFLATE', show_default=True,
+                     help="Compression of the written mask"),
+        click.option('--backend', type=click.Choice(['keras', 'tflite']), default='keras', show_default=True,
+                     help="Run the Keras model or its export from 'export-model'"),
+        click.option('--preview-factor', type=click.Choice(['2', '4', '8']),
+                     callback=lambda ctx, param, value: int(value) if value else 1,
+                     help="Quick look: mask the scene downsampled by this factor"),
+        click.option('--tile-cache', is_flag=False, flag_value=str(TILE_CACHE_DIR), metavar='[DIR]',
+                     help=f"Reuse tile predictions from earlier runs, stored in DIR (default {TILE_CACHE_DIR})"),
+        click.option('--tile-cache-gb', 'tile_cache_bytes', type=click.FloatRange(min=0), default=10,
+                     show_default=True, callback=lambda ctx, param, value: int(value * 2**30),
+                     help="Size the tile cache is trimmed to"),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+def download_options(func):
+    """Options shared by the commands that download products"""
+    options = [
+        click.option('--downloads', type=click.IntRange(min=1), default=4, show_default=True,
+                     help="Products downloaded at a time"),
+        click.option('--per-host', type=click.IntRange(min=1), default=4, show_default=True,
+                     help="Downloads at a time from any one host"),
+        click.option('--sar-only', is_flag=True,
+                     help="Fetch only the VV and VH tifs of each product with HTTP range requests"),
+        click.option('--store-gb', 'store_bytes', type=click.FloatRange(min=0), default=200, show_default=True,
+                     callback=lambda ctx, param, value: int(value * 2**30),
+                     help=f"Size the shared product store in {PRODUCT_STORE_DIR} is trimmed to"),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+def masking_settings(model, options):
+    """Job journal settings of masking with model, whose file is digested so
+    that masks made before the model was retrained are made again"""
+    return job_settings(model, options, model_file_digest(model, options['backend']))
+
+
+def selection_settings(date_start, date_end, aoi_poly, min_cover, cover_cell_size):
+    """What decides the products a run over a subscription selects, so its
+    high-water mark is only kept for reruns selecting the same way"""
+    return {
+        'date_start': date_start,
+        'date_end': date_end,
+        'aoi': None if aoi_poly is None else aoi_poly.wkt,
+        'min_cover': min_cover,
+        'cover_cell_size': cover_cell_size if min_cover else None
+    }
+
+
+def select_pages(pages, date_start, date_end, aoi_poly, cache):
+    """Narrows every page of a subscription to the products within the dates
+    and aoi_poly, if given, as it arrives"""
+    for count, catalog in enumerate(pages):
+        # Removes products not in date bounds
+        if date_start and date_end:
+            catalog = catalog.within(date_start, date_end)
+
+        if aoi_poly is not None:
+            catalog.fill_shapes(cache=cache)
+            catalog = catalog.intersecting(aoi_poly)
+
+        print(f"Page {count + 1}: {len(catalog)} new products after checking date and shape bounds")
+        yield catalog
 
-from src.metadata_class import get_sub_products, populate_cmr_product_shape, get_min_granule_coverage, Product, \
-    triage_products_newest, MaskMetadata
-from src.asf_cnn import test_model_masked, train_model
-from src.model.architecture.masked import create_model_masked
-import matplotlib.pyplot as plt
-from src.model import load_model, load_history, path_from_model_name
-from src.model.architecture.masked import create_model_masked
-from src.plots import edit_predictions, plot_predictions, print_summary, view_filters, plot_history
-
-from src.geo_utility import difference, intersection
-from src.hyp3lib_functions import data2geotiff, geotiff2data
-
-from src.prepare_data import make_tiles, prepare_mask_data, groom_imgs, move_imgs
-import src.identify_water as iw
 
 @click.group()
 def cli():
@@ -63,7 +161,8 @@ def setup():
 @cli.command()
 @click.argument('metalink_path')
 @click.argument('output_directory')
-def download_metalink(metalink_path, output_directory):
+@download_options
+def download_metalink(metalink_path, output_directory, downloads, per_host, sar_only, store_bytes):
     """Download files from products.metalink
 
     \b
@@ -80,7 +179,12 @@ def download_metalink(metalink_path, output_directory):
         password = getpass.getpass(prompt="password: ")
         creds = pda.credentials(username, password)
 
-    pda.download_metalink_products(Path(metalink_path), Path(output_directory), creds)
+    engine = pda.DownloadEngine(creds, downloads, per_host, sar_only)
+    store = ProductStore(engine, max_bytes=store_bytes)
+    for product_path in store.export(pda.metalink_product_generator(Path(metalink_path)), Path(output_directory)):
+        print(f"Saved {product_path.name}")
+
+    print(engine.stats)
 
 
 @cli.command()
@@ -90,58 +194,66 @@ def download_metalink(metalink_path, output_directory):
 @click.option('--date-end', type=click.DateTime(formats=["%Y-%m-%d"]))
 @click.option('--aoi', type=click.Path(exists=True, readable=True))
 @click.option('--min-cover', is_flag=True)
+@click.option('--cover-cell-size', type=click.FloatRange(min=0, min_open=True),
+              help="Approximate --min-cover on a grid of cells this many degrees wide, for very large subscriptions")
 @click.option('--display', is_flag=True)
 @click.option('--dry-run', is_flag=True)
 @click.option('--output_dir', type=click.Path(), default=PRODUCTS_DIR)
-def download_sub(name, id, date_start, date_end, aoi, min_cover, display, dry_run, output_dir):
+@click.option('--refresh', is_flag=True, help="Fetch the subscription listing and footprints again instead of using cached ones")
+@click.option('--rescan', is_flag=True, help="Also process the products a previous run into the same directory already did")
+@download_options
+def download_sub(name, id, date_start, date_end, aoi, min_cover, cover_cell_size, display, dry_run, output_dir, refresh,
+                 rescan, downloads, per_host, sar_only, store_bytes):
     """Download Prodcuts from sub"""
 
-    api = hyp3_login()  # login if .netrc not found
+    cache = ResponseCache(refresh=refresh)
+    products_save_dir = Path(output_dir) / name
+    api = None
 
     # Interactively find sub-id if not given already
     if not id:
+        api = hyp3_login()  # login if .netrc not found
         subscription = grab_subscription(api)
         id = subscription['id']
 
-    # Get list of Products objects from subscription
-    products = get_sub_products(api, id)
-
-    # Removes products not in date bounds
-    if date_start and date_end:
-        products = [product for product in products if product.time_bounds(date_start, date_end)]
-
+    # Page through the subscription's products newer than the last run, only logging in when a page is not cached
     aoi_poly = io.polygon_from_shapefile(aoi)
-    if aoi:
-        products_inbounds = []
+    selection = selection_settings(date_start, date_end, aoi_poly if aoi else None, min_cover, cover_cell_size)
+    run = IncrementalRun(products_save_dir, id, rescan, selection)
+    pages = run.track(
+        select_pages(sub_pages(api or hyp3_login, id, run.since, cache=cache), date_start, date_end,
+                     aoi_poly if aoi else None, cache)
+    )
+
+    # Finding the minimum cover or showing the products needs all of them, otherwise they stream in by page
+    if min_cover or display or dry_run:
+        products = ProductCatalog.concatenate(list(pages)).products()
+
+        print("Products after checking shape bounds")
+        print(f"{len(products)} products in list")
+        # for product in products:
+        #     print(product.granule)
+
+        if min_cover:
+            min_products = minimum_coverage(products, aoi_poly, cell_size=cover_cell_size)
+            products = min_products
+
+        print(f"{len(products)} products after getting min cover by aoi")
         for product in products:
-            product.get_shape_cmr()
-            if product.shape is None:
-                continue
-            if product.intersects(aoi_poly):
-                products_inbounds.append(product)
-
-        products = products_inbounds
-
-    print("Products after checking shape bounds")
-    print(f"{len(products)} products in list")
-    # for product in products:
-    #     print(product.granule)
-
-    if min_cover:
-        min_products = get_min_granule_coverage(products, aoi_poly)
-        products = min_products
-
-    print(f"{len(products)} products after getting min cover by aoi")
-    for product in products:
-        print(product.granule)
-
-    if display:
-        x, y = aoi_poly.exterior.xy
-        plt.plot(x, y)
-        for p in products:
-            x, y = p.shape.exterior.xy
+            print(product.granule)
+
+        if display:
+            import matplotlib.pyplot as plt
+            x, y = aoi_poly.exterior.xy
             plt.plot(x, y)
-        plt.show()
+            for p in products:
+                x, y = p.shape.exterior.xy
+                plt.plot(x, y)
+            plt.show()
+
+        product_urls = [product.url for product in products]
+    else:
+        product_urls = (url for catalog in pages for url in catalog.urls)
 
     if not dry_run:
         netrc_path = PROJECT_DIR / '.netrc'
@@ -153,17 +265,17 @@ def download_sub(name, id, date_start, date_end, aoi, min_cover, display, dry_ru
             password = getpass.getpass(prompt="password: ")
             creds = pda.credentials(username, password)
 
-        products_save_dir = Path(output_dir) / name
-        if not products_save_dir.is_dir():
-            products_save_dir.mkdir()
-
-
-        for product in products:
-
-            print(f"Downloading {product.url}")
-            pda.download_product(product.url, products_save_dir, creds)
+        engine = pda.DownloadEngine(creds, downloads, per_host, sar_only)
+        store = ProductStore(engine, max_bytes=store_bytes)
+        for product_path in store.export(product_urls, products_save_dir):
+            print(f"Saved {product_path.name}")
 
-        print("All Products have been downloaded!")
+        print(engine.stats)
+        if engine.stats.failed:
+            print("Some products failed to download, they will be tried again next run")
+        else:
+            run.commit()
+            print("All Products have been downloaded!")
 
 # TODO: create default file name as granule name with _MASK or _mask appended.
 # TODO: make default save directory be the water mask directory
@@ -174,7 +286,10 @@ def download_sub(name, id, date_start, date_end, aoi, min_cover, display, dry_ru
 @click.argument('vh_path')
 @click.argument('outfile')
 @click.option('-v', '--verbose', help="keras verbosity", default=1, type=int)
-def create_mask(model_path, vv_path, vh_path, outfile, verbose):
+@click.option('--remote', metavar='URL', help=f"Submit the job to a running 'serve' daemon, e.g. {DEFAULT_URL}")
+@mask_options
+@click.pass_context
+def create_mask(ctx, model_path, vv_path, vh_path, outfile, verbose, remote, **options):
     """Create a water mask for an image.
     The image must be dual pol (VV + VH) and must be calibrated. ****** NOTE ******
     create_mask.py contains a memory leak. Use a subprocess call when using main in a loop to prevent memory issues.
@@ -185,7 +300,45 @@ def create_mask(model_path, vv_path, vh_path, outfile, verbose):
     VH_PATH    Path to the calibrated VH tiff
     OUTFILE    Name of the generated mask
     """
-    gu.create_water_mask(model_path, vv_path, vh_path, outfile, verbose)
+    if remote:
+        # Options left at their defaults are for the server's own options to decide
+        options = {name: value for name, value in options.items()
+                   if ctx.get_parameter_source(name) is ParameterSource.COMMANDLINE}
+        seconds = submit_mask_job(remote, model_path, vv_path, vh_path, outfile, **options)
+        print(f"Mask {outfile} finished by {remote} in {seconds:.1f}s")
+        return
+
+    import src.geo_utility as gu
+    gu.create_water_mask(model_path, vv_path, vh_path, outfile, verbose, **options)
+
+
+@cli.command()
+@click.option('--host', default='127.0.0.1', show_default=True)
+@click.option('--port', default=8765, show_default=True, type=int)
+@click.option('--allow-remote', is_flag=True,
+              help="Allow a non-loopback --host. Jobs are not authenticated, so anyone who can reach it can mask")
+@click.option('--root', type=click.Path(file_okay=False), default=DATA_DIR, show_default=True,
+              help="Directory job paths are resolved under. Jobs naming files outside it are rejected")
+@click.option('-m', '--model', 'models', multiple=True, help="Model to load at startup. May be repeated")
+@click.option('--max-group', type=click.IntRange(min=1), default=8, show_default=True,
+              help="Queued jobs taken at a time and run one after another ordered by model")
+@mask_options
+def serve(host, port, allow_remote, root, models, max_group, **options):
+    """Run a mask daemon that keeps models warm.
+    Jobs are submitted with 'create-mask --remote URL' or src/mask_client.py.
+    The mask options given here apply to jobs that don't set them"""
+    from src.mask_server import MaskServer, is_loopback
+    if not is_loopback(host):
+        if not allow_remote:
+            raise click.BadParameter(f"{host} is not a loopback address, pass --allow-remote to serve on it",
+                                     param_hint='--host')
+        print(f"WARNING: serving unauthenticated mask jobs on {host}, reading and writing under {root}")
+    server = MaskServer((host, port), models, max_group, root=root, allow_remote=allow_remote, **options)
+    print(f"Serving masks on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
 
 
 # TODO: Create vrt file
@@ -194,9 +347,17 @@ def create_mask(model_path, vv_path, vh_path, outfile, verbose):
 @click.argument('source_dir', type=click.Path())
 @click.argument('output_dir', type=click.Path())
 @click.argument('name', type=str)
-def mask_directory(model, source_dir, output_dir, name):
+@click.option('--workers', type=click.IntRange(min=1), default=1, show_default=True,
+              help="Worker processes masking scenes in parallel, each with its own slice of the cores")
+@click.option('--recycle-after', type=click.IntRange(min=1), default=10, show_default=True,
+              help="Scenes a worker masks before it is replaced, to contain memory leaks")
+@click.option('--restart', is_flag=True, help="Mask every product again instead of resuming from the job journal")
+@mask_options
+def mask_directory(model, source_dir, output_dir, name, workers, recycle_after, restart, **options):
     """Creates mask of all products in given directory.
        Products must be in original zipfile format."""
+    import src.geo_utility as gu
+    from src.mask_workers import mask_products_parallel
 
     product_list = io.list_products(source_dir)
     print(f"{len(product_list)} products in directory")
@@ -205,13 +366,38 @@ def mask_directory(model, source_dir, output_dir, name):
     if not mask_save_directory.is_dir():
         mask_save_directory.mkdir()
 
+    # Reruns skip the products an earlier run finished
+    journal = JobJournal(mask_save_directory, restart, settings=masking_settings(model, options))
+
+    if workers > 1:
+        start = time.perf_counter()
+        masks = mask_products_parallel(
+            model, product_list, mask_save_directory, workers, recycle_after, journal, **options
+        )
+        masked = 0
+        for product_name, seconds in masks:
+            print(f"Mask for {product_name} is finished ({seconds:.1f}s)")
+            masked += 1
+        elapsed = time.perf_counter() - start
+        print(f"{masked} products masked in {elapsed:.1f}s with {workers} workers")
+        print(journal.report())
+        return
+
     for product in product_list:
+        if journal.finished(product.name, product):
+            print(f"Mask for {product.stem} was finished by an earlier run")
+            continue
+
         print(f"Masking {product.name}")
-        with TemporaryDirectory() as tmpdir_name:
-            vv_path, vh_path = io.extract_from_product(product, Path(tmpdir_name))
-            output_file = mask_save_directory / f"{product.stem}.tif"
-            gu.create_water_mask(model, str(vv_path), str(vh_path), str(output_file))
-            print(f"Mask for {product.stem} is finished")
+        journal.downloaded(product.name, product)
+        vv_path, vh_path = io.locate_sar_members(product)
+        output_file = mask_save_directory / f"{product.stem}.tif"
+        gu.create_water_mask(model, vv_path, vh_path, str(output_file), **options)
+        journal.masked(product.name, output_file)
+        journal.verify(product.name)
+        print(f"Mask for {product.stem} is finished")
+
+    print(journal.report())
 
 
 @cli.command()
@@ -219,6 +405,8 @@ def mask_directory(model, source_dir, output_dir, name):
 @click.argument('dataset', type=str)
 @click.option('-e', '--epochs', default=10, type=int)
 def train(model, dataset, epochs):
+    from src.asf_cnn import train_model
+    from src.model.architecture.masked import create_model_masked
     # model_path = path_from_model_name(model)
 
     model = create_model_masked(model)
@@ -226,12 +414,45 @@ def train(model, dataset, epochs):
 
     train_model(model, history, dataset, epochs)
 
+@cli.command()
+@click.argument('model', type=str)
+@click.option('--quantize', type=click.Choice(QUANTIZATIONS), default='int8', show_default=True)
+@click.option('--dataset', help="Masked dataset to calibrate int8 quantization on and to compare the backends with")
+@click.option('--samples', type=click.IntRange(min=1), default=100, show_default=True,
+              help="Training tiles used to calibrate int8 quantization")
+@click.option('--report', is_flag=True, help="Compare accuracy and throughput with the Keras model on the test split")
+def export_model(model, quantize, dataset, samples, report):
+    """Export a model to a TFLite flatbuffer for the tflite backend"""
+    if (quantize == 'int8' or report) and not dataset:
+        raise click.UsageError("--dataset is needed for int8 calibration and --report")
+
+    from src.model.tflite import compare_backends, export_tflite
+
+    tflite_path = export_tflite(model, quantize, dataset, samples)
+    print(f"Exported {model} to {tflite_path}")
+
+    if report:
+        for key, value in compare_backends(model, dataset).items():
+            print(f"{key:>20}: {value:.4f}")
+
+
+@cli.command()
+@click.argument('model', type=str)
+def export_inference(model):
+    """Export a prediction only copy of a model with BatchNorm folded into the
+    convolutions and Dropout removed. Masking commands load it instead of the
+    .h5 while it is newer than the .h5"""
+    from src.model.inference import export_inference_model
+    print(f"Exported {model} to {export_inference_model(model)}")
+
+
 @cli.command()
 @click.argument('vv_image_path', type=str)
 @click.argument('vh_image_path', type=str)
 @click.argument('mask_name', type=str)
 def identify_water(vv_image_path, vh_image_path, mask_name):
     """identify water using numeric method for training"""
+    import src.identify_water as iw
     prod = iw.Product(vv_image_path, vh_image_path)
     iw.show_mask(prod, iw.create_mask(prod.vv_image, prod.vh_image, 0.01))
 
@@ -241,6 +462,8 @@ def identify_water(vv_image_path, vh_image_path, mask_name):
 @click.argument('name', type=str)
 def mask_difference(first_mask, second_mask, name):
     """generate difference mask"""
+    from src.geo_utility import difference, intersection
+    from src.hyp3lib_functions import data2geotiff, geotiff2data
     _, mask1_transform, projection, epsg, data_type, no_data = geotiff2data(first_mask)
     mask1_intersect, mask2_intersect, col, row, bounds = intersection(first_mask, second_mask)
     mask_difference = difference(mask1_intersect, mask2_intersect)
@@ -252,6 +475,7 @@ def mask_difference(first_mask, second_mask, name):
 @click.argument('tile_size', default=512, type=int)
 def tile_image(image, tile_size):
     """tile tif image to tiles of tile_size with padding"""
+    from src.prepare_data import make_tiles
     make_tiles(image, (tile_size, tile_size))
 
 @cli.command()
@@ -259,6 +483,7 @@ def tile_image(image, tile_size):
 @click.argument('holdout', default=0.2, type=float)
 def divide_dataset(directory, holdout):
     """divide dataset into test and train directories based on holdout"""
+    from src.prepare_data import prepare_mask_data
     prepare_mask_data(directory, holdout)
 
 
@@ -267,6 +492,7 @@ def divide_dataset(directory, holdout):
 @click.argument('holdout', default=0.2, type=float)
 def groom_images(directory, holdout):
     """groom images to remove inaccurate masks"""
+    from src.prepare_data import groom_imgs
     groom_imgs(directory)
 
 @cli.command()
@@ -274,6 +500,7 @@ def groom_images(directory, holdout):
 @click.argument('new_directory', type=str)
 def move_images(directory, new_directory):
     """groom images to remove inaccurate masks"""
+    from src.prepare_data import move_imgs
     move_imgs(directory, new_directory)
 
 @cli.command()
@@ -284,62 +511,79 @@ def move_images(directory, new_directory):
 @click.option('--date-end', type=click.DateTime(formats=["%Y-%m-%d"]))
 @click.option('--aoi', type=click.Path(exists=True, readable=True))
 @click.option('--min-cover', is_flag=True)
+@click.option('--cover-cell-size', type=click.FloatRange(min=0, min_open=True),
+              help="Approximate --min-cover on a grid of cells this many degrees wide, for very large subscriptions")
 @click.option('--display', is_flag=True)
 @click.option('--dry-run', is_flag=True)
 @click.option('--output_dir', type=click.Path(), default=MASK_DIR)
-def mask_sub(model, name, id, date_start, date_end, aoi, min_cover, display, dry_run, output_dir):
+@click.option('--refresh', is_flag=True, help="Fetch the subscription listing and footprints again instead of using cached ones")
+@click.option('--rescan', is_flag=True, help="Also process the products a previous run into the same directory already did")
+@download_options
+@click.option('--prefetch', type=click.IntRange(min=1), default=2, show_default=True,
+              help="Products downloaded ahead of the one being masked")
+@click.option('--prefetch-gb', 'prefetch_bytes', type=click.FloatRange(min=0), default=None,
+              callback=lambda ctx, param, value: None if value is None else int(value * 2**30),
+              help="Stop downloading ahead while the products waiting to be masked take up this much disk")
+@click.option('--restart', is_flag=True, help="Mask every product again instead of resuming from the job journal")
+@mask_options
+def mask_sub(model, name, id, date_start, date_end, aoi, min_cover, cover_cell_size, display, dry_run, output_dir,
+             refresh, rescan, downloads, per_host, sar_only, store_bytes, prefetch, prefetch_bytes, restart,
+             **options):
     """Finds list of prodcuts meeting given criteria"""
+    from src.mask_workers import mask_products_pipelined
 
-    api = hyp3_login()  # login if .netrc not found
+    cache = ResponseCache(refresh=refresh)
+    mask_save_directory = Path(output_dir) / name
+    api = None
 
     # Interactively find sub-id if not given already
     if not id:
+        api = hyp3_login()  # login if .netrc not found
         subscription = grab_subscription(api)
         id = subscription['id']
 
-    # Get list of Products objects from subscription
-    products = get_sub_products(api, id)
-
-    # Removes products not in date bounds
-    if date_start and date_end:
-        products = [product for product in products if product.time_bounds(date_start, date_end)]
-
+    # Page through the subscription's products newer than the last run, only logging in when a page is not cached
     aoi_poly = io.polygon_from_shapefile(aoi)
+    selection = selection_settings(date_start, date_end, aoi_poly if aoi else None, min_cover, cover_cell_size)
+    run = IncrementalRun(mask_save_directory, id, rescan, selection)
     # print(f"aoi_poly={aoi_poly}")
-    if aoi:
-        products_inbounds = []
+    pages = run.track(
+        select_pages(sub_pages(api or hyp3_login, id, run.since, cache=cache), date_start, date_end,
+                     aoi_poly if aoi else None, cache)
+    )
+
+    # Finding the minimum cover or showing the products needs all of them, otherwise they stream in by page
+    if min_cover or display or dry_run:
+        products = ProductCatalog.concatenate(list(pages)).products()
+
+        print("Products after checking shape bounds")
+        print(f"{len(products)} products in list")
+        # for product in products:
+        #     print(product.granule)
+
+        if min_cover:
+            min_products = minimum_coverage(products, aoi_poly, cell_size=cover_cell_size)
+            products = min_products
+
+        print(f"{len(products)} products after getting min cover by aoi")
         for product in products:
-            product.get_shape_cmr()
-            if product.shape is None:
-                continue
-            if product.intersects(aoi_poly):
-                products_inbounds.append(product)
-
-        products = products_inbounds
-
-    print("Products after checking shape bounds")
-    print(f"{len(products)} products in list")
-    # for product in products:
-    #     print(product.granule)
-
-    if min_cover:
-        min_products = get_min_granule_coverage(products, aoi_poly)
-        products = min_products
-
-    print(f"{len(products)} products after getting min cover by aoi")
-    for product in products:
-        print(product.granule)
-
-    if display:
-        x, y = aoi_poly.exterior.xy
-        plt.plot(x, y)
-        for p in products:
-            x, y = p.shape.exterior.xy
+            print(product.granule)
+
+        if display:
+            import matplotlib.pyplot as plt
+            x, y = aoi_poly.exterior.xy
             plt.plot(x, y)
-        plt.show()
+            for p in products:
+                x, y = p.shape.exterior.xy
+                plt.plot(x, y)
+            plt.show()
+
+        metadata = MaskMetadata(name=name, model=model, aoi=aoi_poly, start=date_start, end=date_end, products=products)
+        # print(metadata.to_json())
 
-    metadata = MaskMetadata(name=name, model=model, aoi=aoi_poly, start=date_start, end=date_end, products=products)
-    # print(metadata.to_json())
+        product_urls = [product.url for product in products]
+    else:
+        product_urls = (url for catalog in pages for url in catalog.urls)
 
     if not dry_run:
         netrc_path = PROJECT_DIR / '.netrc'
@@ -351,7 +595,6 @@ def mask_sub(model, name, id, date_start, date_end, aoi, min_cover, display, dry
             password = getpass.getpass(prompt="password: ")
             creds = pda.credentials(username, password)
 
-        mask_save_directory = Path(output_dir) / name
         if not mask_save_directory.is_dir():
             mask_save_directory.mkdir()
 
@@ -368,25 +611,20 @@ def mask_sub(model, name, id, date_start, date_end, aoi, min_cover, display, dry
         #         gu.create_water_mask(model, str(vv_path), str(vh_path), str(output_file))
         #         print(f"Mask for {product_path.stem} is finished")
 
-        for product in products:
-            with TemporaryDirectory() as tmpdir_name:
-                temp_product_dir = Path(tmpdir_name)
-
-                print(f"Downloading {product.url}")
-                pda.download_product(product.url, temp_product_dir, creds)
-                product_path = temp_product_dir / product.name
-
-                print(f"Product_path = {str(product_path)}")
-
-                vv_path, vh_path = io.extract_from_product(product_path, temp_product_dir)
-
-                output_file = mask_save_directory / f"{product_path.stem}.tif"
-                print(f"output_file = {str(output_file)}")
-
-                print(f"Creating mask {product_path.stem}")
-                gu.create_water_mask(model, str(vv_path), str(vh_path), str(output_file))
-                print(f"Mask for {product_path.stem} is finished")
-
+        # Reruns skip the products an earlier run finished without downloading them again
+        journal = JobJournal(mask_save_directory, restart, settings=masking_settings(model, options))
+        store = ProductStore(pda.DownloadEngine(creds, downloads, per_host, sar_only), max_bytes=store_bytes)
+        stats = mask_products_pipelined(
+            model, store, product_urls, mask_save_directory, prefetch, prefetch_bytes, journal, **options
+        )
+        for stage in stats:
+            print(stage)
+        print(journal.report())
+
+        if store.engine.stats.failed:
+            print("Some products failed to download, they will be tried again next run")
+        else:
+            run.commit()
         print(f"Mask {name} is finished")
 
 
@@ -401,18 +639,22 @@ def mask_sub(model, name, id, date_start, date_end, aoi, min_cover, display, dry
 
 def model_history(model):
     """groom images to remove inaccurate masks"""
+    from src.model import load_history
+    from src.plots import plot_history
     plot_history(model, load_history(model))
 
 @cli.command()
 @click.argument('model', type=str)
 def model_filters(model):
     """groom images to remove inaccurate masks"""
+    from src.plots import view_filters
     view_filters(model)
 
 @cli.command()
 @click.argument('model', type=str)
 def model_summary(model):
     """groom images to remove inaccurate masks"""
+    from src.plots import print_summary
     print_summary(model)
 
 
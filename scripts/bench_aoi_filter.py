@@ -0,0 +1,70 @@
+"""
+Compare filtering product footprints by AOI one Product.intersects call at a
+time with the STRtree query in src/spatial.py, over synthetic footprints and a
+complex AOI.
+
+    '$ python3 scripts/bench_aoi_filter.py --products 1000 10000 --vertices 5000'
+"""
+
+import math
+import os
+import random
+import sys
+import time
+from argparse import ArgumentParser
+
+from shapely.geometry import Polygon
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.metadata_class import Product  # noqa: E402
+from src.spatial import products_intersecting  # noqa: E402
+
+GRANULE = 'S1A_IW_GRDH_1SDV_20200624T224520_20200624T224545_033165_03D795_F52E'
+
+
+def synthetic_products(n: int, rng: random.Random) -> list:
+    """Sentinel-1 frame sized, slightly rotated footprints over a 60 by 40
+    degree region."""
+    products = []
+    for i in range(n):
+        x, y = rng.uniform(60, 120), rng.uniform(-10, 30)
+        skew = rng.uniform(-0.3, 0.3)
+        product = Product(name=f"{i}.zip", granule=GRANULE)
+        product.shape = Polygon([(x, y), (x + 2.5, y + skew), (x + 2.5 + skew, y + 2 + skew), (x + skew, y + 2)])
+        products.append(product)
+    return products
+
+
+def complex_aoi(vertices: int, rng: random.Random) -> Polygon:
+    """A star shaped polygon with a ragged, shapefile like boundary."""
+    points = []
+    for i in range(vertices):
+        angle = 2 * math.pi * i / vertices
+        radius = 15 * (1 + 0.3 * math.sin(7 * angle)) * rng.uniform(0.95, 1.05)
+        points.append((90 + radius * math.cos(angle), 10 + radius * math.sin(angle)))
+    return Polygon(points).buffer(0)
+
+
+if __name__ == '__main__':
+    p = ArgumentParser()
+    p.add_argument('--products', '-n', type=int, nargs='+', default=[1000, 10000])
+    p.add_argument('--vertices', type=int, default=5000, help="Vertices of the AOI boundary")
+    args = p.parse_args()
+
+    rng = random.Random(0)
+    aoi = complex_aoi(args.vertices, rng)
+    for n in args.products:
+        products = synthetic_products(n, rng)
+
+        start = time.perf_counter()
+        looped = [product for product in products if product.intersects(aoi)]
+        loop_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        indexed = products_intersecting(products, aoi)
+        index_seconds = time.perf_counter() - start
+
+        assert indexed == looped
+        print(f"{n:>7} products, {len(indexed)} in aoi: loop {loop_seconds:.3f}s, "
+              f"STRtree {index_seconds:.3f}s ({loop_seconds / index_seconds:.1f}x)")
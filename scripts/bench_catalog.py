@@ -0,0 +1,74 @@
+"""
+Compare filtering and sorting a large subscription listing as Product objects
+with doing it in a ProductCatalog, timing them and measuring the memory the result holds and the peak used.
+
+    '$ python3 scripts/bench_catalog.py --products 10000 50000'
+"""
+
+import os
+import random
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.metadata_class import Product, triage_products_newest  # noqa: E402
+from src.product_catalog import ProductCatalog  # noqa: E402
+
+
+def synthetic_listing(n: int, rng: random.Random) -> list:
+    """Subscription listing entries over two years of acquisitions."""
+    listing = []
+    for i in range(n):
+        start = datetime(2019, 1, 1) + timedelta(seconds=rng.randrange(2 * 365 * 86400))
+        end = start + timedelta(seconds=25)
+        granule = f"S1A_IW_GRDH_1SDV_{start:%Y%m%dT%H%M%S}_{end:%Y%m%dT%H%M%S}_{i:06d}_03D795_F52E"
+        name = f"S1A_IW_{start:%Y%m%dT%H%M%S}_DVP_RTC30_G_gpuned_{i:04X}.zip"
+        listing.append({'name': name, 'granule': granule, 'url': f"https://hyp3-download.asf.alaska.edu/asf/data/{name}"})
+    return listing
+
+
+def with_products(listing, start, end) -> list:
+    products = [Product(entry['name'], entry['granule'], entry['url']) for entry in listing]
+    products = [product for product in products if product.time_bounds(start, end)]
+    return triage_products_newest(products)
+
+
+def with_catalog(listing, start, end) -> ProductCatalog:
+    return ProductCatalog.from_listing(listing).within(start, end).sorted_by_start()
+
+
+def measure(func, *args):
+    """Returns the result, the seconds taken, and the MiB held by the result
+    and at the peak, measured in a second, traced run."""
+    begin = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - begin
+    del result
+
+    tracemalloc.start()
+    result = func(*args)
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, held / 2**20, peak / 2**20
+
+
+if __name__ == '__main__':
+    p = ArgumentParser()
+    p.add_argument('--products', '-n', type=int, nargs='+', default=[10000, 50000])
+    args = p.parse_args()
+
+    start, end = datetime(2019, 6, 1), datetime(2020, 6, 1)
+    for n in args.products:
+        listing = synthetic_listing(n, random.Random(n))
+
+        products, *product_measures = measure(with_products, listing, start, end)
+        catalog, *catalog_measures = measure(with_catalog, listing, start, end)
+        assert [product.name for product in products] == list(catalog.names)
+
+        print(f"{n:>7} products, {len(catalog)} in window")
+        for name, (seconds, held, peak) in (('Product objects', product_measures), ('ProductCatalog', catalog_measures)):
+            print(f"  {name:>15}: {seconds:.3f}s, {held:.1f} MiB held, {peak:.1f} MiB peak")
@@ -0,0 +1,34 @@
+"""
+Compare looking up product footprints one granule per request with batched
+lookups, against a local stand in for CMR with a simulated round trip latency.
+
+    '$ python3 scripts/bench_cmr_footprints.py --products 300 --latency 0.05'
+"""
+
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.metadata_class import Product, get_shapes_cmr  # noqa: E402
+from tests.cmr_stub import StubCMRServer, random_granules  # noqa: E402
+
+if __name__ == '__main__':
+    p = ArgumentParser()
+    p.add_argument('--products', '-n', type=int, default=300)
+    p.add_argument('--latency', type=float, default=0.05, help="Seconds added to every request")
+    p.add_argument('--batch-size', type=int, default=100)
+    args = p.parse_args()
+
+    with StubCMRServer(random_granules(args.products), args.latency) as server:
+        for name, batch_size in (('per granule', 1), ('batched', args.batch_size)):
+            products = [Product(name=f"{granule}.zip", granule=granule) for granule in server.granules]
+            server.requests = 0
+            start = time.perf_counter()
+            get_shapes_cmr(products, batch_size=batch_size, url=server.url)
+            seconds = time.perf_counter() - start
+
+            assert all(product.shape is not None for product in products)
+            print(f"{name:>12}: {server.requests} requests, {seconds:.2f}s")
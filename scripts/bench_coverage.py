@@ -0,0 +1,56 @@
+"""
+Compare get_min_granule_coverage with the exact and grid modes of
+spatial.minimum_coverage on synthetic footprints and a complex AOI, checking
+that the exact mode covers the same area with a subset of its products.
+
+    '$ python3 scripts/bench_coverage.py --products 200 800 --cell-size 0.05'
+"""
+
+import os
+import random
+import sys
+import time
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+
+from shapely.ops import unary_union
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from bench_aoi_filter import complex_aoi, synthetic_products  # noqa: E402
+from src.metadata_class import get_min_granule_coverage  # noqa: E402
+from src.spatial import minimum_coverage  # noqa: E402
+
+
+def uncovered(products, aoi) -> float:
+    return aoi.difference(unary_union([product.shape for product in products])).area / aoi.area
+
+
+if __name__ == '__main__':
+    p = ArgumentParser()
+    p.add_argument('--products', '-n', type=int, nargs='+', default=[200, 800])
+    p.add_argument('--vertices', type=int, default=2000, help="Vertices of the AOI boundary")
+    p.add_argument('--cell-size', type=float, default=0.05, help="Cell size of the grid mode, in degrees")
+    args = p.parse_args()
+
+    for n in args.products:
+        rng = random.Random(n)
+        aoi = complex_aoi(args.vertices, rng)
+        products = synthetic_products(n, rng)
+        for product in products:
+            product.start = datetime(2020, 1, 1) + timedelta(hours=rng.randrange(10000))
+
+        results = {}
+        for name, cover in (
+            ('greedy loop', lambda: get_min_granule_coverage(products, aoi)),
+            ('exact', lambda: minimum_coverage(products, aoi)),
+            ('grid', lambda: minimum_coverage(products, aoi, cell_size=args.cell_size)),
+        ):
+            start = time.perf_counter()
+            results[name] = cover()
+            seconds = time.perf_counter() - start
+            print(f"{n:>6} products, {name:>11}: {len(results[name]):>4} selected, "
+                  f"{uncovered(results[name], aoi):.2%} uncovered, {seconds:.2f}s")
+
+        assert set(map(id, results['exact'])) <= set(map(id, results['greedy loop']))
+        assert abs(uncovered(results['exact'], aoi) - uncovered(results['greedy loop'], aoi)) < 1e-9
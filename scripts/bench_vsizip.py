@@ -0,0 +1,91 @@
+"""
+Compare reading a product's VV/VH tifs after extracting them to a temporary
+directory with reading them in place through GDAL's /vsizip/ file system.
+
+    '$ python3 scripts/bench_vsizip.py --size 4096 --repeat 3'
+
+A synthetic product zip is written to a temporary directory. Both paths read
+the bands in strips the way create_water_mask does.
+"""
+
+import os
+import sys
+import time
+import zipfile
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import numpy as np
+from osgeo import gdal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.io_tools import extract_from_product, locate_sar_members  # noqa: E402
+
+PRODUCT = 'S1A_IW_20200101T000000_DVP_RTC30_G_gpuned_0000'
+
+
+def synthetic_product(directory: Path, size: int) -> Path:
+    """Writes a product zip holding float32 VV and VH tifs, plus the other
+    files that come with a product."""
+    product_dir = directory / PRODUCT
+    product_dir.mkdir()
+    driver = gdal.GetDriverByName('GTiff')
+    rng = np.random.default_rng(0)
+    for band in ('VV', 'VH'):
+        dataset = driver.Create(str(product_dir / f"{PRODUCT}_{band}.tif"), size, size, 1, gdal.GDT_Float32)
+        dataset.GetRasterBand(1).WriteArray(rng.random((size, size), dtype=np.float32))
+        dataset = None
+    (product_dir / f"{PRODUCT}.README.md.txt").write_text('synthetic product\n')
+
+    zip_path = directory / f"{PRODUCT}.zip"
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for path in product_dir.iterdir():
+            zf.write(path, f"{PRODUCT}/{path.name}")
+            path.unlink()
+    product_dir.rmdir()
+
+    return zip_path
+
+
+def read_strips(path: str, strip_rows: int = 512) -> None:
+    dataset = gdal.Open(path)
+    band = dataset.GetRasterBand(1)
+    for yoff in range(0, dataset.RasterYSize, strip_rows):
+        band.ReadAsArray(0, yoff, dataset.RasterXSize, min(strip_rows, dataset.RasterYSize - yoff))
+
+
+def extracted(zip_path: Path) -> int:
+    """Returns the number of bytes written to disk."""
+    with TemporaryDirectory() as tmpdir_name:
+        vv_path, vh_path = extract_from_product(zip_path, Path(tmpdir_name))
+        read_strips(str(vv_path))
+        read_strips(str(vh_path))
+        return vv_path.stat().st_size + vh_path.stat().st_size
+
+
+def in_place(zip_path: Path) -> int:
+    vv_path, vh_path = locate_sar_members(zip_path)
+    read_strips(vv_path)
+    read_strips(vh_path)
+    return 0
+
+
+if __name__ == '__main__':
+    p = ArgumentParser()
+    p.add_argument('--size', type=int, default=4096, help="Width and height of the synthetic bands")
+    p.add_argument('--repeat', type=int, default=3)
+    args = p.parse_args()
+
+    with TemporaryDirectory() as tmpdir_name:
+        zip_path = synthetic_product(Path(tmpdir_name), args.size)
+        print(f"Product zip: {zip_path.stat().st_size / 2**20:.1f} MiB")
+
+        for name, func in (('extract', extracted), ('vsizip', in_place)):
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                written = func(zip_path)
+                times.append(time.perf_counter() - start)
+            print(f"{name:>8}: best {min(times):.2f}s, {written / 2**20:.1f} MiB written to temp files")
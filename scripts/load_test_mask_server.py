@@ -0,0 +1,51 @@
+"""
+Load test a running mask server.
+
+    '$ python3 aiwater.py serve -m example_net'
+    '$ python3 scripts/load_test_mask_server.py example_net vv.tif vh.tif --jobs 20 --concurrency 4'
+
+Every job masks the same scene into its own output file. Paths are resolved
+under the server's --root, and the masks are left in --output-dir there.
+"""
+
+import os
+import statistics
+import sys
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.mask_client import DEFAULT_URL, server_status, submit_mask_job  # noqa: E402
+
+if __name__ == '__main__':
+    p = ArgumentParser()
+    p.add_argument('model')
+    p.add_argument('vv_path')
+    p.add_argument('vh_path')
+    p.add_argument('--url', default=DEFAULT_URL)
+    p.add_argument('--output-dir', default='.', help="Existing directory under the server's root for the masks")
+    p.add_argument('--jobs', '-n', type=int, default=10)
+    p.add_argument('--concurrency', '-c', type=int, default=2)
+    args = p.parse_args()
+
+    def run(i: int) -> float:
+        start = time.perf_counter()
+        submit_mask_job(
+            args.url, args.model, args.vv_path, args.vh_path,
+            os.path.join(args.output_dir, f"load_test_mask_{i}.tif")
+        )
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        latencies = sorted(pool.map(run, range(args.jobs)))
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.jobs} jobs in {elapsed:.1f}s ({args.jobs / elapsed:.2f} jobs/sec)")
+    print(
+        f"latency: median {statistics.median(latencies):.1f}s, "
+        f"p95 {latencies[int(0.95 * (len(latencies) - 1))]:.1f}s, max {latencies[-1]:.1f}s"
+    )
+    print(f"server: {server_status(args.url)}")
@@ -7,8 +7,7 @@
 
 import os
 from getpass import getpass
-from subprocess import PIPE, call
-from typing import Dict, List
+from typing import Dict
 
 from asf_hyp3 import API, LoginError
 
@@ -94,21 +93,3 @@ def make_dir(dir: str) -> str:
         os.mkdir(dir)
     return dir
 
-
-def download_products(products: List, i: int, product) -> None:
-    """ download_products takes in a list of products, an index (i),
-        and an individual product. The function uses the product variable to
-        download the zip file. The function uses the list and index to display
-        how many products have finished. """
-
-    print(f'Downloading {i+1} granule of {len(products)}')
-
-    # TODO: duplicate to get_netrc_credentials in product_download_api.py
-    with open('.netrc', 'r') as f:
-        contents = f.read()
-    username = contents.split(' ')[3]
-    password = contents.split(' ')[5].split('\n')[0]
-    args = ['wget', '-c', '-q', '--show-progress', f"--http-user={username}", f"--http-password={password}", product['url']]
-    call(args, stdout=PIPE)
-
-
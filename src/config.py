@@ -35,12 +35,15 @@ DATA_DIR = PROJECT_DIR / "data"
 # Input data subdirectory path configs
 INPUT_DIR = DATA_DIR / "input"
 PRODUCTS_DIR = INPUT_DIR / "products"
+PRODUCT_STORE_DIR = PRODUCTS_DIR / "store"
 AOI_DIR = INPUT_DIR / "aoi"
 
 # TODO: test directory?
 # Working data subdirectory path configs
 WORKING_DIR = DATA_DIR / "working"
 DATASETS_DIR = WORKING_DIR / "datasets"
+TILE_CACHE_DIR = WORKING_DIR / "tile_cache"
+HTTP_CACHE_PATH = WORKING_DIR / "http_cache.sqlite"
 
 # Output data subdirectory path configs
 OUTPUT_DIR = DATA_DIR / "output"
@@ -50,6 +53,12 @@ TENSORBOARD_DIR = OUTPUT_DIR / "tensorboard"
 
 NETWORK_DEMS = 512
 
+# Rows of tiles masked at a time, so scenes are streamed rather than read whole
+STRIP_ROWS = 4
+
+# Quantizations a model can be exported to TFLite with
+QUANTIZATIONS = ('int8', 'float16', 'none')
+
 VH_REGEX = re.compile(r'(.*)_([0-9]+).vh.tif')
 VV_REGEX = re.compile(r'(.*)_([0-9]+).vv.tif')
 ZIP_REGEX = re.compile(r'S1(A|B)_IW(.*)-rtc-gamma\.zip')
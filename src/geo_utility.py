@@ -6,9 +6,18 @@
 
 import os
 import itertools
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple, Union
+from keras.models import Model
 from osgeo import gdal
-from src.model import load_model
-from src.config import NETWORK_DEMS as dems
+from src.gdal_wrapper import gdal_open
+from src.model import activation_bytes, get_model, model_digest
+from src.mask_writer import MaskWriter
+from src.pipeline import run_pipeline
+from src.tile_cache import DEFAULT_CACHE_BYTES, TileCache, get_tile_cache
+from src.config import NETWORK_DEMS as dems, STRIP_ROWS
 import numpy as np
 
 from src.hyp3lib_functions import overlap_indices, geotiff_overlap
@@ -62,20 +71,6 @@ def get_tile_dimensions(height: int, width: int, tile_size: int):
     return int(np.ceil(height / tile_size)), int(np.ceil(width / tile_size))
 
 
-def write_mask_to_file(
-        mask: np.ndarray, file_name: str, projection: str, geo_transform: str
-) -> None:
-    (width, height) = mask.shape
-    out_image = gdal.GetDriverByName('GTiff').Create(
-        file_name, height, width, bands=1
-    )
-    out_image.SetProjection(projection)
-    out_image.SetGeoTransform(geo_transform)
-    out_image.GetRasterBand(1).WriteArray(mask)
-    out_image.GetRasterBand(1).SetNoDataValue(0)
-    out_image.FlushCache()
-
-
 def pad_image(image: np.ndarray, to: int) -> np.ndarray:
     height, width = image.shape
 
@@ -88,52 +83,238 @@ def pad_image(image: np.ndarray, to: int) -> np.ndarray:
     return padded
 
 
-# TODO: Cut edge fill on final mask (make it more pretty!)
-# TODO: SHould use pathlib as inputs
-def create_water_mask(
-        model_path: str, vv_path: str, vh_path: str, outfile: str, verbose: int = 0
-):
-    if not os.path.isfile(vv_path):
-        raise FileNotFoundError(f"Tiff '{vv_path}' does not exist")
-
-    if not os.path.isfile(vh_path):
-        raise FileNotFoundError(f"Tiff '{vh_path}' does not exist")
-
-    def get_tiles(img_path):
-        f = gdal.Open(img_path)
-        img_array = f.ReadAsArray()
-        original_shape = img_array.shape
-        n_rows, n_cols = get_tile_dimensions(*original_shape, tile_size=dems)
-        padded_img_array = pad_image(img_array, dems)
-        invalid_pixels = np.nonzero(padded_img_array == 0.0)
-        img_tiles = stride_tile_image(padded_img_array)
-        return img_tiles, n_rows, n_cols, invalid_pixels, f.GetProjection(), f.GetGeoTransform()
+def scene_exists(path: str) -> bool:
+    """Whether path is a file, or a file inside a GDAL virtual file system such
+    as /vsizip/."""
+    if path.startswith('/vsi'):
+        return gdal.VSIStatL(path) is not None
+    return os.path.isfile(path)
+
+
+def open_scene(path: str, preview_factor: int = 1) -> gdal.Dataset:
+    """Opens a band of a scene. With a preview_factor above 1 the scene is
+    opened as an in-memory VRT decimated by that factor, which GDAL reads from
+    the overviews when the file has them. The geo transform is scaled to
+    match, so masks predicted from it stay georeferenced."""
+    if preview_factor == 1:
+        with gdal_open(path) as f:
+            return f
+
+    with gdal_open(path) as f:
+        width, height = f.RasterXSize, f.RasterYSize
+    return gdal.Translate(
+        '', path, format='VRT', resampleAlg='average', noData=0,
+        width=int(np.ceil(width / preview_factor)), height=int(np.ceil(height / preview_factor))
+    )
 
-    # Get vv tiles
-    vv_tiles, vv_rows, vv_cols, vv_pixels, vv_projection, vv_transform = get_tiles(vv_path)
 
-    # Get vh tiles
-    vh_tiles, vh_rows, vh_cols, vh_pixels, vh_projection, vh_transform = get_tiles(vh_path)
+def read_padded_strip(
+        dataset: gdal.Dataset, yoff: int, n_tile_rows: int, tile_size: int = dems
+) -> np.ndarray:
+    """Reads a strip of n_tile_rows rows of tiles starting at pixel row yoff
+    with a windowed read, then pads it so that it is evenly tileable."""
+    ysize = min(n_tile_rows * tile_size, dataset.RasterYSize - yoff)
+    strip = dataset.GetRasterBand(1).ReadAsArray(0, yoff, dataset.RasterXSize, ysize)
+    return pad_image(strip, tile_size)
+
+
+def available_memory() -> int:
+    """Returns the number of bytes of memory available for new allocations."""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except FileNotFoundError:
+        pass
+    return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
+
+def auto_batch_size(model, max_tiles: int, memory_fraction: float = 0.5) -> int:
+    """Picks the largest batch size whose activations fit in memory_fraction of
+    the available memory, capped at max_tiles."""
+    budget = available_memory() * memory_fraction
+    return int(max(1, min(max_tiles, budget // activation_bytes(model))))
+
+
+@dataclass
+class MaskStats:
+    """Counters collected while masking a scene."""
+    tiles: int = 0
+    skipped: int = 0
+    cached: int = 0
+    predict_time: float = 0.0
+
+    def report(self, batch_size) -> str:
+        return (
+            f"Predicted {self.tiles - self.skipped - self.cached} of {self.tiles} tiles "
+            f"({self.skipped} nodata tiles skipped, {self.cached} from cache) in {self.predict_time:.2f}s "
+            f"({self.tiles / max(self.predict_time, 1e-9):.1f} tiles/sec, batch size {batch_size})"
+        )
+
+
+def nodata_tiles(vv_tiles: np.ndarray, nodata_fraction: float = 1.0) -> np.ndarray:
+    """Returns a boolean array marking the tiles where at least nodata_fraction
+    of the VV pixels are nodata (0)."""
+    tile_pixels = vv_tiles.shape[1] * vv_tiles.shape[2]
+    return np.count_nonzero(vv_tiles == 0.0, axis=(1, 2)) >= nodata_fraction * tile_pixels
+
+
+def predict_strip(
+        model, vv_strip: np.ndarray, vh_strip: np.ndarray, verbose: int = 0, tile_size: int = dems,
+        batch_size: int = 1, nodata_fraction: float = 1.0, stats: Optional[MaskStats] = None,
+        cache: Optional[TileCache] = None, digest: str = ''
+) -> np.ndarray:
+    """Predicts the mask of a padded strip. Pixels without VV data are set to 0.
+    Tiles that are at least nodata_fraction nodata are never sent to the model
+    and are written as nodata. With a cache, tiles predicted before by the model
+    with the given weights digest are served from it."""
+    n_rows, n_cols = get_tile_dimensions(*vv_strip.shape, tile_size)
+    vv_tiles = stride_tile_image(vv_strip, tile_size, tile_size)
+    vh_tiles = stride_tile_image(vh_strip, tile_size, tile_size)
+
+    start = time.perf_counter()
+    skipped = nodata_tiles(vv_tiles, nodata_fraction)
+    predict = ~skipped
+    masks = np.zeros((n_rows * n_cols, tile_size, tile_size, 1), dtype=np.float32)
+
+    keys = {}
+    if cache is not None:
+        for i in np.flatnonzero(predict):
+            keys[i] = cache.key(digest, vv_tiles[i], vh_tiles[i])
+            cached = cache.get(keys[i], (tile_size, tile_size))
+            if cached is not None:
+                masks[i, ..., 0] = cached
+                predict[i] = False
+
+    if predict.any():
+        masks[predict] = model.predict(
+            np.stack((vv_tiles[predict], vh_tiles[predict]), axis=3), batch_size=batch_size, verbose=verbose
+        )
 
-    model = load_model(model_path)
+    masks.round(decimals=0, out=masks)
 
-    # Predict masks
-    masks = model.predict(
-        np.stack((vv_tiles, vh_tiles), axis=3), batch_size=1, verbose=verbose
-    )
+    if cache is not None:
+        for i in np.flatnonzero(predict):
+            cache.put(keys[i], masks[i, ..., 0])
 
-    masks.round(decimals=0, out=masks)
+    if stats is not None:
+        stats.tiles += len(skipped)
+        stats.skipped += int(np.count_nonzero(skipped))
+        stats.cached += len(keys) - int(np.count_nonzero(predict))
+        stats.predict_time += time.perf_counter() - start
 
     # Stitch masks together
-    mask = masks.reshape((vv_rows, vv_cols, dems, dems)) \
+    mask = masks.reshape((n_rows, n_cols, tile_size, tile_size)) \
         .swapaxes(1, 2) \
-        .reshape(vv_rows * dems, vv_cols * dems)  # yapf: disable
+        .reshape(n_rows * tile_size, n_cols * tile_size)  # yapf: disable
+
+    mask[vv_strip == 0.0] = 0
+    return mask
+
+
+# TODO: Cut edge fill on final mask (make it more pretty!)
+# TODO: SHould use pathlib as inputs
+def create_water_mask(
+        model: Union[str, Model], vv_path: str, vh_path: str, outfile: str, verbose: int = 0,
+        strip_rows: Optional[int] = STRIP_ROWS, batch_size: Union[int, str] = 1,
+        nodata_fraction: float = 1.0, readers: int = 2, queue_depth: int = 2,
+        compress: str = 'DEFLATE', backend: str = 'keras', preview_factor: int = 1,
+        tile_cache: Optional[str] = None, tile_cache_bytes: int = DEFAULT_CACHE_BYTES,
+        threads: Optional[int] = None
+):
+    """Predicts a water mask for a dual pol scene and writes it to outfile.
+    model is either a loaded model or the name of one, which is loaded through
+    the process wide model cache so batch runs only load it once. With the
+    'tflite' backend a named model is run from its exported .tflite file.
+
+    The scene is processed in strips of strip_rows rows of tiles. Each strip is
+    read with a windowed read, predicted and written to outfile, so peak memory
+    is bounded by the strip height instead of the scene size. The last strip
+    is shorter when the tile rows don't divide by strip_rows. When strip_rows
+    is None the whole scene is a single strip.
+
+    The mask is a tiled uint8 GeoTIFF compressed with compress.
+
+    Reading, prediction and writing overlap: strips are read by a pool of
+    readers threads and written by a writer thread while the model predicts,
+    with at most queue_depth strips waiting between stages.
+
+    A preview_factor above 1 masks the scene decimated by that factor for a
+    quick low resolution look.
+
+    Tiles are predicted batch_size at a time. A batch_size of 'auto' uses the
+    largest batch whose activations fit in the available memory. Tiles where at
+    least nodata_fraction of the pixels are blackfill are skipped and written
+    as nodata.
+
+    tile_cache is a directory of previously predicted tiles. Tiles whose inputs
+    and model weights are unchanged are read from it instead of predicted, and
+    the least recently used are evicted beyond tile_cache_bytes.
+
+    threads caps the threads a named tflite model and the mask compression
+    run on, so that parallel workers keep to their own cores. None uses all
+    of them."""
+    if not scene_exists(vv_path):
+        raise FileNotFoundError(f"Tiff '{vv_path}' does not exist")
+
+    if not scene_exists(vh_path):
+        raise FileNotFoundError(f"Tiff '{vh_path}' does not exist")
 
-    mask[vv_pixels] = 0
-    write_mask_to_file(mask, outfile, vv_projection, vv_transform)
+    model = get_model(model, backend, threads)
+    stats = MaskStats()
+    cache = get_tile_cache(tile_cache, tile_cache_bytes) if tile_cache else None
+    digest = model_digest(model) if cache else ''
+
+    vv_f = open_scene(vv_path, preview_factor)
+    n_rows, n_cols = get_tile_dimensions(vv_f.RasterYSize, vv_f.RasterXSize, dems)
+    projection, geo_transform = vv_f.GetProjection(), vv_f.GetGeoTransform()
+    vv_f = None
+
+    strip_rows = strip_rows or n_rows
+    if batch_size == 'auto':
+        batch_size = auto_batch_size(model, strip_rows * n_cols)
+
+    # GDAL datasets must not be shared between threads, so every reader opens its own
+    local = threading.local()
+
+    def read(first_row: int) -> Tuple[int, np.ndarray, np.ndarray]:
+        if not hasattr(local, 'vv_f'):
+            local.vv_f = open_scene(vv_path, preview_factor)
+            local.vh_f = open_scene(vh_path, preview_factor)
+        yoff = first_row * dems
+        strip_height = min(strip_rows, n_rows - first_row)
+        return (
+            yoff, read_padded_strip(local.vv_f, yoff, strip_height),
+            read_padded_strip(local.vh_f, yoff, strip_height)
+        )
+
+    def predict(strip: Tuple[int, np.ndarray, np.ndarray]) -> Tuple[int, np.ndarray]:
+        yoff, vv_strip, vh_strip = strip
+        mask = predict_strip(
+            model, vv_strip, vh_strip, verbose, batch_size=batch_size,
+            nodata_fraction=nodata_fraction, stats=stats, cache=cache, digest=digest
+        )
+        return yoff, mask
+
+    with MaskWriter(
+        outfile, n_cols * dems, n_rows * dems, projection, geo_transform, nodata=0, compress=compress,
+        threads=threads
+    ) as writer:
+
+        def write(strip: Tuple[int, np.ndarray]) -> None:
+            yoff, mask = strip
+            writer.write_block(mask, 0, yoff)
+
+        stage_stats = run_pipeline(
+            range(0, n_rows, strip_rows), read, predict, write, readers=readers, queue_depth=queue_depth
+        )
+
+    print(stats.report(batch_size))
+    if cache:
+        print(cache.report())
+    print(" | ".join(str(stage) for stage in stage_stats))
 
-    # Needed?
-    f = None
 
 def intersection(raster1: str, raster2: str):
     """Takes in the path of 2 GeoTiff raster's. Then returns the intersection between them"""
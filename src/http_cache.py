@@ -0,0 +1,84 @@
+"""
+    On disk cache of JSON responses from CMR and the HyP3 API, kept in SQLite.
+Every endpoint has its own time to live: granule footprints never change, so
+they never expire, while subscription listings grow and are kept briefly.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Union
+
+from src.config import HTTP_CACHE_PATH
+
+# Seconds a response stays fresh, None for ever
+DEFAULT_TTLS: Dict[str, Optional[float]] = {
+    'cmr_footprint': None,
+    'hyp3_products': 15 * 60,
+}
+
+
+class ResponseCache:
+    """With refresh, cached responses are ignored but fresh ones are still
+    stored."""
+
+    def __init__(
+            self,
+            path: Union[str, Path] = HTTP_CACHE_PATH,
+            ttls: Dict[str, Optional[float]] = None,
+            refresh: bool = False
+    ):
+        self.ttls = DEFAULT_TTLS if ttls is None else ttls
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(str(path), check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "endpoint TEXT, key TEXT, value TEXT, fetched REAL, PRIMARY KEY (endpoint, key))"
+            )
+
+    def get(self, endpoint: str, key: str) -> Optional[Any]:
+        """Returns the fresh cached response for key, or None."""
+        row = None
+        if not self.refresh:
+            with self._lock:
+                row = self._connection.execute(
+                    "SELECT value, fetched FROM responses WHERE endpoint = ? AND key = ?", (endpoint, key)
+                ).fetchone()
+
+        ttl = self.ttls.get(endpoint)
+        if row is None or (ttl is not None and time.time() - row[1] > ttl):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, endpoint: str, key: str, value: Any) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (endpoint, key, json.dumps(value), time.time())
+            )
+
+    def cached(self, endpoint: str, key: str, fetch: Callable[[], Any]) -> Any:
+        """Returns the cached response for key, calling fetch and storing its
+        result when there is none."""
+        value = self.get(endpoint, key)
+        if value is None:
+            value = fetch()
+            self.put(endpoint, key, value)
+        return value
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def report(self) -> str:
+        return f"Response cache: {self.hits} hits, {self.misses} misses"
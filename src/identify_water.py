@@ -10,6 +10,8 @@ from matplotlib.path import Path
 from osgeo import gdal
 import time
 
+from src.mask_writer import write_mask_to_file
+
 
 @contextmanager
 def gdal_open(file_name: Union[str, pathlib.Path]) -> Iterator[gdal.Dataset]:
@@ -239,15 +241,3 @@ def edit_mask_from_selection(
     mask[tuple(indices)] = 0
 
     return mask
-
-def write_mask_to_file(
-    mask: np.ndarray, file_name: str, projection: str, geo_transform: str
-) -> None:
-    (width, height) = mask.shape
-    out_image = gdal.GetDriverByName('GTiff').Create(
-        file_name, height, width, bands=1
-    )
-    out_image.SetProjection(projection)
-    out_image.SetGeoTransform(geo_transform)
-    out_image.GetRasterBand(1).WriteArray(mask)
-    out_image.FlushCache()
@@ -14,9 +14,11 @@ from itertools import groupby
 from pathlib import Path
 from shapely.geometry import Polygon
 from tempfile import TemporaryDirectory
+from typing import Tuple
 
 from src.asf_typing import sar_set
-from src.config import PRODUCTS_DIR, AOI_DIR, DATASETS_DIR, MODEL_DIR, MASK_DIR, TENSORBOARD_DIR, TYPE_REGEX
+from src.config import PRODUCTS_DIR, AOI_DIR, DATASETS_DIR, MODEL_DIR, MASK_DIR, TENSORBOARD_DIR, TYPE_REGEX, \
+    SAR_REGEX
 
 
 def polygon_from_shapefile(shp_path: Path) -> Polygon:
@@ -50,6 +52,26 @@ def extract_from_product(product_path, output_dir):
     return vv, vh
 
 
+def locate_sar_members(product_path) -> Tuple[str, str]:
+    """Find the vv and vh tifs inside a product zip.
+       returns VV & VH paths that GDAL opens in place through /vsizip/,
+       without extracting anything"""
+    vv = vh = None
+    with zipfile.ZipFile(product_path, "r") as zip_ref:
+        for archive_name in zip_ref.namelist():
+            if m := re.fullmatch(SAR_REGEX, archive_name.split('/')[-1]):
+                if m.group(4) == 'VV':
+                    vv = archive_name
+                if m.group(4) == 'VH':
+                    vh = archive_name
+
+    if vv is None or vh is None:
+        raise FileNotFoundError(f"{product_path} does not contain both VV and VH tifs")
+
+    zip_path = Path(product_path).resolve()
+    return f"/vsizip/{zip_path}/{vv}", f"/vsizip/{zip_path}/{vh}"
+
+
 def list_products(dir_path: Path) -> list:
     product_glob = Path(dir_path).glob('*.zip')
     return [product for product in product_glob]
@@ -0,0 +1,187 @@
+"""
+    Crash safe journal of a masking job, kept in SQLite in the job's output
+directory. Every product moves through the stages downloaded, masked and
+verified, and each stage is committed as soon as it is reached, so a job that
+dies part way through can be rerun to skip the products it finished and pick
+up the others where they stopped.
+
+    Inputs are recorded with their sha512, so a product is masked again if
+its input changes. Products are read in place from their zips, so there is no
+extraction stage to record.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+from urllib.parse import urlsplit
+
+from osgeo import gdal
+
+from src.model_paths import model_source_path
+from src.product_download_api import file_digest, recorded_digest
+
+JOURNAL_NAME = ".journal.sqlite"
+STAGES = ('downloaded', 'masked', 'verified')
+# Mask options that change the masks written, unlike those only tuning speed
+OUTPUT_OPTIONS = ('backend', 'preview_factor', 'nodata_fraction', 'compress')
+
+
+def model_file_digest(model_name: str, backend: str = 'keras') -> str:
+    """sha512 of the file the model is loaded from on backend, read from disk
+    without loading the model."""
+    return file_digest(Path(model_source_path(model_name, backend)))
+
+
+def job_settings(model_name: str, options: Dict[str, Any], model_digest: str = None) -> Dict[str, Any]:
+    """The settings of a masking job that decide what its masks hold.
+    model_digest, from model_file_digest, tells a model retrained under the
+    same name apart."""
+    return {
+        'model': model_name,
+        'model_digest': model_digest,
+        **{name: options.get(name) for name in OUTPUT_OPTIONS}
+    }
+
+
+def product_key(product: Union[str, Path]) -> str:
+    """The zip name a product url or path is journaled under."""
+    return Path(urlsplit(str(product)).path).name
+
+
+def readable_raster(path: Path) -> bool:
+    """Whether path is a raster GDAL can read to the end."""
+    try:
+        dataset = gdal.Open(str(path))
+        if dataset is None:
+            return False
+        # Reading the last row catches files cut short by a crash
+        row = dataset.GetRasterBand(1).ReadAsArray(0, dataset.RasterYSize - 1, dataset.RasterXSize, 1)
+        return row is not None
+    except RuntimeError:
+        return False
+
+
+class JobJournal:
+    """One journal per output directory. Safe to use from several threads."""
+
+    def __init__(self, directory: Union[str, Path], restart: bool = False, settings: Dict[str, Any] = None):
+        """The journal starts over when restart, or when the job's settings,
+        such as its model, differ from the ones it was kept with."""
+        self.path = Path(directory) / JOURNAL_NAME
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS products ("
+                "product TEXT PRIMARY KEY, stage TEXT, input_hash TEXT, input_size INTEGER, input_mtime INTEGER, "
+                "output TEXT, output_size INTEGER, updated REAL)"
+            )
+            self._connection.execute("CREATE TABLE IF NOT EXISTS job (key TEXT PRIMARY KEY, value TEXT)")
+
+            settings_json = json.dumps(settings or {}, sort_keys=True, default=str)
+            row = self._connection.execute("SELECT value FROM job WHERE key = 'settings'").fetchone()
+            if row is not None and row[0] != settings_json:
+                print("Job settings changed since the last run, masking every product again")
+            if restart or (row is not None and row[0] != settings_json):
+                self._connection.execute("DELETE FROM products")
+            self._connection.execute("INSERT OR REPLACE INTO job VALUES ('settings', ?)", (settings_json, ))
+
+    def _row(self, product: str) -> Optional[Dict]:
+        with self._lock:
+            cursor = self._connection.execute("SELECT * FROM products WHERE product = ?", (product, ))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip((column[0] for column in cursor.description), row))
+
+    def _update(self, product: str, **columns) -> None:
+        columns['updated'] = time.time()
+        names = ', '.join(columns)
+        with self._lock, self._connection:
+            self._connection.execute(
+                f"INSERT INTO products (product, {names}) VALUES (?{', ?' * len(columns)}) "
+                f"ON CONFLICT (product) DO UPDATE SET {', '.join(f'{name} = excluded.{name}' for name in columns)}",
+                (product, *columns.values())
+            )
+
+    def stage(self, product: str) -> Optional[str]:
+        row = self._row(product)
+        return None if row is None else row['stage']
+
+    def _input_unchanged(self, row: Dict, input_path: Path) -> bool:
+        stat = input_path.stat()
+        # Only rehashed when its size or modification time changed, say by a copy
+        if (row['input_size'], row['input_mtime']) == (stat.st_size, stat.st_mtime_ns):
+            return True
+        if row['input_hash'] != (recorded_digest(input_path) or file_digest(input_path)):
+            return False
+        self._update(row['product'], input_size=stat.st_size, input_mtime=stat.st_mtime_ns)
+        return True
+
+    def finished(self, product: str, input_path: Optional[Path] = None) -> bool:
+        """Whether product's mask is verified and still in place. Masks that
+        were written but not verified are verified now. With input_path, the
+        mask must also have been made from the same input."""
+        row = self._row(product)
+        if row is None or row['stage'] not in ('masked', 'verified'):
+            return False
+        if input_path is not None and not self._input_unchanged(row, input_path):
+            return False
+
+        output = Path(row['output'])
+        if not output.is_file():
+            return False
+        if row['stage'] == 'masked':
+            return self.verify(product)
+        return output.stat().st_size == row['output_size']
+
+    def downloaded(self, product: str, input_path: Path) -> None:
+        """Records product's input, hashed unless download_product already
+        recorded its digest. Any later stage of a different input is
+        forgotten."""
+        row = self._row(product)
+        if row is not None and self._input_unchanged(row, input_path):
+            return
+
+        stat = input_path.stat()
+        self._update(
+            product,
+            stage='downloaded',
+            input_hash=recorded_digest(input_path) or file_digest(input_path),
+            input_size=stat.st_size,
+            input_mtime=stat.st_mtime_ns,
+            output=None,
+            output_size=None
+        )
+
+    def masked(self, product: str, output: Path) -> None:
+        self._update(product, stage='masked', output=str(output), output_size=output.stat().st_size)
+
+    def verify(self, product: str) -> bool:
+        """Checks product's mask can be read, moving it to verified if so and
+        back to downloaded if not."""
+        output = self._row(product)['output']
+        if output is not None and Path(output).is_file() and readable_raster(Path(output)):
+            self._update(product, stage='verified', output_size=Path(output).stat().st_size)
+            return True
+
+        self._update(product, stage='downloaded', output=None, output_size=None)
+        return False
+
+    def summary(self) -> Counter:
+        with self._lock:
+            return Counter(dict(self._connection.execute("SELECT stage, COUNT(*) FROM products GROUP BY stage")))
+
+    def report(self) -> str:
+        summary = self.summary()
+        return "Journal: " + ", ".join(f"{summary[stage]} {stage}" for stage in STAGES)
+
+    def close(self) -> None:
+        self._connection.close()
@@ -0,0 +1,49 @@
+"""
+    Thin client for the mask server in mask_server.py. Only depends on
+requests, so submitting a job doesn't import TensorFlow.
+
+    $ python -m src.mask_client http://127.0.0.1:8765 model vv.tif vh.tif out.tif
+"""
+
+import os
+import sys
+from typing import Any, Dict
+
+import requests
+
+DEFAULT_URL = 'http://127.0.0.1:8765'
+
+
+def submit_mask_job(
+        url: str, model: str, vv_path: str, vh_path: str, outfile: str, **options: Any
+) -> float:
+    """Submits a mask job to the server at url and waits for it to finish.
+    Paths are made absolute since the server may run in another directory,
+    and must be under the server's root.
+    Returns the seconds the server spent on the job."""
+    job = {
+        'model': model,
+        'vv_path': os.path.abspath(vv_path),
+        'vh_path': os.path.abspath(vh_path),
+        'outfile': os.path.abspath(outfile),
+        'options': options
+    }
+    response = requests.post(f"{url.rstrip('/')}/jobs", json=job)
+    result = response.json()
+    if result.get('error'):
+        raise RuntimeError(f"Mask server failed job: {result['error']}")
+
+    return result['seconds']
+
+
+def server_status(url: str) -> Dict[str, Any]:
+    return requests.get(f"{url.rstrip('/')}/status").json()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 6:
+        print(__doc__)
+        sys.exit(1)
+
+    seconds = submit_mask_job(*sys.argv[1:])
+    print(f"Mask {sys.argv[5]} finished in {seconds:.1f}s")
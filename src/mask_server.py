@@ -0,0 +1,185 @@
+"""
+    Long running mask daemon. Holds models warm and masks scenes submitted as
+JSON jobs over localhost HTTP, so clients don't pay for importing TensorFlow
+and loading the model on every scene.
+
+    POST /jobs    {"model", "vv_path", "vh_path", "outfile", "options"}
+                  blocks until the mask is written
+    GET  /status  queue length, completed jobs and loaded models
+
+Scene and mask paths in jobs are resolved under the server's root directory
+and jobs naming files outside it are rejected. The server only listens on
+loopback addresses unless told otherwise.
+"""
+
+import ipaddress
+import json
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+
+from src.geo_utility import create_water_mask
+from src.model import MODEL_CACHE, get_model
+
+JOB_FIELDS = {'model', 'vv_path', 'vh_path', 'outfile', 'options'}
+PATH_FIELDS = ('vv_path', 'vh_path', 'outfile')
+
+
+def is_loopback(host: str) -> bool:
+    """True if host only accepts connections from this machine."""
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+@dataclass
+class MaskJob:
+    """A scene waiting to be masked by the server."""
+    model: str
+    vv_path: str
+    vh_path: str
+    outfile: str
+    options: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+    seconds: float = 0.0
+    done: threading.Event = field(default_factory=threading.Event, repr=False, compare=False)
+
+
+class MaskServer(ThreadingHTTPServer):
+    """HTTP server feeding a single inference thread from a job queue.
+
+    The inference thread takes up to max_group waiting jobs at a time and runs
+    them one after another, ordered by model, so interleaved submissions for
+    several models don't thrash the model cache.
+
+    default_options are the mask options jobs are run with, unless a job
+    sets them itself. Models named in models are loaded at startup with the
+    default backend.
+
+    Job paths are taken relative to root and must stay inside it. Binding to
+    anything but a loopback address raises ValueError unless allow_remote is
+    set, as jobs are not authenticated."""
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        models: Sequence[str] = (),
+        max_group: int = 8,
+        mask_func: Callable[..., None] = create_water_mask,
+        root: Union[str, Path] = '.',
+        allow_remote: bool = False,
+        **default_options: Any
+    ):
+        if not allow_remote and not is_loopback(address[0]):
+            raise ValueError(f"Refusing to serve masks on non-loopback address {address[0]}")
+        super().__init__(address, MaskRequestHandler)
+        self.root = Path(root).resolve()
+        self.max_group = max_group
+        self.mask_func = mask_func
+        self.default_options = default_options
+        self.jobs: queue.Queue = queue.Queue()
+        self.completed = 0
+        self.failed = 0
+
+        MODEL_CACHE.max_size = max(MODEL_CACHE.max_size, len(models))
+        for model in models:
+            get_model(model, default_options.get('backend', 'keras'))
+
+        self.worker = threading.Thread(target=self._run_jobs, daemon=True)
+        self.worker.start()
+
+    def resolve_path(self, path: str) -> str:
+        """Resolves a job path under root, raising ValueError if it leaves it."""
+        resolved = (self.root / path).resolve()
+        if resolved != self.root and self.root not in resolved.parents:
+            raise ValueError(f"{path} is outside of {self.root}")
+        return str(resolved)
+
+    def submit(self, job: MaskJob) -> MaskJob:
+        """Queues job and waits for it to finish."""
+        self.jobs.put(job)
+        job.done.wait()
+        return job
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'queued': self.jobs.qsize(),
+            'completed': self.completed,
+            'failed': self.failed,
+            'models_loaded': len(MODEL_CACHE)
+        }
+
+    def _next_group(self) -> List[MaskJob]:
+        group = [self.jobs.get()]
+        while len(group) < self.max_group:
+            try:
+                group.append(self.jobs.get_nowait())
+            except queue.Empty:
+                break
+        return sorted(group, key=lambda job: job.model)
+
+    def _run_jobs(self) -> None:
+        while True:
+            for job in self._next_group():
+                start = time.perf_counter()
+                try:
+                    self.mask_func(
+                        job.model, job.vv_path, job.vh_path, job.outfile,
+                        **{**self.default_options, **job.options}
+                    )
+                    self.completed += 1
+                except Exception as e:
+                    job.error = f"{type(e).__name__}: {e}"
+                    self.failed += 1
+                finally:
+                    job.seconds = time.perf_counter() - start
+                    job.done.set()
+
+
+class MaskRequestHandler(BaseHTTPRequestHandler):
+    server: MaskServer
+
+    def do_GET(self) -> None:
+        if self.path != '/status':
+            self._send(404, {'error': f"Unknown path {self.path}"})
+            return
+        self._send(200, self.server.status())
+
+    def do_POST(self) -> None:
+        if self.path != '/jobs':
+            self._send(404, {'error': f"Unknown path {self.path}"})
+            return
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            unknown = set(body) - JOB_FIELDS
+            if unknown:
+                raise ValueError(f"Unknown job fields {sorted(unknown)}")
+            job = MaskJob(**body)
+            for name in PATH_FIELDS:
+                setattr(job, name, self.server.resolve_path(getattr(job, name)))
+        except (ValueError, TypeError) as e:
+            self._send(400, {'error': str(e)})
+            return
+
+        job = self.server.submit(job)
+        self._send(
+            500 if job.error else 200,
+            {'outfile': job.outfile, 'seconds': job.seconds, 'error': job.error}
+        )
+
+    def _send(self, status: int, body: Dict[str, Any]) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
@@ -0,0 +1,199 @@
+"""
+    Scene parallel masking with a pool of worker processes. Each worker loads
+the model once, pins itself and TensorFlow's thread pools to its own slice of
+the cores and is recycled after a number of scenes to contain memory leaks.
+
+    Subscriptions are masked while their next products download, so that the
+network and the model are busy at the same time.
+"""
+
+import multiprocessing as mp
+import multiprocessing.util
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import tensorflow as tf
+from keras.models import Model
+
+from src.geo_utility import create_water_mask
+from src.io_tools import locate_sar_members
+from src.job_journal import JobJournal, product_key
+from src.model import get_model
+from src.pipeline import ByteBudget, StageStats, run_pipeline
+from src.product_store import ProductStore
+
+# Per worker state, set by _init_worker
+_model = None
+_mask_func: Callable[..., None] = create_water_mask
+_options: Dict[str, Any] = {}
+
+
+def available_cores() -> List[int]:
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def core_slices(workers: int, cores: Optional[Sequence[int]] = None) -> List[List[int]]:
+    """Splits cores into workers contiguous slices. When there are more
+    workers than cores the cores are shared round robin."""
+    cores = list(available_cores() if cores is None else cores)
+    if workers >= len(cores):
+        return [[cores[i % len(cores)]] for i in range(workers)]
+
+    per_worker = len(cores) // workers
+    return [cores[i * per_worker:(i + 1) * per_worker] for i in range(workers)]
+
+
+def longest_first(product_paths: Sequence[Path]) -> List[Path]:
+    """Orders products by size, largest first, so the longest scenes are not
+    left running on their own at the end of a batch."""
+    return sorted(product_paths, key=lambda path: path.stat().st_size, reverse=True)
+
+
+def _init_worker(
+        model: Union[str, Model],
+        free_slices: "mp.Queue[List[int]]",
+        mask_func: Callable[..., None],
+        options: Dict[str, Any]
+) -> None:
+    global _model, _mask_func, _options
+
+    # Every worker takes a free slice and gives it back as it exits, so the
+    # workers replacing recycled ones take over their slices
+    cores = free_slices.get()
+    multiprocessing.util.Finalize(None, free_slices.put, args=(cores, ), exitpriority=0)
+
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+
+    # Must be configured before TensorFlow creates its thread pools
+    tf.config.threading.set_intra_op_parallelism_threads(len(cores))
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    # The interpreter and the writer's compression keep to the slice as well
+    _model = get_model(model, options.get('backend', 'keras'), len(cores))
+    _mask_func = mask_func
+    _options = {**options, 'threads': len(cores)}
+
+
+def _free_slices(manager, workers: int) -> "mp.Queue[List[int]]":
+    free_slices = manager.Queue()
+    for cores in core_slices(workers):
+        free_slices.put(cores)
+    return free_slices
+
+
+def _mask_product(job: Tuple[Path, Path]) -> Tuple[Path, Path, float]:
+    product_path, output_file = job
+    start = time.perf_counter()
+    vv_path, vh_path = locate_sar_members(product_path)
+    _mask_func(_model, vv_path, vh_path, str(output_file), **_options)
+
+    return product_path, output_file, time.perf_counter() - start
+
+
+def mask_products_parallel(
+        model_name: Union[str, Model],
+        product_paths: Sequence[Path],
+        output_dir: Path,
+        workers: int,
+        recycle_after: Optional[int] = None,
+        journal: Optional[JobJournal] = None,
+        mask_func: Callable[..., None] = create_water_mask,
+        **options: Any
+) -> Iterator[Tuple[str, float]]:
+    """Masks every product in product_paths into output_dir with a pool of
+    workers processes. Yields (product name, seconds) as products finish.
+    Workers are replaced after recycle_after scenes. Products journal has as
+    finished are skipped, and the others are journaled as they finish.
+    model_name may also be a loaded model, and mask_func, like model, must
+    pickle to reach the workers."""
+    if journal is not None:
+        product_paths = [path for path in product_paths if not journal.finished(path.name, path)]
+    jobs = [(path, output_dir / f"{path.stem}.tif") for path in longest_first(product_paths)]
+    if not jobs:
+        return
+
+    # Spawn so that every worker starts its own TensorFlow runtime
+    context = mp.get_context('spawn')
+    with context.Manager() as manager, context.Pool(
+        processes=workers,
+        initializer=_init_worker,
+        initargs=(model_name, _free_slices(manager, workers), mask_func, options),
+        maxtasksperchild=recycle_after
+    ) as pool:
+        for product_path, output_file, seconds in pool.imap_unordered(_mask_product, jobs, chunksize=1):
+            if journal is not None:
+                # Hashing the input here overlaps it with the workers still masking
+                journal.downloaded(product_path.name, product_path)
+                journal.masked(product_path.name, output_file)
+                journal.verify(product_path.name)
+            yield product_path.stem, seconds
+
+
+def mask_products_pipelined(
+        model_name: str,
+        store: ProductStore,
+        product_urls: Sequence[str],
+        output_dir: Path,
+        prefetch: int = 2,
+        prefetch_bytes: Optional[int] = None,
+        journal: Optional[JobJournal] = None,
+        **options: Any
+) -> List[StageStats]:
+    """Masks products into output_dir as they arrive from the store. While one
+    product is masked up to prefetch more are downloaded, running
+    store.engine.workers downloads at a time. Downloads wait while the
+    products waiting to be masked take up prefetch_bytes. Products journal
+    has as finished are skipped without downloading them, and the others are
+    journaled as they go. Returns the stats of the download, mask and release
+    stages."""
+    model = get_model(model_name, options.get('backend', 'keras'))
+    budget = ByteBudget(prefetch_bytes)
+    stop = threading.Event()
+
+    def download(url: str) -> Optional[Tuple[Path, int]]:
+        if journal is not None and journal.finished(product_key(url)):
+            print(f"Mask for {product_key(url)} was finished by an earlier run")
+            return None
+        if not budget.wait(stop):
+            return None
+        # Failed downloads are reported by the engine and skipped
+        for product_path in list(store.acquire([url])):
+            if journal is not None:
+                journal.downloaded(product_path.name, product_path)
+            size = product_path.stat().st_size
+            budget.add(size)
+            return product_path, size
+        return None
+
+    def mask(product: Optional[Tuple[Path, int]]) -> Optional[Tuple[Path, int]]:
+        if product is not None:
+            product_path = product[0]
+            print(f"Creating mask {product_path.stem}")
+            output_file = output_dir / f"{product_path.stem}.tif"
+            vv_path, vh_path = locate_sar_members(product_path)
+            create_water_mask(model, vv_path, vh_path, str(output_file), **options)
+            if journal is not None:
+                journal.masked(product_path.name, output_file)
+                journal.verify(product_path.name)
+            print(f"Mask for {product_path.stem} is finished")
+        return product
+
+    def release(product: Optional[Tuple[Path, int]]) -> None:
+        if product is not None:
+            product_path, size = product
+            store.release(product_path)
+            budget.remove(size)
+
+    stats = run_pipeline(
+        product_urls, download, mask, release, readers=store.engine.workers, queue_depth=prefetch, stop=stop
+    )
+    for stage, name in zip(stats, ('download', 'mask', 'release')):
+        stage.name = name
+
+    return stats
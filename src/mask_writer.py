@@ -0,0 +1,87 @@
+"""
+    Shared writer for mask GeoTIFFs. Masks are written as tiled, compressed
+uint8 rasters, either in one go or a block at a time as they are predicted.
+"""
+
+import pathlib
+from typing import List, Optional, Union
+
+import numpy as np
+from osgeo import gdal
+
+from src.config import NETWORK_DEMS
+
+COMPRESSIONS = ('DEFLATE', 'ZSTD', 'LZW', 'NONE')
+
+
+def creation_options(
+        compress: str = 'DEFLATE', block_size: int = NETWORK_DEMS, threads: Optional[int] = None
+) -> List[str]:
+    """GTiff creation options for a tiled mask compressed on threads threads,
+    or on all cores when threads is None."""
+    if compress not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression '{compress}', expected one of {COMPRESSIONS}")
+
+    return [
+        'TILED=YES',
+        f'BLOCKXSIZE={block_size}',
+        f'BLOCKYSIZE={block_size}',
+        f'COMPRESS={compress}',
+        f'NUM_THREADS={threads or "ALL_CPUS"}',
+    ]
+
+
+class MaskWriter:
+    """Creates a single band uint8 mask GeoTIFF that blocks are written into.
+
+    with MaskWriter('mask.tif', width, height, projection, geo_transform) as writer:
+        writer.write_block(strip, 0, yoff)
+    """
+
+    def __init__(
+        self,
+        file_name: Union[str, pathlib.Path],
+        width: int,
+        height: int,
+        projection: str,
+        geo_transform: str,
+        nodata: Optional[int] = 0,
+        compress: str = 'DEFLATE',
+        threads: Optional[int] = None
+    ):
+        self.dataset = gdal.GetDriverByName('GTiff').Create(
+            str(file_name), width, height, 1, gdal.GDT_Byte,
+            options=creation_options(compress, threads=threads)
+        )
+        self.dataset.SetProjection(projection)
+        self.dataset.SetGeoTransform(geo_transform)
+        self.band = self.dataset.GetRasterBand(1)
+        if nodata is not None:
+            self.band.SetNoDataValue(nodata)
+
+    def write_block(self, block: np.ndarray, xoff: int = 0, yoff: int = 0) -> None:
+        """Float blocks, like raw predictions, are rounded half up and clamped
+        to 0..255, as GDAL does writing them to a Byte band."""
+        if np.issubdtype(block.dtype, np.floating):
+            block = np.clip(np.floor(block + 0.5), 0, 255)
+        self.band.WriteArray(block.astype(np.uint8, copy=False), xoff, yoff)
+
+    def close(self) -> None:
+        if self.dataset is not None:
+            self.dataset.FlushCache()
+        self.band = self.dataset = None
+
+    def __enter__(self) -> 'MaskWriter':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def write_mask_to_file(
+        mask: np.ndarray, file_name: str, projection: str, geo_transform: str,
+        nodata: Optional[int] = None, compress: str = 'DEFLATE'
+) -> None:
+    (height, width) = mask.shape
+    with MaskWriter(file_name, width, height, projection, geo_transform, nodata, compress) as writer:
+        writer.write_block(mask)
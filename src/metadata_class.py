@@ -6,7 +6,7 @@
 """
 
 import json
-from typing import List
+from typing import Dict, Iterable, Iterator, List, Tuple
 
 import requests
 import re
@@ -17,10 +17,26 @@ import dataclasses as dc
 from dataclasses import asdict
 from shapely.geometry import Polygon
 
+from src.http_cache import ResponseCache
 
 
 CMR_URL = 'https://cmr.earthdata.nasa.gov/search/granules.json'
 
+GRANULE_TIME_REGEX = re.compile(r"[0-9]{8}T[0-9]{6}")
+
+
+def granule_stamps(granule: str) -> Tuple[str, str]:
+    """The start and end time stamps (YYYYMMDDTHHMMSS) in a granule name."""
+    stamps = GRANULE_TIME_REGEX.findall(granule)
+    if len(stamps) < 2:
+        raise ValueError(f"No start and end time in granule name {granule}")
+    return stamps[0], stamps[1]
+
+
+def granule_times(granule: str) -> Tuple[datetime, datetime]:
+    start, end = granule_stamps(granule)
+    return datetime.strptime(start, "%Y%m%dT%H%M%S"), datetime.strptime(end, "%Y%m%dT%H%M%S")
+
 
 @dc.dataclass()
 class Product:
@@ -34,16 +50,9 @@ class Product:
     end: datetime = None
 
     def __post_init__(self):
-        self.start = self.__make_start()
-        self.end = self.__make_end()
-
-    def __make_start(self):
-        start_time = re.findall(r"[0-9]{8}T[0-9]{6}", self.granule)[0]
-        return datetime.strptime(start_time, "%Y%m%dT%H%M%S")
-
-    def __make_end(self):
-        end_time = re.findall(r"[0-9]{8}T[0-9]{6}", self.granule)[1]
-        return datetime.strptime(end_time, "%Y%m%dT%H%M%S")
+        # Times already parsed, by a ProductCatalog, are not parsed again
+        if self.start is None or self.end is None:
+            self.start, self.end = granule_times(self.granule)
 
     def time_bounds(self, start, end):
         return self.start > start and self.end < end
@@ -54,18 +63,7 @@ class Product:
         return self.shape.intersects(aoi)
 
     def get_shape_cmr(self):
-        payload = {'provider': 'ASF',
-                   'producer_granule_id': self.granule,
-                   'page_size': 100}
-
-        response = requests.post(CMR_URL, data=payload)
-
-        entrys = response.json()['feed']['entry']
-        if len(entrys) == 0:
-            return None
-
-        entry = entrys[0]
-        self.shape = Polygon(format_points(entry['polygons'][0][0]))
+        get_shapes_cmr([self])
 
 
     def to_dict(self):
@@ -124,9 +122,25 @@ def format_points(point_string):
     return points
 
 
-def get_sub_products(api, sub_id):
-    """returns all products in subscription as Product objects """
-    response = api.get_products(sub_id=sub_id)
+def get_sub_listing(api, sub_id, cache: ResponseCache = None) -> List[dict]:
+    """returns the name, granule and url of every product in subscription.
+    api is an API, or a function returning one which is only called when the
+    listing is not in cache."""
+
+    def fetch():
+        hyp3 = api() if callable(api) else api
+        return [{key: product[key] for key in ('name', 'granule', 'url')}
+                for product in hyp3.get_products(sub_id=sub_id)]
+
+    if cache is None:
+        return fetch()
+    return cache.cached('hyp3_products', str(sub_id), fetch)
+
+
+def get_sub_products(api, sub_id, cache: ResponseCache = None):
+    """returns all products in subscription as Product objects.
+    See get_sub_listing for api."""
+    response = get_sub_listing(api, sub_id, cache)
 
     products = []
     for product in response:
@@ -185,18 +199,70 @@ def get_min_granule_coverage(products: list, aoi: Polygon) -> list:
 #         yield shape
 
 def populate_cmr_product_shape(product: Product):
-    payload = {'provider': 'ASF',
-               'producer_granule_id': product.granule,
-               'page_size': 100}
+    get_shapes_cmr([product])
 
-    response = requests.post(CMR_URL, data=payload)
 
-    entrys = response.json()['feed']['entry']
-    if len(entrys) == 0:
-        return None
+def _cmr_entries(session: requests.Session, url: str, granules: List[str], page_size: int) -> Iterator[dict]:
+    """Yields CMR's entries for granules, following its pagination."""
+    page_num = 1
+    while True:
+        payload = {'provider': 'ASF',
+                   'producer_granule_id[]': granules,
+                   'page_size': page_size,
+                   'page_num': page_num}
 
-    entry = entrys[0]
-    shape = Polygon(format_points(entry['polygons'][0][0]))
-    product.shape = shape
-    return shape
+        response = session.post(url, data=payload)
+        response.raise_for_status()
 
+        entrys = response.json()['feed']['entry']
+        yield from entrys
+        if len(entrys) < page_size:
+            return
+        page_num += 1
+
+
+def get_footprints_cmr(
+        granules: Iterable[str],
+        batch_size: int = 100,
+        page_size: int = 2000,
+        url: str = CMR_URL,
+        session: requests.Session = None,
+        cache: ResponseCache = None
+) -> Dict[str, Polygon]:
+    """Looks up the footprint of every granule in CMR, batch_size granules per
+    request. Footprints in cache are not looked up again. Granules without a
+    footprint in CMR are left out."""
+    session = session or requests.Session()
+    wanted = dict.fromkeys(granules)
+
+    footprints = {}
+    missing = []
+    for granule in wanted:
+        points = cache.get('cmr_footprint', granule) if cache is not None else None
+        if points is None:
+            missing.append(granule)
+        else:
+            footprints[granule] = Polygon(format_points(points))
+
+    for i in range(0, len(missing), batch_size):
+        for entry in _cmr_entries(session, url, missing[i:i + batch_size], page_size):
+            granule = entry.get('producer_granule_id')
+            # Like a lookup of one granule, the first entry with a footprint wins
+            if granule not in wanted or granule in footprints or not entry.get('polygons'):
+                continue
+
+            points = entry['polygons'][0][0]
+            if cache is not None:
+                cache.put('cmr_footprint', granule, points)
+            footprints[granule] = Polygon(format_points(points))
+
+    return footprints
+
+
+def get_shapes_cmr(products: List[Product], **options) -> None:
+    """Fills in the shape of every product from CMR, see get_footprints_cmr
+    for options. Products without a footprint in CMR keep a shape of None."""
+    footprints = get_footprints_cmr([product.granule for product in products], **options)
+    for product in products:
+        if product.granule in footprints:
+            product.shape = footprints[product.granule]
@@ -2,18 +2,25 @@
     Create, save, and load models and model histories. Includes helper functions
 for keeping model paths consistent.
 """
+import hashlib
 import json
 import os
-import re
+import threading
+from collections import OrderedDict
 from enum import Enum
-from typing import Optional, Tuple
+from functools import partial
+from typing import Callable, Optional, Tuple, Union
 
 import numpy as np
 from keras.models import Model
 from keras.models import load_model as kload_model
 
-from ..config import MODEL_DIR, NETWORK_DEMS
+from ..config import NETWORK_DEMS
 from ..asf_typing import History
+from ..model_paths import (
+    inference_path_from_model_name, inference_source_path,
+    name_tag_from_model_name, path_from_model_name, path_from_model_name_tag
+)
 
 
 class ModelType(Enum):
@@ -32,35 +39,6 @@ class Encoder(json.JSONEncoder):
             return super(Encoder, self).default(obj)
 
 
-def path_from_model_name(model_name: str) -> str:
-    """ Parse the components of a model name into a file path.
-
-    # Example
-    ```python
-        assert PROJECT_DIR + "models/example_net/epoch1.h5" == \\
-            path_from_model_name("example_net:epoch1")
-    ```
-    """
-    name, tag = name_tag_from_model_name(model_name)
-    if not tag:
-        tag = "latest"
-
-    return path_from_model_name_tag(name, tag)
-
-
-def name_tag_from_model_name(model_name: str) -> Tuple[str, str]:
-    m = re.match(r"^(.*?)(?::(.*))?$", model_name)
-    if not m:
-        raise ValueError("Invalid model name")
-
-    name, tag = m.groups()
-    return name, tag or ''
-
-
-def path_from_model_name_tag(name: str, tag: str) -> str:
-    return os.path.join(MODEL_DIR, name, f"{tag}.h5")
-
-
 def save_model(
         model: Model, model_tag: str, history: Optional[History] = None
 ) -> None:
@@ -80,13 +58,19 @@ def save_model(
     model.save(model_path)
 
 
-def load_model(model_name: str) -> Model:
+def load_model(model_name: str, inference: bool = False) -> Model:
     """ Loads and returns a model. Attaches the model name and that model's
-    history. """
+    history.
+
+    With inference=True the model is loaded without compiling it, from its
+    prediction only export if there is one at least as new as the .h5. """
     model_path = path_from_model_name(model_name)
     model_dir = os.path.dirname(model_path)
 
-    model = kload_model(model_path)
+    if inference:
+        model = kload_model(inference_source_path(model_name), compile=False)
+    else:
+        model = kload_model(model_path)
     history = load_history_from_path(model_dir)
 
     # Attach our extra data to the model
@@ -96,6 +80,90 @@ def load_model(model_name: str) -> Model:
     return model
 
 
+class ModelCache:
+    """ In-process LRU cache of loaded models. Models are keyed by the resolved
+    path and modification time of their .h5 file, and the modification time
+    of the file actually loaded, such as a newer .inference.h5, so a model
+    that is saved or exported again is reloaded on its next use. """
+
+    def __init__(self, max_size: int = 2):
+        self.max_size = max_size
+        self.loads = 0
+        self._models: "OrderedDict[Tuple[str, float, float], Model]" = \
+            OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        model_name: str,
+        loader: Callable[[str], Model] = None,
+        model_path: Optional[str] = None
+    ) -> Model:
+        model_path = os.path.realpath(
+            model_path or path_from_model_name(model_name)
+        )
+        # Without a loader of its own the model may come from its export
+        source_path = model_path if loader else \
+            inference_source_path(model_name)
+        key = (
+            model_path,
+            os.path.getmtime(model_path),
+            os.path.getmtime(source_path)
+        )
+
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+
+            model = (loader or load_inference_model)(model_name)
+            self.loads += 1
+
+            # Drop models loaded from an older version of the same file
+            for stale in [k for k in self._models if k[0] == model_path]:
+                del self._models[stale]
+
+            self._models[key] = model
+            while len(self._models) > self.max_size:
+                self._models.popitem(last=False)
+
+            return model
+
+    def clear(self) -> None:
+        with self._lock:
+            self._models.clear()
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+
+def load_inference_model(model_name: str) -> Model:
+    return load_model(model_name, inference=True)
+
+
+MODEL_CACHE = ModelCache()
+
+
+def get_model(
+    model: Union[str, Model], backend: str = 'keras', threads: Optional[int] = None
+) -> Model:
+    """ Returns model unchanged if it is already loaded, otherwise loads it by
+    name through the process wide MODEL_CACHE. The 'tflite' backend loads the
+    model's exported .tflite file instead of the .h5, with an interpreter
+    running on threads threads, all cores when None. """
+    if not isinstance(model, str):
+        return model
+
+    if backend == 'tflite':
+        from .tflite import load_tflite_model, tflite_path_from_model_name
+        return MODEL_CACHE.get(
+            model, partial(load_tflite_model, num_threads=threads),
+            tflite_path_from_model_name(model)
+        )
+
+    return MODEL_CACHE.get(model)
+
+
 def save_history(history: History, model_name: str) -> None:
     model_path = path_from_model_name(model_name)
     model_dir = os.path.dirname(model_path)
@@ -123,6 +191,40 @@ def load_history_from_path(model_dir: str) -> History:
         return json.load(f)
 
 
+def activation_bytes(model: Model, dtype_size: int = 4) -> int:
+    """ Estimates the memory needed to hold the activations of one sample by
+    summing the output sizes of every layer in the model. Models that aren't
+    Keras models may provide their own estimate. """
+    if hasattr(model, 'activation_bytes'):
+        return model.activation_bytes()
+
+    total = 0
+    for layer in model.layers:
+        shapes = layer.output_shape
+        if not isinstance(shapes, list):
+            shapes = [shapes]
+        for shape in shapes:
+            total += int(np.prod(shape[1:]))
+
+    return total * dtype_size
+
+
+def model_digest(model: Model) -> str:
+    """ Hash of the model's weights, computed once per model. Models that
+    aren't Keras models may provide their own digest. """
+    if hasattr(model, 'digest'):
+        return model.digest()
+
+    if not hasattr(model, '_asf_weights_digest'):
+        h = hashlib.blake2b(digest_size=20)
+        for weights in model.get_weights():
+            h.update(str(weights.shape).encode())
+            h.update(weights.tobytes())
+        model._asf_weights_digest = h.hexdigest()
+
+    return model._asf_weights_digest
+
+
 def model_type(model: Model, dem=NETWORK_DEMS) -> Optional[ModelType]:
     if model.output_shape == (None, dem, dem, 1):
         return ModelType.MASKED
@@ -0,0 +1,124 @@
+"""
+    Build prediction only copies of models. BatchNormalization layers are
+folded into the Conv2D/Conv2DTranspose kernels in front of them and Dropout
+layers are removed, which leaves fewer ops to run per tile.
+"""
+import os
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from keras.layers import BatchNormalization, Dropout, Input, InputLayer, Layer
+from keras.layers.convolutional import Conv2D, Conv2DTranspose
+from keras.models import Model
+
+from . import inference_path_from_model_name, load_model
+
+
+def _as_list(tensors) -> list:
+    return tensors if isinstance(tensors, list) else [tensors]
+
+
+def _folds_into(bn: BatchNormalization, conv: Layer) -> bool:
+    """ Whether bn normalizes the channels of a linear conv. """
+    if not isinstance(conv, (Conv2D, Conv2DTranspose)):
+        return False
+
+    axes = _as_list(bn.axis)
+    rank = len(conv.output_shape)
+    return (
+        conv.get_config()['activation'] == 'linear'
+        and conv.data_format == 'channels_last'
+        and len(axes) == 1 and axes[0] in (-1, rank - 1)
+    )
+
+
+def fold_batchnorm_weights(
+    conv: Layer, bn: BatchNormalization
+) -> Tuple[np.ndarray, np.ndarray]:
+    """ Returns the kernel and bias of conv with bn applied to its output. """
+    weights = conv.get_weights()
+    kernel = weights[0]
+    bias = weights[1] if conv.use_bias else np.zeros(conv.filters)
+
+    n = conv.filters
+    gamma = bn.gamma.numpy() if bn.scale else np.ones(n)
+    beta = bn.beta.numpy() if bn.center else np.zeros(n)
+    mean = bn.moving_mean.numpy()
+    variance = bn.moving_variance.numpy()
+
+    scale = gamma / np.sqrt(variance + bn.epsilon)
+    # Conv2D kernels are (h, w, in, out), Conv2DTranspose kernels (h, w, out, in)
+    if isinstance(conv, Conv2DTranspose):
+        kernel = kernel * scale[:, np.newaxis]
+    else:
+        kernel = kernel * scale
+
+    return kernel.astype(weights[0].dtype), ((bias - mean) * scale + beta).astype(weights[0].dtype)
+
+
+def _clone_layer(layer: Layer, **config_changes) -> Layer:
+    config = layer.get_config()
+    config.update(config_changes)
+    return layer.__class__.from_config(config)
+
+
+def strip_for_inference(model: Model) -> Model:
+    """ Returns a copy of a functional model with BatchNormalization folded
+    into the preceding convolutions and Dropout removed. The copy is not
+    compiled. """
+    producers: Dict[str, Layer] = {}
+    consumers: Counter = Counter()
+    for layer in model.layers:
+        producers[layer.output.name] = layer
+        if not isinstance(layer, InputLayer):
+            consumers.update(t.name for t in _as_list(layer.input))
+
+    # conv name -> the BatchNormalization folded into it
+    folds: Dict[str, BatchNormalization] = {}
+    for layer in model.layers:
+        if isinstance(layer, BatchNormalization):
+            conv = producers.get(layer.input.name)
+            if conv is not None and consumers[conv.output.name] == 1 and _folds_into(layer, conv):
+                folds[conv.name] = layer
+    folded_bns = {bn.name for bn in folds.values()}
+
+    inputs = [Input(shape=t.shape[1:], name=t.name.split(':')[0]) for t in _as_list(model.input)]
+    tensors = {t.name: new for t, new in zip(_as_list(model.input), inputs)}
+
+    for layer in model.layers:
+        if isinstance(layer, InputLayer):
+            continue
+
+        layer_inputs = [tensors[t.name] for t in _as_list(layer.input)]
+        x = layer_inputs if isinstance(layer.input, list) else layer_inputs[0]
+
+        if isinstance(layer, Dropout) or layer.name in folded_bns:
+            output = x
+        elif layer.name in folds:
+            new_layer = _clone_layer(layer, use_bias=True)
+            output = new_layer(x)
+            new_layer.set_weights(fold_batchnorm_weights(layer, folds[layer.name]))
+        else:
+            new_layer = _clone_layer(layer)
+            output = new_layer(x)
+            new_layer.set_weights(layer.get_weights())
+
+        tensors[layer.output.name] = output
+
+    outputs: List = [tensors[t.name] for t in _as_list(model.output)]
+    return Model(inputs=inputs, outputs=outputs)
+
+
+def export_inference_model(model_name: str, model: Optional[Model] = None) -> str:
+    """ Writes the prediction only copy of a model next to its .h5 file, where
+    load_model(inference=True) prefers it. Returns the path written. """
+    model = model or load_model(model_name)
+    inference_path = inference_path_from_model_name(model_name)
+
+    model_dir = os.path.dirname(inference_path)
+    if not os.path.isdir(model_dir):
+        os.makedirs(model_dir)
+
+    strip_for_inference(model).save(inference_path, include_optimizer=False)
+    return inference_path
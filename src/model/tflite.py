@@ -0,0 +1,165 @@
+"""
+    Export models to TensorFlow Lite flatbuffers, optionally with int8 post
+training quantization, and run them with a multithreaded interpreter that can
+stand in for a Keras model when predicting masks.
+"""
+import hashlib
+import os
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+import tensorflow as tf
+from keras.models import Model
+
+from . import load_model
+from ..config import QUANTIZATIONS
+from ..model_paths import tflite_path_from_model_name
+from ..dataset.masked import generate_from_metadata, make_metadata
+
+
+def representative_tiles(dataset: str, samples: int = 100) -> Iterator[np.ndarray]:
+    """ Yields up to samples tiles from the training split of dataset, as they
+    would be fed to the model by create_water_mask. """
+    train_metadata, _ = make_metadata(dataset)
+    for i, (x, _) in enumerate(generate_from_metadata(train_metadata)):
+        if i >= samples:
+            return
+        # The dataset stacks (vh, vv) but masks are predicted from (vv, vh)
+        yield x[np.newaxis, ..., ::-1].astype(np.float32)
+
+
+def convert_to_tflite(
+    model: Model,
+    quantize: str = 'int8',
+    representative_data: Optional[Callable[[], Iterator[np.ndarray]]] = None
+) -> bytes:
+    """ Converts model to a TFLite flatbuffer. int8 quantization calibrates the
+    activation ranges on representative_data. Inputs and outputs stay float32
+    so the flatbuffer is a drop in replacement for the Keras model. """
+    if quantize not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization '{quantize}', expected one of {QUANTIZATIONS}")
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize == 'int8':
+        if representative_data is None:
+            raise ValueError("int8 quantization needs representative data")
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([x] for x in representative_data())
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    elif quantize == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+
+    return converter.convert()
+
+
+def export_tflite(
+    model_name: str, quantize: str = 'int8', dataset: Optional[str] = None, samples: int = 100
+) -> str:
+    """ Writes the model as a .tflite file next to its .h5 file and returns the
+    path. int8 quantization is calibrated on samples tiles of dataset. """
+    def representative_data() -> Iterator[np.ndarray]:
+        return representative_tiles(dataset, samples)
+
+    flatbuffer = convert_to_tflite(
+        load_model(model_name), quantize, representative_data if dataset else None
+    )
+
+    tflite_path = tflite_path_from_model_name(model_name)
+    with open(tflite_path, 'wb') as f:
+        f.write(flatbuffer)
+
+    return tflite_path
+
+
+class TFLiteModel:
+    """ Runs a TFLite flatbuffer with the subset of the Keras Model interface
+    used to predict masks. """
+
+    def __init__(
+        self,
+        model_path: Optional[str] = None,
+        model_content: Optional[bytes] = None,
+        num_threads: Optional[int] = None
+    ):
+        self.model_path = model_path
+        self.model_content = model_content
+        self.interpreter = tf.lite.Interpreter(
+            model_path=model_path,
+            model_content=model_content,
+            num_threads=num_threads or os.cpu_count()
+        )
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self.input_shape = tuple(self._input['shape'])
+
+    def _resize(self, batch_size: int) -> None:
+        shape = (batch_size, *self.input_shape[1:])
+        if tuple(self.interpreter.get_input_details()[0]['shape']) != shape:
+            self.interpreter.resize_tensor_input(self._input['index'], shape)
+            self.interpreter.allocate_tensors()
+
+    def predict(self, x: np.ndarray, batch_size: int = 1, verbose: int = 0) -> np.ndarray:
+        outputs = []
+        for start in range(0, len(x), batch_size):
+            batch = np.ascontiguousarray(x[start:start + batch_size], dtype=np.float32)
+            self._resize(len(batch))
+            self.interpreter.set_tensor(self._input['index'], batch)
+            self.interpreter.invoke()
+            outputs.append(self.interpreter.get_tensor(self._output['index']))
+
+        return np.concatenate(outputs)
+
+    def digest(self) -> str:
+        """ Hash of the flatbuffer. """
+        if self.model_content is None:
+            with open(self.model_path, 'rb') as f:
+                self.model_content = f.read()
+        return hashlib.blake2b(self.model_content, digest_size=20).hexdigest()
+
+    def activation_bytes(self) -> int:
+        """ Bytes of every tensor in the graph for a single sample. """
+        self._resize(1)
+        return sum(
+            int(np.prod(t['shape'])) * np.dtype(t['dtype']).itemsize
+            for t in self.interpreter.get_tensor_details()
+        )
+
+
+def load_tflite_model(model_name: str, num_threads: Optional[int] = None) -> TFLiteModel:
+    return TFLiteModel(tflite_path_from_model_name(model_name), num_threads=num_threads)
+
+
+def iou(a: np.ndarray, b: np.ndarray) -> float:
+    """ Intersection over union of the water (1) pixels of two masks. """
+    a, b = a.astype(bool), b.astype(bool)
+    union = np.count_nonzero(a | b)
+    if not union:
+        return 1.0
+    return np.count_nonzero(a & b) / union
+
+
+def compare_backends(model_name: str, dataset: str, batch_size: int = 8) -> Dict[str, float]:
+    """ Predicts the test split of dataset with the Keras model and its TFLite
+    export. Reports the IoU of each against the labels, the IoU between the two
+    and the tiles/sec of each backend. """
+    _, test_metadata = make_metadata(dataset)
+    tiles: List[np.ndarray] = []
+    labels: List[np.ndarray] = []
+    for x, y in generate_from_metadata(test_metadata):
+        tiles.append(x[..., ::-1])
+        labels.append(y)
+    x, y = np.array(tiles, dtype=np.float32), np.array(labels)
+
+    report: Dict[str, float] = {'tiles': len(x)}
+    predictions = {}
+    for backend, model in (('keras', load_model(model_name)), ('tflite', load_tflite_model(model_name))):
+        start = time.perf_counter()
+        predictions[backend] = model.predict(x, batch_size=batch_size).round()
+        report[f'{backend}_tiles_per_sec'] = len(x) / max(time.perf_counter() - start, 1e-9)
+        report[f'{backend}_iou'] = iou(predictions[backend], y)
+
+    report['keras_tflite_iou'] = iou(predictions['keras'], predictions['tflite'])
+    return report
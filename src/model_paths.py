@@ -0,0 +1,66 @@
+"""
+    Paths of a model's files, kept apart from src.model so they can be found
+without importing Keras.
+"""
+import os
+import re
+from typing import Tuple
+
+from src.config import MODEL_DIR
+
+
+def path_from_model_name(model_name: str) -> str:
+    """ Parse the components of a model name into a file path.
+
+    # Example
+    ```python
+        assert PROJECT_DIR + "models/example_net/epoch1.h5" == \\
+            path_from_model_name("example_net:epoch1")
+    ```
+    """
+    name, tag = name_tag_from_model_name(model_name)
+    if not tag:
+        tag = "latest"
+
+    return path_from_model_name_tag(name, tag)
+
+
+def name_tag_from_model_name(model_name: str) -> Tuple[str, str]:
+    m = re.match(r"^(.*?)(?::(.*))?$", model_name)
+    if not m:
+        raise ValueError("Invalid model name")
+
+    name, tag = m.groups()
+    return name, tag or ''
+
+
+def path_from_model_name_tag(name: str, tag: str) -> str:
+    return os.path.join(MODEL_DIR, name, f"{tag}.h5")
+
+
+def inference_path_from_model_name(model_name: str) -> str:
+    """ The prediction only export that sits next to the model's .h5 file. """
+    return os.path.splitext(path_from_model_name(model_name))[0] + \
+        ".inference.h5"
+
+
+def inference_source_path(model_name: str) -> str:
+    """ The file load_model(model_name, inference=True) loads. """
+    model_path = path_from_model_name(model_name)
+    inference_path = inference_path_from_model_name(model_name)
+    if os.path.isfile(inference_path) and \
+            os.path.getmtime(inference_path) >= os.path.getmtime(model_path):
+        return inference_path
+    return model_path
+
+
+def tflite_path_from_model_name(model_name: str) -> str:
+    """ The .tflite file that sits next to the model's .h5 file. """
+    return os.path.splitext(path_from_model_name(model_name))[0] + ".tflite"
+
+
+def model_source_path(model_name: str, backend: str = 'keras') -> str:
+    """ The file masking with model_name on backend loads the model from. """
+    if backend == 'tflite':
+        return tflite_path_from_model_name(model_name)
+    return inference_source_path(model_name)
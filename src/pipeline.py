@@ -0,0 +1,175 @@
+"""
+    Bounded producer/consumer pipeline that overlaps reading, processing and
+writing so that wall time approaches the slowest stage instead of the sum of
+all three.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, List, Optional
+
+_DONE = object()
+
+
+@dataclass
+class StageStats:
+    """Time spent working by one stage of a pipeline."""
+    name: str
+    workers: int = 1
+    items: int = 0
+    busy: float = 0.0
+    wall: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self.items += 1
+            self.busy += seconds
+
+    @property
+    def utilisation(self) -> float:
+        """Fraction of the wall time the stage's workers were busy."""
+        return self.busy / max(self.wall * self.workers, 1e-9)
+
+    def __str__(self) -> str:
+        return f"{self.name}: {self.items} items, {self.busy:.2f}s busy, {self.utilisation:.0%} utilised"
+
+
+def _timed(func: Callable[[Any], Any], stats: StageStats) -> Callable[[Any], Any]:
+    def wrapper(item):
+        start = time.perf_counter()
+        result = func(item)
+        stats.add(time.perf_counter() - start)
+        return result
+
+    return wrapper
+
+
+def _put(q: queue.Queue, item: Any, stop: threading.Event) -> None:
+    """Puts item on q unless the pipeline is stopped while waiting for room."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def _get(q: queue.Queue, stop: threading.Event) -> Any:
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+class ByteBudget:
+    """Bytes held by items between stages. Producers wait for room before
+    taking on more, so a budget bounds disk or memory use by size rather than
+    by item count."""
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.held = 0
+        self._condition = threading.Condition()
+
+    def wait(self, stop: threading.Event) -> bool:
+        """Waits until less than max_bytes are held. Returns False if stop is
+        set first."""
+        with self._condition:
+            while self.max_bytes is not None and self.held >= self.max_bytes:
+                if stop.is_set():
+                    return False
+                self._condition.wait(timeout=0.1)
+        return not stop.is_set()
+
+    def add(self, n_bytes: int) -> None:
+        with self._condition:
+            self.held += n_bytes
+
+    def remove(self, n_bytes: int) -> None:
+        with self._condition:
+            self.held -= n_bytes
+            self._condition.notify_all()
+
+
+def run_pipeline(
+        items: Iterable[Any],
+        read: Callable[[Any], Any],
+        process: Callable[[Any], Any],
+        write: Callable[[Any], None],
+        readers: int = 2,
+        queue_depth: int = 2,
+        stop: Optional[threading.Event] = None
+) -> List[StageStats]:
+    """Runs read -> process -> write over items, preserving their order.
+
+    read runs on a pool of reader threads, process runs on the calling thread
+    and write runs on a single writer thread. The queues between the stages
+    hold at most queue_depth items, which bounds the memory in flight. The
+    first exception raised by any stage stops the pipeline and is re-raised.
+    Stages that block on anything else should watch stop, which is set when
+    the pipeline stops. Returns the stats of the read, process and write
+    stages."""
+    stats = [StageStats('read', workers=readers), StageStats('process'), StageStats('write')]
+    timed_read, timed_process, timed_write = (_timed(f, s) for f, s in zip((read, process, write), stats))
+
+    read_queue: queue.Queue = queue.Queue(maxsize=queue_depth)
+    write_queue: queue.Queue = queue.Queue(maxsize=queue_depth)
+    if stop is None:
+        stop = threading.Event()
+    errors: List[BaseException] = []
+
+    def feed(pool: ThreadPoolExecutor) -> None:
+        for item in items:
+            if stop.is_set():
+                return
+            _put(read_queue, pool.submit(timed_read, item), stop)
+        _put(read_queue, _DONE, stop)
+
+    def drain() -> None:
+        while True:
+            result = write_queue.get()
+            if result is _DONE:
+                return
+            # Keep draining after a failure so the process stage never blocks
+            if errors:
+                continue
+            try:
+                timed_write(result)
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=readers) as pool:
+        feeder = threading.Thread(target=feed, args=(pool, ), daemon=True)
+        writer = threading.Thread(target=drain, daemon=True)
+        feeder.start()
+        writer.start()
+        try:
+            while True:
+                future = _get(read_queue, stop)
+                if future is _DONE:
+                    break
+                _put(write_queue, timed_process(future.result()), stop)
+        except BaseException:
+            stop.set()
+            raise
+        finally:
+            write_queue.put(_DONE)
+            writer.join()
+            feeder.join()
+
+    if errors:
+        raise errors[0]
+
+    wall = time.perf_counter() - start
+    for stage in stats:
+        stage.wall = wall
+
+    return stats
@@ -13,7 +13,7 @@ from matplotlib import pyplot as plt
 from matplotlib.widgets import Button, RectangleSelector
 from tensorflow.keras.layers import Conv2D
 from src.model import load_history, load_model
-from src.identify_water import write_mask_to_file
+from src.mask_writer import write_mask_to_file
 from .config import DATASETS_DIR, NETWORK_DEMS
 from .gdal_wrapper import gdal_open
 
@@ -62,7 +62,7 @@ def interactive_editor(mask_path: str) -> None:
 
         # Keys that don't care about the selection data
         if event.key == KEY_SAVE:
-            write_mask_to_file(f, mask_path, mask)
+            write_mask_to_file(mask, mask_path, f.GetProjection(), f.GetGeoTransform())
             saved_text.set_visible(True)
             fig.canvas.draw()
             return
@@ -0,0 +1,173 @@
+"""
+    Columnar catalog of a subscription's products. Start and end times are kept
+in numpy datetime64 arrays parsed in bulk, names, granules and urls are
+interned, listing ids are kept in an int64 array, and footprints are stored by index, so filtering tens of thousands
+of products by time window or AOI and sorting them are array operations.
+Product objects are only made for the entries actually used.
+"""
+
+import sys
+from datetime import datetime
+from typing import Iterable, Iterator, List, Sequence, Tuple
+
+import numpy as np
+from shapely.geometry.base import BaseGeometry
+
+from src.http_cache import ResponseCache
+from src.metadata_class import Product, get_footprints_cmr, get_sub_listing, granule_stamps
+from src.spatial import intersecting
+
+def _number(chars: np.ndarray, first: int, count: int) -> np.ndarray:
+    """The numbers written in count columns of ASCII digits from first."""
+    digits = chars[:, first:first + count].astype(np.int32) - ord('0')
+    return digits @ 10 ** np.arange(count - 1, -1, -1, dtype=np.int32)
+
+
+def _parse_chars(chars: np.ndarray) -> np.ndarray:
+    """datetime64[s] array of the YYYYMMDDTHHMMSS time stamps in the rows of
+    an n by 15 array of ASCII codes."""
+    year, month, day = _number(chars, 0, 4), _number(chars, 4, 2), _number(chars, 6, 2)
+    hour, minute, second = _number(chars, 9, 2), _number(chars, 11, 2), _number(chars, 13, 2)
+
+    months = (year - 1970) * 12 + month - 1
+    days = months.astype('datetime64[M]').astype('datetime64[D]') + (day - 1)
+    return days.astype('datetime64[s]') + (hour * 3600 + minute * 60 + second)
+
+
+def _chars(stamps: Iterable[str]) -> np.ndarray:
+    return np.frombuffer(''.join(stamps).encode('ascii'), dtype=np.uint8)
+
+
+def parse_stamps(stamps: Sequence[str]) -> np.ndarray:
+    """datetime64[s] array of YYYYMMDDTHHMMSS time stamps, converted together."""
+    return _parse_chars(_chars(stamps).reshape(-1, 15))
+
+
+def granule_time_arrays(granules: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Start and end time arrays of granule names."""
+    chars = _chars(stamp for granule in granules for stamp in granule_stamps(granule)).reshape(-1, 2, 15)
+    return _parse_chars(chars[:, 0]), _parse_chars(chars[:, 1])
+
+
+def _column(values: Iterable) -> np.ndarray:
+    strings = [None if value is None else sys.intern(value) for value in values]
+    column = np.empty(len(strings), dtype=object)
+    column[:] = strings
+    return column
+
+
+class ProductCatalog:
+    """Indexing a catalog with an int gives a Product, with an array of
+    indices or a boolean mask a smaller catalog."""
+
+    def __init__(
+            self,
+            names: np.ndarray,
+            granules: np.ndarray,
+            urls: np.ndarray,
+            start: np.ndarray,
+            end: np.ndarray,
+            shapes: np.ndarray = None,
+            ids: np.ndarray = None
+    ):
+        """ids are the listing's product ids, -1 where there is none."""
+        self.names = names
+        self.granules = granules
+        self.urls = urls
+        self.start = start
+        self.end = end
+        self.shapes = np.full(len(names), None, dtype=object) if shapes is None else shapes
+        self.ids = np.full(len(names), -1, dtype=np.int64) if ids is None else ids
+
+    @classmethod
+    def from_listing(cls, listing: Sequence[dict]) -> 'ProductCatalog':
+        """Catalog of dictionaries with a name, granule, url and id, as in a
+        subscription's listing."""
+        granules = _column(product['granule'] for product in listing)
+        start, end = granule_time_arrays(granules)
+        return cls(
+            _column(product['name'] for product in listing),
+            granules,
+            _column(product.get('url') for product in listing),
+            start,
+            end,
+            ids=np.array([-1 if product.get('id') is None else product['id'] for product in listing], dtype=np.int64)
+        )
+
+    @classmethod
+    def from_products(cls, products: Sequence[Product]) -> 'ProductCatalog':
+        catalog = cls.from_listing([{'name': p.name, 'granule': p.granule, 'url': p.url} for p in products])
+        for i, product in enumerate(products):
+            catalog.shapes[i] = product.shape
+        return catalog
+
+    @classmethod
+    def concatenate(cls, catalogs: Sequence['ProductCatalog']) -> 'ProductCatalog':
+        if not catalogs:
+            return cls.from_listing([])
+        columns = ('names', 'granules', 'urls', 'start', 'end', 'shapes', 'ids')
+        return cls(*(np.concatenate([getattr(catalog, column) for catalog in catalogs]) for column in columns))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return Product(
+                self.names[index],
+                self.granules[index],
+                self.urls[index],
+                self.shapes[index],
+                self.start[index].item(),
+                self.end[index].item()
+            )
+
+        return ProductCatalog(
+            self.names[index],
+            self.granules[index],
+            self.urls[index],
+            self.start[index],
+            self.end[index],
+            self.shapes[index],
+            self.ids[index]
+        )
+
+    def __iter__(self) -> Iterator[Product]:
+        return (self[i] for i in range(len(self)))
+
+    @property
+    def has_shape(self) -> np.ndarray:
+        return np.array([shape is not None for shape in self.shapes], dtype=bool)
+
+    def products(self) -> List[Product]:
+        return list(self)
+
+    def within(self, start: datetime, end: datetime) -> 'ProductCatalog':
+        """Products starting after start and ending before end, like
+        Product.time_bounds."""
+        return self[(self.start > np.datetime64(start, 's')) & (self.end < np.datetime64(end, 's'))]
+
+    def sorted_by_start(self) -> 'ProductCatalog':
+        """Least to most recent, like triage_products_newest."""
+        return self[np.argsort(self.start, kind='stable')]
+
+    def fill_shapes(self, **options) -> None:
+        """Fills in the footprints of products without one from CMR, see
+        get_footprints_cmr for options."""
+        missing = np.flatnonzero(~self.has_shape)
+        footprints = get_footprints_cmr(self.granules[missing], **options)
+        # One at a time, so numpy does not try to unpack the polygons
+        for i in missing:
+            self.shapes[i] = footprints.get(self.granules[i])
+
+    def intersecting(self, aoi: BaseGeometry) -> 'ProductCatalog':
+        """Products whose footprint intersects aoi, in order. Products without a
+        footprint are left out."""
+        with_shape = np.flatnonzero(self.has_shape)
+        hits = intersecting(list(self.shapes[with_shape]), aoi)
+        return self[with_shape[np.asarray(hits, dtype=np.intp)]]
+
+
+def get_sub_catalog(api, sub_id, cache: ResponseCache = None) -> ProductCatalog:
+    """Catalog of all products in subscription. See get_sub_listing for api."""
+    return ProductCatalog.from_listing(get_sub_listing(api, sub_id, cache))
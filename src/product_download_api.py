@@ -5,12 +5,28 @@
  Description:  functions for downloading from products.metalink file
 """
 
+import fcntl
+import hashlib
+import io
+import os
+import re
+import struct
+import threading
+import time
+import zipfile
+import zlib
 import xml.etree.ElementTree as ET
-from typing import List
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Pattern, Tuple, Union
 from pathlib import Path
 from dataclasses import dataclass
 from collections import namedtuple
+from urllib.parse import urlsplit
 import requests
+import requests.adapters
+
+from src.config import SAR_REGEX
 
 
 @dataclass
@@ -74,36 +90,460 @@ def get_redirect_url(url: str) -> str:
     return response_redirect.url
 
 
+class ChecksumMismatch(Exception):
+    """A downloaded product does not match its expected hash."""
+
+
+def _hash_file(hasher, path: Path, chunk_size: int = 2**20) -> int:
+    """Feeds a file to hasher. Returns the number of bytes read."""
+    n_bytes = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+            n_bytes += len(chunk)
+    return n_bytes
+
+
+def file_digest(path: Path) -> str:
+    """sha512 hex digest of a file, the hash products.metalink lists."""
+    hasher = hashlib.sha512()
+    _hash_file(hasher, path)
+    return hasher.hexdigest()
+
+
+def digest_path(save_path: Path) -> Path:
+    """The sha512sum style file recording the digest of a downloaded product."""
+    return save_path.with_name(f"{save_path.name}.sha512")
+
+
+def recorded_digest(save_path: Path) -> Optional[str]:
+    try:
+        return digest_path(save_path).read_text().split()[0]
+    except (FileNotFoundError, IndexError):
+        return None
+
+
+def lock_file(path: Path, shared: bool = False, blocking: bool = True) -> Optional[int]:
+    """Opens path, creating it if needed, and takes an flock on it. Returns the
+    descriptor holding the lock, or None without blocking when another
+    descriptor, in this process or another, holds a conflicting lock. Lock
+    files removed by their holder while waiting are opened again."""
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            os.close(fd)
+            return None
+
+        try:
+            if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                return fd
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+
+def unlock_file(fd: int, path: Path = None) -> None:
+    """Releases a lock taken with lock_file, first removing the lock file at
+    path. Only the holder of an exclusive lock may remove it."""
+    if path is not None:
+        path.unlink(missing_ok=True)
+    os.close(fd)
+
+
+@contextmanager
+def download_lock(save_path: Path) -> Iterator[None]:
+    """Exclusive lock on downloading save_path, so processes sharing a
+    directory never append to the same .part file."""
+    lock_path = save_path.with_name(f"{save_path.name}.lock")
+    fd = lock_file(lock_path)
+    try:
+        yield
+    finally:
+        unlock_file(fd, lock_path)
+
+
+def is_downloaded(save_path: Path, size: int = None, hash: str = None) -> bool:
+    """Whether save_path holds a complete download. Downloads only reach their
+    final name once they are complete, so without a size or hash to check
+    against, an existing file counts. The hash is checked against the digest
+    recorded by download_product when there is one."""
+    if not save_path.is_file():
+        return False
+    if size is not None and save_path.stat().st_size != size:
+        return False
+    return hash is None or (recorded_digest(save_path) or file_digest(save_path)) == hash.lower()
+
+
 # TODO: add credentials as input
-# TODO: MetalinkProduct class as input to get file size for print log???
 # TODO: Add progress bar (TQDM)
 # TODO: Split function. creates get_redirect
 # TODO: *************REMINDER***************************** have creds input normally. Not with function call !!! THATS THE FIX
-# TODO: Should not overrite existing files. Instead tack on a (1), (2), etc
 # TODO: Needs to stop if creds are invalid. Currenlty creates empty .zip files
-def download_product(product_url: str, save_directory: Path, creds: credentials) -> None:
-    """Download sar product from given url."""
+def download_product(
+        product_url: str,
+        save_directory: Path,
+        creds: credentials,
+        sar_only: bool = False,
+        session: requests.Session = None,
+        size: int = None,
+        hash: str = None
+) -> Path:
+    """Download sar product from given url. With sar_only just the VV and VH
+    tifs are fetched when the server supports range requests. Returns the path
+    of the saved product.
 
+    The product streams into a .part file, which a later call resumes with a
+    range request. The sha512 is computed as chunks arrive and, with the
+    size, checked against the expected values before the .part file is
+    renamed. Products already downloaded and matching them are skipped.
+    Downloads of the same product into one directory, from any process, take
+    turns."""
+    save_path = save_directory / product_url.split('/')[-1]
+    with download_lock(save_path):
+        return _download_product(product_url, save_directory, creds, sar_only, session, size, hash)
+
+
+def _download_product(
+        product_url: str,
+        save_directory: Path,
+        creds: credentials,
+        sar_only: bool,
+        session: Optional[requests.Session],
+        size: Optional[int],
+        hash: Optional[str]
+) -> Path:
     filename = product_url.split('/')[-1]
     save_path = save_directory / filename
+    part_path = save_path.with_name(f"{filename}.part")
+
+    # A sar_only download will not match the size and hash of the whole product
+    if is_downloaded(save_path, *((None, None) if sar_only else (size, hash))):
+        print(f"{filename} is already downloaded")
+        return save_path
+
+    if sar_only:
+        try:
+            return fetch_product_members(product_url, save_directory, creds, session=session)
+        except RangeNotSupported as e:
+            print(f"{e}, downloading the whole product")
+
+    http = session or requests
 
-    # Authenticate and then get redirect
-    response_redirect = requests.get(product_url)
-    redirect_url = response_redirect.url
+    # Authenticate and then get redirect, without pulling the product itself
+    with http.get(product_url, headers={'Range': 'bytes=0-0'}, stream=True) as response_redirect:
+        redirect_url = response_redirect.url
+
+    if size is not None and part_path.is_file() and part_path.stat().st_size > size:
+        print(f"{filename}.part is larger than the product, downloading it again")
+        part_path.unlink()
+
+    # Hash what is already on disk so the digest covers the whole file
+    hasher = hashlib.sha512()
+    offset = _hash_file(hasher, part_path) if part_path.is_file() else 0
+
+    headers = {'Range': f"bytes={offset}-"} if offset else {}
 
     # authenticate with .netrc and then Download fjle from redirect_url
-    with requests.get(redirect_url, stream=True, auth=(creds.username, creds.password)) as response:
-        with open(save_path, 'wb') as f:
-            print(f"Downloading {filename}")
+    restart = False
+    with http.get(redirect_url, headers=headers, stream=True, auth=(creds.username, creds.password)) as response:
+        if offset and response.status_code == 416:
+            # The .part file holds the whole product already, unless its size
+            # or the server's says otherwise
+            expected = size
+            total = response.headers.get('Content-Range', '').split('/')[-1]
+            if expected is None and total.isdigit():
+                expected = int(total)
+            restart = expected is not None and offset != expected
+        else:
+            if offset and response.status_code != 206:
+                # The server ignored the range, start over
+                print(f"Cannot resume {filename}, downloading it again")
+                hasher = hashlib.sha512()
+                offset = 0
+            response.raise_for_status()
+
+            with open(part_path, 'ab' if offset else 'wb') as f:
+                print(f"{'Resuming' if offset else 'Downloading'} {filename}")
+
+                # Downloads files in chucks
+                for chunk in response.iter_content(chunk_size=2**20):
+                    if chunk:
+                        f.write(chunk)
+                        hasher.update(chunk)
+                        offset += len(chunk)
+
+    if restart:
+        # Resuming could never complete it, so start over
+        print(f"{filename}.part does not match the product, downloading it again")
+        part_path.unlink()
+        return _download_product(product_url, save_directory, creds, sar_only, session, size, hash)
+
+    if size is not None and offset != size:
+        raise IOError(f"{filename} is incomplete, got {offset} of {size} bytes. Download again to resume")
+
+    if hash is not None and hasher.hexdigest() != hash.lower():
+        part_path.unlink()
+        raise ChecksumMismatch(f"sha512 of {filename} does not match products.metalink")
+
+    digest_path(save_path).write_text(f"{hasher.hexdigest()}  {filename}\n")
+    part_path.replace(save_path)
+    return save_path
+
+
+class RangeNotSupported(Exception):
+    """The server answered a range request with the whole file."""
+
+
+class HttpRangeFile(io.RawIOBase):
+    """Read only, seekable file over HTTP range requests. Reads are served from
+    a buffer of at least min_fetch bytes, so that zipfile can parse the central
+    directory of a remote zip in a couple of requests."""
+
+    def __init__(self, session: requests.Session, url: str, auth: Tuple[str, str] = None, min_fetch: int = 2**16):
+        super().__init__()
+        self.session = session
+        self.url = url
+        self.auth = auth
+        self.min_fetch = min_fetch
+        self.position = 0
+        self.bytes_fetched = 0
+
+        # The tail holds the end of central directory record and, for products,
+        # the whole central directory
+        response = self._request(f"bytes=-{min_fetch}")
+        self.size = int(response.headers['Content-Range'].split('/')[-1])
+        self._buffer = response.content
+        self._buffer_start = self.size - len(self._buffer)
+        self.bytes_fetched += len(self._buffer)
 
-            # Downloads files in chucks
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-        f.close()
+    def _request(self, byte_range: str, stream: bool = False) -> requests.Response:
+        response = self.session.get(self.url, headers={'Range': byte_range}, auth=self.auth, stream=stream)
+        if response.status_code != 206:
+            response.close()
+            raise RangeNotSupported(f"{self.url} answered a range request with {response.status_code}")
+        # Skip any redirects on the following requests
+        self.url = response.url
+        return response
 
+    def readable(self) -> bool:
+        return True
 
-def download_metalink_products(metalink_path: Path, save_directory_path: Path, creds: credentials):
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}")
+        self.position = offset
+        return self.position
+
+    def readinto(self, b) -> int:
+        n = min(len(b), self.size - self.position)
+        if n <= 0:
+            return 0
+
+        start = self.position - self._buffer_start
+        if start < 0 or start + n > len(self._buffer):
+            end = min(self.position + max(n, self.min_fetch), self.size) - 1
+            self._buffer = self._request(f"bytes={self.position}-{end}").content
+            self._buffer_start = self.position
+            self.bytes_fetched += len(self._buffer)
+            start = 0
+
+        b[:n] = self._buffer[start:start + n]
+        self.position += n
+        return n
+
+    def iter_range(self, start: int, length: int, chunk_size: int = 2**20) -> Iterator[bytes]:
+        """Streams length bytes from start with a single request."""
+        if length <= 0:
+            return
+        with self._request(f"bytes={start}-{start + length - 1}", stream=True) as response:
+            for chunk in response.iter_content(chunk_size):
+                self.bytes_fetched += len(chunk)
+                yield chunk
+
+
+def _member_chunks(remote: HttpRangeFile, info: zipfile.ZipInfo) -> Iterator[bytes]:
+    """Streams the uncompressed contents of a member of a remote zip."""
+    # The local header's name and extra fields can differ from the central directory's
+    remote.seek(info.header_offset)
+    name_length, extra_length = struct.unpack('<HH', remote.read(zipfile.sizeFileHeader)[26:30])
+    data_start = info.header_offset + zipfile.sizeFileHeader + name_length + extra_length
+
+    if info.compress_type == zipfile.ZIP_STORED:
+        yield from remote.iter_range(data_start, info.compress_size)
+    elif info.compress_type == zipfile.ZIP_DEFLATED:
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        for chunk in remote.iter_range(data_start, info.compress_size):
+            yield decompressor.decompress(chunk)
+        yield decompressor.flush()
+    else:
+        raise NotImplementedError(f"{info.filename} uses unsupported compression {info.compress_type}")
+
+
+def fetch_product_members(
+        product_url: str,
+        save_directory: Path,
+        creds: credentials,
+        pattern: Pattern = SAR_REGEX,
+        session: requests.Session = None
+) -> Path:
+    """Download only the members of a product zip whose file names match
+    pattern, by reading the zip's central directory and the members' byte
+    ranges with HTTP range requests. The members are saved uncompressed, so
+    GDAL can seek in them, into a zip named like the product. Returns its path."""
+
+    filename = product_url.split('/')[-1]
+    save_path = save_directory / filename
+    part_path = save_path.with_name(f"{filename}.part")
+
+    session = session or requests.Session()
+    # Authenticate and then get redirect, like download_product, without
+    # pulling the product itself
+    with session.get(product_url, headers={'Range': 'bytes=0-0'}, stream=True) as response_redirect:
+        redirect_url = response_redirect.url
+
+    remote = HttpRangeFile(session, redirect_url, auth=(creds.username, creds.password))
+    with zipfile.ZipFile(remote) as remote_zip:
+        members = [info for info in remote_zip.infolist() if re.fullmatch(pattern, info.filename.split('/')[-1])]
+
+        print(f"Downloading {', '.join(info.filename.split('/')[-1] for info in members)} from {filename}")
+        with zipfile.ZipFile(part_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as local_zip:
+            for info in members:
+                local_info = zipfile.ZipInfo(info.filename, info.date_time)
+                local_info.file_size = info.file_size
+
+                crc = 0
+                with local_zip.open(local_info, 'w') as f:
+                    for chunk in _member_chunks(remote, info):
+                        crc = zlib.crc32(chunk, crc)
+                        f.write(chunk)
+
+                if crc != info.CRC:
+                    raise zipfile.BadZipFile(f"CRC mismatch for {info.filename} in {filename}")
+
+    # Not the whole product, so no digest of it applies
+    digest_path(save_path).unlink(missing_ok=True)
+    part_path.replace(save_path)
+    print(f"Fetched {remote.bytes_fetched / 2**20:.1f} of {remote.size / 2**20:.1f} MiB of {filename}")
+
+    return save_path
+
+
+@dataclass
+class DownloadStats:
+    """Aggregate counts and throughput of a DownloadEngine."""
+    products: int = 0
+    failed: int = 0
+    bytes: int = 0
+    wall: float = 0.0
+
+    def __str__(self) -> str:
+        rate = self.bytes / 2**20 / max(self.wall, 1e-9)
+        return (f"Downloaded {self.products} products ({self.failed} failed), "
+                f"{self.bytes / 2**20:.1f} MiB in {self.wall:.1f}s, {rate:.1f} MiB/s")
+
+
+class DownloadEngine:
+    """Downloads products concurrently on a pool of threads sharing one
+    connection pooling session. At most per_host downloads run against any one
+    host at a time."""
+
+    def __init__(self, creds: credentials, workers: int = 4, per_host: int = 4, sar_only: bool = False):
+        self.creds = creds
+        self.workers = workers
+        self.per_host = per_host
+        self.sar_only = sar_only
+        self.stats = DownloadStats()
+        self.failures: List[Tuple[str, Exception]] = []
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._host_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def _host_slot(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self._host_slots[host]
+
+    def _download(self, product: Union[str, MetalinkProduct], save_directory: Path) -> Path:
+        if isinstance(product, MetalinkProduct):
+            url, size, hash = product.url, product.size, product.hash
+        else:
+            url, size, hash = product, None, None
+
+        with self._host_slot(url):
+            return download_product(url, save_directory, self.creds, self.sar_only, self.session, size, hash)
+
+    def download(self, products: Iterable[Union[str, MetalinkProduct]], save_directory: Path) -> Iterator[Path]:
+        """Downloads every product url, or MetalinkProduct whose size and hash
+        are then verified, into save_directory, yielding the saved paths as
+        downloads finish. Failed downloads are reported and kept in failures
+        instead of stopping the others. Products saved under a name already
+        given are only downloaded once. The time spent adds to stats.wall."""
+        save_directory.mkdir(parents=True, exist_ok=True)
+        wall = self.stats.wall
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {}
+            names = set()
+            for product in products:
+                url = getattr(product, 'url', product)
+                # Two threads saving one product would write the same .part file
+                name = url.split('/')[-1]
+                if name in names:
+                    continue
+                names.add(name)
+                futures[pool.submit(self._download, product, save_directory)] = url
+
+            for future in as_completed(futures):
+                try:
+                    save_path = future.result()
+                except Exception as e:
+                    print(f"Failed to download {futures[future]}: {e}")
+                    with self._lock:
+                        self.failures.append((futures[future], e))
+                        self.stats.failed += 1
+                    continue
+
+                # download may run on several threads at once
+                with self._lock:
+                    self.stats.products += 1
+                    self.stats.bytes += save_path.stat().st_size
+                    self.stats.wall = wall + time.perf_counter() - start
+                yield save_path
+
+        self.stats.wall = wall + time.perf_counter() - start
+
+
+def download_metalink_products(
+        metalink_path: Path,
+        save_directory_path: Path,
+        creds: credentials,
+        workers: int = 4,
+        per_host: int = 4,
+        sar_only: bool = False
+) -> DownloadStats:
     """Download all products from metalink file (products.metalink)."""
-    for product in metalink_product_generator(metalink_path):
-        download_product(product.url, save_directory_path, creds)
+    engine = DownloadEngine(creds, workers, per_host, sar_only)
+    for _ in engine.download(metalink_product_generator(metalink_path), save_directory_path):
+        pass
+
+    print(engine.stats)
+    return engine.stats
@@ -0,0 +1,165 @@
+"""
+    Local store of downloaded products shared by every command, so that a
+granule overlapping several AOIs or jobs is only downloaded once. Products are
+kept under their granule's zip name next to the sha512 download_product
+records for them. The least recently used products are evicted once the store
+exceeds its byte budget, except for products still referenced by a job in
+any process sharing the store.
+"""
+
+import os
+import shutil
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+
+from src.config import PRODUCT_STORE_DIR
+from src.product_download_api import DownloadEngine, MetalinkProduct, digest_path, lock_file, unlock_file
+
+DEFAULT_STORE_BYTES = 200 * 2**30
+
+
+def lease_path(path: Path) -> Path:
+    return path.with_name(f"{path.name}.lease")
+
+
+def _drop_lease(path: Path) -> None:
+    """Removes a product's lease file once no store holds it."""
+    fd = lock_file(lease_path(path), blocking=False)
+    if fd is not None:
+        unlock_file(fd, lease_path(path))
+
+
+def _remove_unleased(path: Path) -> bool:
+    """Removes a stored product unless a store in any process holds its lease.
+    Returns whether it was removed."""
+    fd = lock_file(lease_path(path), blocking=False)
+    if fd is None:
+        return False
+    try:
+        path.unlink(missing_ok=True)
+        digest_path(path).unlink(missing_ok=True)
+    finally:
+        unlock_file(fd, lease_path(path))
+    return True
+
+
+class ProductStore:
+    """Products fetched with only their VV and VH members (sar_only) are kept
+    apart from whole products, so neither is mistaken for the other.
+
+    References are counted within a process, and while a product has any,
+    the process holds a shared flock on the product's .lease file. Stores of
+    other processes in the same directory only evict products whose lease
+    they can lock exclusively."""
+
+    def __init__(
+            self,
+            engine: DownloadEngine,
+            directory: Union[str, Path] = PRODUCT_STORE_DIR,
+            max_bytes: int = DEFAULT_STORE_BYTES
+    ):
+        self.engine = engine
+        self.root = Path(directory)
+        self.directory = self.root / 'sar_only' if engine.sar_only else self.root
+        self.max_bytes = max_bytes
+        self.references: Counter = Counter()
+        self._leases: Dict[Path, int] = {}
+        self._lock = threading.Lock()
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _products(self):
+        return [*self.root.glob('*.zip'), *self.root.glob('sar_only/*.zip')]
+
+    @property
+    def size(self) -> int:
+        return sum(size for _, size, _ in self._stats())
+
+    def _stats(self) -> List[Tuple[float, int, Path]]:
+        """Modification time, size and path of every product, leaving out those
+        removed by another process meanwhile."""
+        stats = []
+        for path in self._products():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            stats.append((stat.st_mtime, stat.st_size, path))
+        return stats
+
+    def _reference(self, path: Path) -> None:
+        with self._lock:
+            if path not in self._leases:
+                self._leases[path] = lock_file(lease_path(path), shared=True)
+            self.references[path] += 1
+
+    def acquire(self, products: Iterable[Union[str, MetalinkProduct]]) -> Iterator[Path]:
+        """Yields the stored path of every product url or MetalinkProduct as it
+        becomes available, downloading those the store does not already hold.
+        Each yielded path is referenced until it is passed to release.
+
+        Products are referenced before their download starts, so they cannot
+        be evicted between finishing and being yielded. References to those
+        that fail, or are not yielded because the caller stopped early, are
+        dropped at the end."""
+        pending: Counter = Counter()
+
+        def referenced(products):
+            for product in products:
+                path = self.directory / getattr(product, 'url', product).split('/')[-1]
+                self._reference(path)
+                pending[path] += 1
+                yield product
+
+        try:
+            for path in self.engine.download(referenced(products), self.directory):
+                pending[path] -= 1
+                # Mark as recently used for eviction
+                os.utime(path)
+                with self._lock:
+                    self.evict()
+                yield path
+        finally:
+            for path, count in pending.items():
+                for _ in range(count):
+                    self.release(path)
+
+    def release(self, path: Path) -> None:
+        with self._lock:
+            self.references[path] -= 1
+            if self.references[path] <= 0:
+                del self.references[path]
+                os.close(self._leases.pop(path))
+                _drop_lease(path)
+                self.evict()
+
+    def evict(self) -> None:
+        """Removes the least recently used, unreferenced products until the
+        store is within its budget. Products leased by other processes are
+        skipped."""
+        products = sorted(self._stats(), key=lambda product: product[0])
+        size = sum(size for _, size, _ in products)
+        for _, product_size, path in products:
+            if size <= self.max_bytes:
+                break
+            if path in self.references or not _remove_unleased(path):
+                continue
+            size -= product_size
+
+    def export(self, products: Iterable[Union[str, MetalinkProduct]], directory: Path) -> Iterator[Path]:
+        """Places products in directory, hard linked to the store where the file
+        system allows and copied otherwise. Yields the placed paths."""
+        directory.mkdir(parents=True, exist_ok=True)
+        for path in self.acquire(products):
+            try:
+                target = directory / path.name
+                target.unlink(missing_ok=True)
+                try:
+                    os.link(path, target)
+                except OSError:
+                    shutil.copy2(path, target)
+            finally:
+                self.release(path)
+            yield target
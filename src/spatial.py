@@ -0,0 +1,179 @@
+"""
+    Spatial queries over product footprints. Footprints are bulk loaded into a
+Shapely STRtree so that only products whose bounding boxes overlap the AOI are
+tested against it, and the AOI is prepared so those tests are cheap even for
+complex shapefile boundaries. Works with Shapely 1.7+ and 2.x.
+
+    minimum_coverage picks the products covering an AOI like
+get_min_granule_coverage, either exactly on pieces of the AOI or approximately
+on a grid of cells.
+"""
+
+from typing import List, Optional, Sequence
+
+import numpy as np
+import shapely
+from shapely.geometry import Point, box
+from shapely.geometry.base import BaseGeometry
+from shapely.prepared import prep
+from shapely.strtree import STRtree
+
+from src.metadata_class import Product, triage_products_newest
+
+SHAPELY_2 = int(shapely.__version__.split('.')[0]) >= 2
+
+
+def intersecting(shapes: Sequence[BaseGeometry], aoi: BaseGeometry) -> List[int]:
+    """Returns the sorted indices of shapes intersecting aoi."""
+    if not shapes:
+        return []
+
+    tree = STRtree(shapes)
+    if SHAPELY_2:
+        # Tests the bounding box candidates with a prepared aoi internally
+        return sorted(int(i) for i in tree.query(aoi, predicate='intersects'))
+
+    # Shapely 1.x queries return the candidate geometries themselves
+    index = {id(shape): i for i, shape in enumerate(shapes)}
+    prepared = prep(aoi)
+    return sorted(index[id(shape)] for shape in tree.query(aoi) if prepared.intersects(shape))
+
+
+def products_intersecting(products: Sequence[Product], aoi: BaseGeometry) -> List[Product]:
+    """Products whose shape intersects aoi, in their original order. Products
+    without a shape are left out."""
+    with_shape = [product for product in products if product.shape is not None]
+    return [with_shape[i] for i in intersecting([product.shape for product in with_shape], aoi)]
+
+
+def _polygonal(geometry: BaseGeometry) -> List[BaseGeometry]:
+    """The polygons in geometry, dropping the lines and points overlays can
+    leave behind."""
+    if geometry.is_empty:
+        return []
+    if geometry.geom_type == 'Polygon':
+        return [geometry]
+    if hasattr(geometry, 'geoms'):
+        return [polygon for part in geometry.geoms for polygon in _polygonal(part)]
+    return []
+
+
+def split(aoi: BaseGeometry, pieces: int) -> List[BaseGeometry]:
+    """Cuts aoi along a pieces by pieces grid, so overlays only touch the few
+    small pieces near a footprint instead of the whole boundary."""
+    minx, miny, maxx, maxy = aoi.bounds
+    xs = np.linspace(minx, maxx, pieces + 1)
+    ys = np.linspace(miny, maxy, pieces + 1)
+    prepared = prep(aoi)
+
+    parts = []
+    for x0, x1 in zip(xs[:-1], xs[1:]):
+        for y0, y1 in zip(ys[:-1], ys[1:]):
+            cell = box(x0, y0, x1, y1)
+            if prepared.contains(cell):
+                parts.append(cell)
+            elif prepared.intersects(cell):
+                parts.extend(_polygonal(aoi.intersection(cell)))
+    return parts
+
+
+def _cover_exact(candidates: List[Product], aoi: BaseGeometry, min_exposed: float, pieces: int) -> List[Product]:
+    parts: List[Optional[BaseGeometry]] = split(aoi, pieces)
+    bounds = np.array([part.bounds for part in parts]).reshape(-1, 4)
+    exposed = sum(part.area for part in parts)
+
+    selected = []
+    for product in candidates:
+        if exposed <= aoi.area * min_exposed:
+            break
+
+        minx, miny, maxx, maxy = product.shape.bounds
+        near = np.flatnonzero(
+            (bounds[:, 0] <= maxx) & (bounds[:, 2] >= minx) & (bounds[:, 1] <= maxy) & (bounds[:, 3] >= miny)
+        )
+        footprint = prep(product.shape)
+        remaining = {i: parts[i].difference(product.shape) for i in near if footprint.intersects(parts[i])}
+        covered = sum(parts[i].area - part.area for i, part in remaining.items())
+        # Footprints only touching the uncovered area along an edge add nothing
+        if covered <= 0:
+            continue
+
+        selected.append(product)
+        exposed -= covered
+        for i, part in remaining.items():
+            if part.is_empty:
+                # Never near anything again
+                parts[i] = None
+                bounds[i] = (np.inf, np.inf, -np.inf, -np.inf)
+            else:
+                parts[i] = part
+                bounds[i] = part.bounds
+
+    return selected
+
+
+def _cells_inside(geometry: BaseGeometry, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+    """Whether each of the cell centres on the xs by ys grid is in geometry."""
+    x, y = np.meshgrid(xs, ys)
+    if SHAPELY_2:
+        return shapely.contains_xy(geometry, x, y)
+    prepared = prep(geometry)
+    return np.array([prepared.contains(Point(px, py)) for px, py in zip(x.ravel(), y.ravel())]).reshape(x.shape)
+
+
+def _cover_grid(candidates: List[Product], aoi: BaseGeometry, min_exposed: float, cell_size: float) -> List[Product]:
+    minx, miny, maxx, maxy = aoi.bounds
+    xs = np.arange(minx + cell_size / 2, maxx, cell_size)
+    ys = np.arange(miny + cell_size / 2, maxy, cell_size)
+    uncovered = _cells_inside(aoi, xs, ys)
+    total = uncovered.sum()
+
+    selected = []
+    for product in candidates:
+        if uncovered.sum() <= total * min_exposed:
+            break
+
+        # Only the window of cells under the footprint's bounding box
+        p_minx, p_miny, p_maxx, p_maxy = product.shape.bounds
+        c0, c1 = np.searchsorted(xs, [p_minx, p_maxx])
+        r0, r1 = np.searchsorted(ys, [p_miny, p_maxy])
+        window = uncovered[r0:r1, c0:c1]
+        if not window.any():
+            continue
+
+        inside = _cells_inside(product.shape, xs[c0:c1], ys[r0:r1])
+        if not (window & inside).any():
+            continue
+
+        selected.append(product)
+        window &= ~inside
+
+    return selected
+
+
+def minimum_coverage(
+        products: Sequence[Product],
+        aoi: BaseGeometry,
+        min_exposed: float = 0.005,
+        cell_size: Optional[float] = None,
+        pieces: int = 8
+) -> List[Product]:
+    """Returns the products needed to cover aoi, preferring the most recent,
+    oldest first. Like get_min_granule_coverage, newer products are taken
+    while they overlap what is left uncovered, until no more than min_exposed
+    of the aoi is. Unlike it, products only touching the uncovered area along
+    an edge are not taken. Only products whose footprints intersect the aoi
+    are considered.
+
+    By default the uncovered area is tracked exactly, on the aoi split into
+    pieces by pieces parts. With a cell_size, in the units of the footprints,
+    it is tracked as a grid of cells instead, which is faster for very large
+    product sets but misses overlaps smaller than a cell."""
+    candidates = list(reversed(triage_products_newest(products_intersecting(products, aoi))))
+
+    if cell_size is None:
+        selected = _cover_exact(candidates, aoi, min_exposed, pieces)
+    else:
+        selected = _cover_grid(candidates, aoi, min_exposed, cell_size)
+
+    return list(reversed(selected))
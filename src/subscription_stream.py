@@ -0,0 +1,152 @@
+"""
+    Incremental processing of HyP3 subscriptions. The listing is paged through
+and handed out a page at a time, so products can be downloaded and masked
+while later pages are still being fetched. Every job keeps a high-water mark
+for its subscription, the last product its last complete run processed by
+listing id, so a rerun only picks up products HyP3 made since.
+"""
+
+import dataclasses as dc
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+from src.http_cache import ResponseCache
+from src.product_catalog import ProductCatalog
+
+PAGE_SIZE = 500
+
+
+@dc.dataclass(frozen=True, order=True)
+class HighWaterMark:
+    """The highest listing id handed out. HyP3 numbers products in the order it
+    processes them, so a product backfilled or reprocessed after a run is newer
+    than the mark however old its acquisition."""
+
+    id: int
+
+    @classmethod
+    def newest(cls, catalogs: Iterable[ProductCatalog]) -> Optional['HighWaterMark']:
+        """Mark of the newest product in catalogs, or None if none has an id."""
+        ids = [catalog.ids.max() for catalog in catalogs if len(catalog)]
+        newest = max(ids, default=-1)
+        return None if newest < 0 else cls(int(newest))
+
+    def newer(self, catalog: ProductCatalog) -> ProductCatalog:
+        """Products in catalog newer than the mark. Products without an id are
+        always newer."""
+        return catalog[(catalog.ids > self.id) | (catalog.ids < 0)]
+
+    def to_json(self) -> str:
+        return json.dumps({'id': self.id})
+
+    @classmethod
+    def from_json(cls, text: str) -> Optional['HighWaterMark']:
+        """None for marks kept by acquisition time, which could miss products,
+        so the next run goes over the whole subscription once."""
+        mark = json.loads(text)
+        return cls(mark['id']) if 'id' in mark else None
+
+
+def mark_path(directory: Union[str, Path], sub_id) -> Path:
+    return Path(directory) / f".subscription_{sub_id}.json"
+
+
+def _settings_json(settings: Optional[Dict[str, Any]]) -> str:
+    return json.dumps(settings or {}, sort_keys=True, default=str)
+
+
+def load_high_water_mark(
+        directory: Union[str, Path], sub_id, settings: Dict[str, Any] = None
+) -> Optional[HighWaterMark]:
+    """The mark the last complete run over subscription into directory left,
+    or None if there was none. Marks left by runs selecting products with
+    other settings, such as another date range or AOI, are None too, since
+    the products those runs left out were never processed."""
+    path = mark_path(directory, sub_id)
+    if not path.exists():
+        return None
+
+    text = path.read_text()
+    if _settings_json(json.loads(text).get('settings')) != _settings_json(settings):
+        print("Product selection changed since the last run, going over the whole subscription again")
+        return None
+    return HighWaterMark.from_json(text)
+
+
+def save_high_water_mark(
+        directory: Union[str, Path], sub_id, mark: HighWaterMark, settings: Dict[str, Any] = None
+) -> None:
+    path = mark_path(directory, sub_id)
+    part_path = path.with_name(path.name + '.part')
+    part_path.write_text(json.dumps({'id': mark.id, 'settings': json.loads(_settings_json(settings))}))
+    # Replaced in one step so a crash never leaves half a mark behind
+    part_path.replace(path)
+
+
+class IncrementalRun:
+    """One run over a subscription into directory. Only products newer than
+    the mark left by the last complete run are handed out, unless rescan, and
+    commit moves the mark up to the newest product the run handed out.
+
+    settings are whatever narrows the products handed out, like the date
+    range and AOI. The mark is only kept while they stay the same."""
+
+    def __init__(
+            self, directory: Union[str, Path], sub_id, rescan: bool = False, settings: Dict[str, Any] = None
+    ):
+        self.directory = Path(directory)
+        self.sub_id = sub_id
+        self.settings = settings
+        self.since = None if rescan else load_high_water_mark(directory, sub_id, settings)
+        self.handed_out: List[ProductCatalog] = []
+
+    def track(self, catalogs: Iterable[ProductCatalog]) -> Iterator[ProductCatalog]:
+        """Passes catalogs through, remembering them as handed out."""
+        for catalog in catalogs:
+            self.handed_out.append(catalog)
+            yield catalog
+
+    def commit(self) -> Optional[HighWaterMark]:
+        """Call once every product handed out has been processed. Returns the
+        new mark."""
+        newest = HighWaterMark.newest(self.handed_out)
+        if newest is not None and (self.since is None or newest > self.since):
+            self.directory.mkdir(parents=True, exist_ok=True)
+            save_high_water_mark(self.directory, self.sub_id, newest, self.settings)
+            return newest
+        return self.since
+
+
+def sub_pages(
+        api,
+        sub_id,
+        since: Optional[HighWaterMark] = None,
+        page_size: int = PAGE_SIZE,
+        cache: ResponseCache = None
+) -> Iterator[ProductCatalog]:
+    """Yields a catalog of every page of the subscription's listing as it
+    arrives, holding only products newer than since. api is an API, or a
+    function returning one which is only called when a page is not in cache."""
+    hyp3 = None
+
+    def fetch(page: int) -> List[dict]:
+        nonlocal hyp3
+        if hyp3 is None:
+            hyp3 = api() if callable(api) else api
+        return [{key: product.get(key) for key in ('id', 'name', 'granule', 'url')}
+                for product in hyp3.get_products(sub_id=sub_id, page=page, page_size=page_size)]
+
+    page = 0
+    while True:
+        if cache is None:
+            listing = fetch(page)
+        else:
+            listing = cache.cached('hyp3_products', f"{sub_id}/{page}/{page_size}", lambda: fetch(page))
+
+        catalog = ProductCatalog.from_listing(listing)
+        yield catalog if since is None else since.newer(catalog)
+
+        if len(listing) < page_size:
+            return
+        page += 1
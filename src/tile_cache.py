@@ -0,0 +1,120 @@
+"""
+    Content addressed, on disk cache of predicted tile masks. Tiles are keyed
+by the model's weights, the tile's VV/VH content and the tile size, so
+re-masking a frame only predicts the tiles whose inputs changed. The least
+recently used tiles are evicted once the cache exceeds its byte budget.
+
+    Several processes may share a cache directory. Tiles are written under a
+temporary name and renamed into place, so they are never read half written,
+and tiles another process evicted meanwhile are treated as misses.
+"""
+
+import hashlib
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from src.config import TILE_CACHE_DIR
+
+DEFAULT_CACHE_BYTES = 10 * 2**30
+
+
+class TileCache:
+    """Tiles are stored bit packed, 1/8 byte per pixel, in 256 subdirectories
+    named after the first two characters of their key."""
+
+    def __init__(self, directory: Union[str, Path] = TILE_CACHE_DIR, max_bytes: int = DEFAULT_CACHE_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.size = sum(size for _, size, _ in self._tiles())
+
+    @staticmethod
+    def key(model_digest: str, vv_tile: np.ndarray, vh_tile: np.ndarray) -> str:
+        h = hashlib.blake2b(digest_size=20)
+        h.update(model_digest.encode())
+        h.update(str(vv_tile.shape).encode())
+        h.update(np.ascontiguousarray(vv_tile).tobytes())
+        h.update(np.ascontiguousarray(vh_tile).tobytes())
+        return h.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.npy"
+
+    def _tiles(self) -> List[Tuple[float, int, Path]]:
+        """Modification time, size and path of every tile still in place."""
+        tiles = []
+        for path in self.directory.glob('*/*.npy'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            tiles.append((stat.st_mtime, stat.st_size, path))
+        return tiles
+
+    def get(self, key: str, shape: Tuple[int, int]) -> Optional[np.ndarray]:
+        """Returns the cached mask for key, or None on a miss."""
+        path = self._path(key)
+        try:
+            packed = np.load(path)
+        except (FileNotFoundError, ValueError):
+            self.misses += 1
+            return None
+
+        # Mark as recently used for eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        self.hits += 1
+        return np.unpackbits(packed, count=shape[0] * shape[1]).reshape(shape)
+
+    def put(self, key: str, mask: np.ndarray) -> None:
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        part_path = path.with_name(f"{key}.{os.getpid()}.{threading.get_ident()}.part")
+        with open(part_path, 'wb') as f:
+            np.save(f, np.packbits(mask.astype(bool)))
+        size = part_path.stat().st_size
+        os.replace(part_path, path)
+        with self._lock:
+            self.size += size
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self, fraction: float = 0.9) -> None:
+        """Removes the least recently used tiles until the cache is below
+        fraction of its budget."""
+        tiles = sorted(self._tiles(), key=lambda tile: tile[0])
+        self.size = sum(size for _, size, _ in tiles)
+        for _, size, path in tiles:
+            if self.size <= self.max_bytes * fraction:
+                break
+            path.unlink(missing_ok=True)
+            self.size -= size
+
+    def report(self) -> str:
+        lookups = self.hits + self.misses
+        return (
+            f"Tile cache: {self.hits} hits, {self.misses} misses "
+            f"({self.hits / max(lookups, 1):.0%} hit rate), {self.size / 2**20:.1f} MiB"
+        )
+
+
+_caches: Dict[Tuple[str, int], TileCache] = {}
+
+
+def get_tile_cache(directory: Union[str, Path], max_bytes: int = DEFAULT_CACHE_BYTES) -> TileCache:
+    """Returns the process wide TileCache for directory, so its size is only
+    scanned once per process."""
+    key = (str(Path(directory).resolve()), max_bytes)
+    if key not in _caches:
+        _caches[key] = TileCache(directory, max_bytes)
+    return _caches[key]
@@ -0,0 +1,73 @@
+"""
+Stand in for CMR's granule search, so footprint lookups can be tested and
+benchmarked offline. Answers form POSTs like CMR_URL with the footprints of the
+granules it was given.
+"""
+
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+from urllib.parse import parse_qs
+
+
+def random_granules(n: int, seed: int = 0) -> Dict[str, str]:
+    """n granule ids with CMR style footprints ('lat lon lat lon ...' rings)."""
+    rng = random.Random(seed)
+    granules = {}
+    for i in range(n):
+        lat, lon = rng.uniform(-60, 60), rng.uniform(-170, 170)
+        ring = [(lat, lon), (lat, lon + 2.5), (lat + 2, lon + 2.5), (lat + 2, lon), (lat, lon)]
+        start = 20200101 + i % 28
+        granule = f"S1A_IW_GRDH_1SDV_{start}T000000_{start}T000025_{i:06d}_03D795_F52E"
+        granules[granule] = ' '.join(f"{lat:.6f} {lon:.6f}" for lat, lon in ring)
+    return granules
+
+
+class CMRHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        self.server.requests += 1
+        time.sleep(self.server.latency)
+
+        ids = form.get('producer_granule_id[]', []) + form.get('producer_granule_id', [])
+        page_size = int(form.get('page_size', ['10'])[0])
+        page_num = int(form.get('page_num', ['1'])[0])
+
+        entries = [
+            {'producer_granule_id': granule, 'polygons': [[self.server.granules[granule]]]}
+            for granule in ids if granule in self.server.granules
+        ]
+        page = entries[(page_num - 1) * page_size:page_num * page_size]
+
+        body = json.dumps({'feed': {'entry': page}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubCMRServer(ThreadingHTTPServer):
+    """Serves granules on a free localhost port from a background thread.
+    Every request waits latency seconds, and requests counts them."""
+
+    def __init__(self, granules: Dict[str, str], latency: float = 0.0):
+        super().__init__(('127.0.0.1', 0), CMRHandler)
+        self.granules = granules
+        self.latency = latency
+        self.requests = 0
+        self.url = f"http://127.0.0.1:{self.server_port}/search/granules.json"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,31 @@
+"""
+Stand in for the HyP3 API's paged product listing, so subscriptions can be
+paged through offline.
+"""
+
+from typing import List
+
+
+def granule(day: int, hour: int = 0, index: int = 0) -> str:
+    """Name of a granule acquired on a day of January 2020."""
+    start = f"202001{day:02d}T{hour:02d}0000"
+    end = f"202001{day:02d}T{hour:02d}0025"
+    return f"S1A_IW_GRDH_1SDV_{start}_{end}_{index:06d}_03D795_F52E"
+
+
+def listing(granules: List[str]) -> List[dict]:
+    """Subscription listing entries for granules."""
+    return [{'name': f"{g}.zip", 'granule': g, 'url': f"https://example.com/{g}.zip", 'id': i}
+            for i, g in enumerate(granules)]
+
+
+class PagedAPI:
+    """Serves a listing in pages like the HyP3 API, counting requests."""
+
+    def __init__(self, products):
+        self.products = products
+        self.requests = 0
+
+    def get_products(self, sub_id, page, page_size):
+        self.requests += 1
+        return self.products[page * page_size:(page + 1) * page_size]
@@ -5,9 +5,13 @@
  Description:  unit test for functions from geo_utility.py
 """
 
+import mock
 import numpy as np
 import pytest
-from src.geo_utility import pad_image, get_tile_dimensions, stride_tile_image
+from osgeo import gdal
+from src.config import STRIP_ROWS
+from src.gdal_wrapper import gdal_open
+from src.geo_utility import MaskStats, auto_batch_size, create_water_mask, nodata_tiles, pad_image, predict_strip, get_tile_dimensions, stride_tile_image
 
 
 # tests for tile_image()
@@ -33,3 +37,129 @@ def test_get_tile_dimensions():
     input = get_tile_dimensions(2000, 2000, 512)
     expected = (4, 4)
     assert input == expected, "dimensions do not match"
+
+
+class ThresholdModel:
+    """Stand in for the masked model. Predicts water where VV is below VH."""
+
+    def predict(self, x, batch_size=1, verbose=0):
+        return (x[..., :1] < x[..., 1:]).astype('float32')
+
+
+def write_tif(path, array):
+    f = gdal.GetDriverByName('GTiff').Create(str(path), array.shape[1], array.shape[0], 1, gdal.GDT_Float32)
+    f.SetGeoTransform((0, 10, 0, 0, 0, -10))
+    f.GetRasterBand(1).WriteArray(array)
+    f = None
+
+
+@pytest.fixture
+def sample_scene(tmp_path):
+    rng = np.random.default_rng(0)
+    vv = rng.random((1100, 1300), dtype='float32')
+    vh = rng.random((1100, 1300), dtype='float32')
+    # Blackfill border like an RTC product
+    vv[:, :200] = 0
+    vh[:, :200] = 0
+    write_tif(tmp_path / "vv.tif", vv)
+    write_tif(tmp_path / "vh.tif", vh)
+    return tmp_path
+
+
+def mask_whole_and_streamed(scene, **options):
+    """Masks scene as a single strip and with options, returns both masks."""
+    vv, vh = str(scene / "vv.tif"), str(scene / "vh.tif")
+    full, streamed = str(scene / "full.tif"), str(scene / "streamed.tif")
+
+    with mock.patch("src.geo_utility.activation_bytes", return_value=2**20):
+        create_water_mask(ThresholdModel(), vv, vh, full, strip_rows=None, readers=1)
+        create_water_mask(ThresholdModel(), vv, vh, streamed, **options)
+
+    with gdal_open(full) as f:
+        full_mask = f.ReadAsArray()
+    with gdal_open(streamed) as f:
+        streamed_mask = f.ReadAsArray()
+    return full_mask, streamed_mask
+
+
+@pytest.mark.parametrize("strip_rows, batch_size, readers", [(1, 1, 1), (2, 1, 2), (1, 'auto', 3), (None, 4, 2)])
+def test_create_water_mask_streaming_matches_full_scene(sample_scene, strip_rows, batch_size, readers):
+    full_mask, streamed_mask = mask_whole_and_streamed(
+        sample_scene, strip_rows=strip_rows, batch_size=batch_size, readers=readers
+    )
+
+    assert full_mask.shape == (1536, 1536)
+    assert full_mask.any()
+    assert np.array_equal(full_mask, streamed_mask)
+
+
+@pytest.mark.parametrize("strip_rows", [2, 3, STRIP_ROWS])
+def test_create_water_mask_last_strip_shorter(tmp_path, strip_rows):
+    # 5 rows of tiles, which none of the strip heights divide
+    rng = np.random.default_rng(1)
+    write_tif(tmp_path / "vv.tif", rng.random((2400, 600), dtype='float32'))
+    write_tif(tmp_path / "vh.tif", rng.random((2400, 600), dtype='float32'))
+
+    full_mask, streamed_mask = mask_whole_and_streamed(tmp_path, strip_rows=strip_rows)
+
+    assert full_mask.shape == (2560, 1024)
+    assert full_mask.any()
+    assert np.array_equal(full_mask, streamed_mask)
+
+
+def test_create_water_mask_streams_by_default(sample_scene):
+    vv, vh = str(sample_scene / "vv.tif"), str(sample_scene / "vh.tif")
+
+    with mock.patch("src.geo_utility.run_pipeline", return_value=[]) as run_pipeline:
+        create_water_mask(ThresholdModel(), vv, vh, str(sample_scene / "mask.tif"))
+
+    assert run_pipeline.call_args.args[0] == range(0, 3, STRIP_ROWS)
+
+
+@pytest.mark.parametrize("memory, expected", [(10 * 2**20, 5), (100 * 2**20, 16), (2**20, 1)])
+def test_auto_batch_size(memory, expected):
+    with mock.patch("src.geo_utility.available_memory", return_value=memory), \
+            mock.patch("src.geo_utility.activation_bytes", return_value=2**20):
+        assert auto_batch_size(None, max_tiles=16) == expected
+
+
+def test_nodata_tiles():
+    tiles = np.ones((3, 4, 4))
+    tiles[0] = 0
+    tiles[1, :2] = 0
+
+    assert nodata_tiles(tiles).tolist() == [True, False, False]
+    assert nodata_tiles(tiles, 0.5).tolist() == [True, True, False]
+
+
+def test_predict_strip_skips_nodata_tiles():
+    model = mock.Mock(wraps=ThresholdModel())
+    vv = np.ones((512, 1536))
+    vh = np.full((512, 1536), 2.0)
+    vv[:, :512] = 0
+    stats = MaskStats()
+
+    mask = predict_strip(model, vv, vh, stats=stats)
+
+    assert model.predict.call_args[0][0].shape == (2, 512, 512, 2)
+    assert stats.tiles == 3 and stats.skipped == 1
+    assert not mask[:, :512].any()
+    assert mask[:, 512:].all()
+
+
+def test_create_water_mask_preview(sample_scene):
+    outfile = str(sample_scene / "preview.tif")
+
+    create_water_mask(
+        ThresholdModel(), str(sample_scene / "vv.tif"), str(sample_scene / "vh.tif"), outfile,
+        batch_size=2, preview_factor=4
+    )
+
+    with gdal_open(outfile) as f:
+        assert (f.RasterYSize, f.RasterXSize) == (512, 512)
+        assert f.GetGeoTransform()[1] == 40
+        mask = f.ReadAsArray()
+
+    # 1100 x 1300 scene decimated to 275 x 325 with a 50 pixel blackfill border
+    assert mask[:275, 50:325].any()
+    assert not mask[:, :50].any() and not mask[275:].any()
@@ -0,0 +1,44 @@
+"""
+ File Name:    test_http_cache.py
+ Description:  unit tests for the SQLite response cache
+"""
+
+from unittest import mock
+
+from src.http_cache import ResponseCache
+
+
+def test_response_cache_persists(tmp_path):
+    cache = ResponseCache(tmp_path / 'cache.sqlite')
+    assert cache.get('cmr_footprint', 'granule') is None
+    cache.put('cmr_footprint', 'granule', '1 2 3 4')
+    cache.close()
+
+    cache = ResponseCache(tmp_path / 'cache.sqlite')
+    assert cache.get('cmr_footprint', 'granule') == '1 2 3 4'
+    assert cache.get('hyp3_products', 'granule') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_response_cache_ttl(tmp_path):
+    cache = ResponseCache(tmp_path / 'cache.sqlite', ttls={'listing': 60, 'forever': None})
+    with mock.patch('src.http_cache.time.time', return_value=1000):
+        cache.put('listing', '1', [1, 2])
+        cache.put('forever', '1', [3])
+
+    with mock.patch('src.http_cache.time.time', return_value=1059):
+        assert cache.get('listing', '1') == [1, 2]
+    with mock.patch('src.http_cache.time.time', return_value=10**9):
+        assert cache.get('listing', '1') is None
+        assert cache.get('forever', '1') == [3]
+
+
+def test_response_cache_refresh(tmp_path):
+    ResponseCache(tmp_path / 'cache.sqlite').put('hyp3_products', '1', ['old'])
+    cache = ResponseCache(tmp_path / 'cache.sqlite', refresh=True)
+
+    fetch = mock.Mock(return_value=['new'])
+    assert cache.cached('hyp3_products', '1', fetch) == ['new']
+    fetch.assert_called_once()
+
+    assert ResponseCache(tmp_path / 'cache.sqlite').get('hyp3_products', '1') == ['new']
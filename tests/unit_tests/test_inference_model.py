@@ -0,0 +1,58 @@
+"""
+ File Name:    test_inference_model.py
+ Description:  unit test for functions from model/inference.py
+"""
+
+import numpy as np
+import pytest
+from keras.layers import Activation, BatchNormalization, Dropout, Input
+from keras.layers.convolutional import Conv2D, Conv2DTranspose
+from keras.layers.merge import concatenate
+from keras.layers.pooling import MaxPooling2D
+from keras.models import Model
+
+from src.model.inference import strip_for_inference
+
+
+@pytest.fixture
+def small_unet() -> Model:
+    inputs = Input(shape=(16, 16, 2))
+    c1 = Conv2D(4, (3, 3), padding='same')(inputs)
+    c1 = BatchNormalization()(c1)
+    c1 = Activation('relu')(c1)
+    p1 = Dropout(0.5)(MaxPooling2D((2, 2))(c1))
+
+    c2 = Conv2D(8, (3, 3), padding='same', use_bias=False)(p1)
+    c2 = BatchNormalization()(c2)
+    c2 = Activation('relu')(c2)
+
+    u3 = Conv2DTranspose(4, (3, 3), strides=(2, 2), padding='same')(c2)
+    u3 = BatchNormalization()(u3)
+    u3 = Dropout(0.5)(concatenate([u3, c1]))
+    outputs = Conv2D(1, (1, 1), activation='sigmoid')(u3)
+    model = Model(inputs=inputs, outputs=[outputs])
+
+    # Give the BatchNormalization layers non trivial statistics
+    rng = np.random.default_rng(0)
+    for layer in model.layers:
+        if isinstance(layer, BatchNormalization):
+            gamma, beta, mean, variance = layer.get_weights()
+            layer.set_weights([
+                rng.uniform(0.5, 2, gamma.shape), rng.normal(size=beta.shape),
+                rng.normal(size=mean.shape), rng.uniform(0.5, 2, variance.shape)
+            ])
+    return model
+
+
+def test_strip_for_inference_matches_model(small_unet: Model):
+    stripped = strip_for_inference(small_unet)
+    x = np.random.default_rng(1).random((3, 16, 16, 2), dtype=np.float32)
+
+    assert np.allclose(stripped.predict(x), small_unet.predict(x), atol=1e-5)
+
+
+def test_strip_for_inference_removes_layers(small_unet: Model):
+    stripped = strip_for_inference(small_unet)
+
+    assert not [l for l in stripped.layers if isinstance(l, (BatchNormalization, Dropout))]
+    assert len(stripped.layers) == len(small_unet.layers) - 5
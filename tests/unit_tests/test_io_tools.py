@@ -8,7 +8,9 @@
 import os
 import pytest
 from pathlib import Path
-from src.io_tools import extract_from_product, polygon_from_shapefile
+import zipfile
+from osgeo import gdal
+from src.io_tools import extract_from_product, locate_sar_members, polygon_from_shapefile
 from shapely.geometry import Polygon
 
 
@@ -36,6 +38,32 @@ def test_extract_from_product():
     assert expected_vh == vh, f"EXPECTED={expected_vh}, GOT={vh}"
 
 
+@pytest.mark.usefixtures("supply_datadir_cwd")
+def test_locate_sar_members():
+    """Test that vv/vh tifs are opened in place without being extracted"""
+    input_path = Path('S1A_IW_20191203T224518_DVP_RTC10_G_gpuned_54B9.zip')
+    before = set(os.listdir('.'))
+    vv, vh = locate_sar_members(input_path)
+
+    zip_path = input_path.resolve()
+    member = 'S1A_IW_20191203T224518_DVP_RTC10_G_gpuned_54B9/S1A_IW_20191203T224518_DVP_RTC10_G_gpuned_54B9'
+    assert vv == f"/vsizip/{zip_path}/{member}_VV.tif"
+    assert vh == f"/vsizip/{zip_path}/{member}_VH.tif"
+    assert gdal.VSIStatL(vv) is not None
+    assert gdal.VSIStatL(vh) is not None
+
+    assert set(os.listdir('.')) == before
+
+
+def test_locate_sar_members_missing_band(tmp_path):
+    product = tmp_path / 'S1A_IW_product.zip'
+    with zipfile.ZipFile(product, 'w') as zf:
+        zf.writestr('S1A_IW_product/S1A_IW_product_VV.tif', b'')
+
+    with pytest.raises(FileNotFoundError):
+        locate_sar_members(product)
+
+
 @pytest.mark.usefixtures("supply_datadir_cwd")
 def test_polygon_from_shapefile():
     input_path = Path('gnis_mekong_aoi')
@@ -0,0 +1,152 @@
+"""
+ File Name:    test_job_journal.py
+ Description:  unit tests for the crash safe journal of masking jobs
+"""
+
+import hashlib
+import os
+from unittest import mock
+
+import numpy as np
+from osgeo import gdal
+
+from src.job_journal import JobJournal, job_settings, model_file_digest, product_key
+
+
+def write_mask(path, size=64):
+    dataset = gdal.GetDriverByName('GTiff').Create(str(path), size, size, 1, gdal.GDT_Byte)
+    dataset.GetRasterBand(1).WriteArray(np.ones((size, size), dtype=np.uint8))
+    dataset = None
+    return path
+
+
+def make_job(tmp_path):
+    product = tmp_path / 'S1A_IW_20200101T000000_DVP_RTC30_G_gpuned_0000.zip'
+    product.write_bytes(os.urandom(1000))
+    output_dir = tmp_path / 'masks'
+    output_dir.mkdir()
+    return product, output_dir
+
+
+def test_product_key():
+    assert product_key('https://hyp3-download.asf.alaska.edu/asf/data/S1A_IW_0000.zip?a=1') == 'S1A_IW_0000.zip'
+    assert product_key(os.path.join('products', 'S1A_IW_0000.zip')) == 'S1A_IW_0000.zip'
+
+
+def test_journal_stages(tmp_path):
+    product, output_dir = make_job(tmp_path)
+    journal = JobJournal(output_dir)
+
+    assert journal.stage(product.name) is None
+    journal.downloaded(product.name, product)
+    assert journal.stage(product.name) == 'downloaded'
+    assert not journal.finished(product.name)
+
+    journal.masked(product.name, write_mask(output_dir / f"{product.stem}.tif"))
+    assert journal.verify(product.name)
+    assert journal.stage(product.name) == 'verified'
+    assert journal.finished(product.name, product)
+    assert journal.summary() == {'verified': 1}
+
+
+def test_journal_survives_reopening(tmp_path):
+    product, output_dir = make_job(tmp_path)
+    journal = JobJournal(output_dir)
+    journal.downloaded(product.name, product)
+    journal.masked(product.name, write_mask(output_dir / f"{product.stem}.tif"))
+    # Dies before verifying
+    journal.close()
+
+    journal = JobJournal(output_dir)
+    assert journal.stage(product.name) == 'masked'
+    assert journal.finished(product.name)
+    assert journal.stage(product.name) == 'verified'
+
+
+def test_journal_redoes_truncated_masks(tmp_path):
+    product, output_dir = make_job(tmp_path)
+    output = write_mask(output_dir / f"{product.stem}.tif", size=512)
+    journal = JobJournal(output_dir)
+    journal.downloaded(product.name, product)
+    journal.masked(product.name, output)
+
+    with open(output, 'r+b') as f:
+        f.truncate(output.stat().st_size // 2)
+
+    assert not journal.finished(product.name)
+    assert journal.stage(product.name) == 'downloaded'
+
+
+def test_journal_input_hash(tmp_path):
+    product, output_dir = make_job(tmp_path)
+    journal = JobJournal(output_dir)
+    journal.downloaded(product.name, product)
+    journal.masked(product.name, write_mask(output_dir / f"{product.stem}.tif"))
+    journal.verify(product.name)
+
+    # Touched but unchanged inputs are still finished
+    os.utime(product, ns=(0, 0))
+    assert journal.finished(product.name, product)
+
+    product.write_bytes(os.urandom(1000))
+    assert not journal.finished(product.name, product)
+    journal.downloaded(product.name, product)
+    assert journal.stage(product.name) == 'downloaded'
+
+
+def test_journal_uses_recorded_digest(tmp_path):
+    product, output_dir = make_job(tmp_path)
+    digest = hashlib.sha512(product.read_bytes()).hexdigest()
+    product.with_name(f"{product.name}.sha512").write_text(f"{'0' * 128}  {product.name}\n")
+    journal = JobJournal(output_dir)
+
+    journal.downloaded(product.name, product)
+
+    # Not hashed again when download_product recorded the digest
+    assert journal._row(product.name)['input_hash'] == '0' * 128 != digest
+
+
+def test_journal_restart(tmp_path):
+    product, output_dir = make_job(tmp_path)
+    settings = job_settings('model', {'backend': 'keras', 'readers': 2})
+    journal = JobJournal(output_dir, settings=settings)
+    journal.downloaded(product.name, product)
+    journal.close()
+
+    # Options that only change speed keep the journal
+    journal = JobJournal(output_dir, settings=job_settings('model', {'backend': 'keras', 'readers': 8}))
+    assert journal.stage(product.name) == 'downloaded'
+    journal.close()
+
+    assert JobJournal(output_dir, restart=True, settings=settings).stage(product.name) is None
+
+    journal = JobJournal(output_dir, settings=settings)
+    journal.downloaded(product.name, product)
+    journal.close()
+    assert JobJournal(output_dir, settings=job_settings('other_model', {})).stage(product.name) is None
+
+
+def test_journal_restarts_for_retrained_model(tmp_path):
+    product, output_dir = make_job(tmp_path)
+    journal = JobJournal(output_dir, settings=job_settings('model', {}, 'digest'))
+    journal.downloaded(product.name, product)
+    journal.close()
+
+    assert JobJournal(output_dir, settings=job_settings('model', {}, 'digest')).stage(product.name) == 'downloaded'
+    # Same name, new weights
+    assert JobJournal(output_dir, settings=job_settings('model', {}, 'retrained')).stage(product.name) is None
+
+
+def test_model_file_digest(tmp_path):
+    model_dir = tmp_path / 'net'
+    model_dir.mkdir()
+    (model_dir / 'latest.h5').write_bytes(b'weights')
+    (model_dir / 'latest.tflite').write_bytes(b'flatbuffer')
+
+    with mock.patch('src.model_paths.MODEL_DIR', tmp_path):
+        digest = model_file_digest('net')
+        assert digest == hashlib.sha512(b'weights').hexdigest()
+        assert model_file_digest('net', 'tflite') == hashlib.sha512(b'flatbuffer').hexdigest()
+
+        (model_dir / 'latest.h5').write_bytes(b'retrained')
+        assert model_file_digest('net') != digest
@@ -0,0 +1,47 @@
+"""
+ File Name:    test_mask_class.py
+ Description:  unit tests for masking a subscription with the Mask class
+"""
+
+from datetime import datetime
+from unittest import mock
+
+from src.mask_class import Mask
+from src.product_download_api import DownloadStats
+from tests.hyp3_stub import PagedAPI, granule, listing
+
+
+def make_mask(tmp_path, api):
+    user = mock.MagicMock(api=api, mask_path=str(tmp_path))
+    with mock.patch('src.mask_class.grab_subscription', return_value={'id': 3}):
+        return Mask(user, 'test', datetime(2019, 12, 31), datetime(2020, 2, 1))
+
+
+def test_mask_subscription_masks_each_page_once(tmp_path):
+    api = PagedAPI(listing([granule(day, hour) for day in range(1, 29) for hour in range(0, 24, 6)]))
+    mask = make_mask(tmp_path, api)
+
+    masked = []
+    with mock.patch.object(Mask, '_mask_products', autospec=True,
+                           side_effect=lambda self: masked.extend(self.products) or DownloadStats()):
+        mask.mask_subscription()
+
+        assert sorted(product.granule for product in masked) == sorted(p['granule'] for p in api.products)
+
+        # A rerun finds nothing new to mask
+        masked.clear()
+        mask.mask_subscription()
+        assert masked == []
+
+
+def test_mask_subscription_retries_after_failures(tmp_path):
+    api = PagedAPI(listing([granule(day) for day in range(1, 6)]))
+    mask = make_mask(tmp_path, api)
+
+    masked = []
+    with mock.patch.object(Mask, '_mask_products', autospec=True,
+                           side_effect=lambda self: masked.extend(self.products) or DownloadStats(failed=1)):
+        mask.mask_subscription()
+        mask.mask_subscription()
+
+    assert len(masked) == 10
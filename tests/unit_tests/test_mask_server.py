@@ -0,0 +1,103 @@
+"""
+ File Name:    test_mask_server.py
+ Description:  unit test for mask_server.py and mask_client.py
+"""
+
+import threading
+from unittest import mock
+
+import pytest
+import requests
+from src.mask_client import server_status, submit_mask_job
+from src.mask_server import MaskServer, is_loopback
+
+
+@pytest.fixture
+def mask_server(tmp_path):
+    masked = []
+
+    def fake_mask(model, vv_path, vh_path, outfile, **options):
+        if model == "broken":
+            raise ValueError("no such model")
+        masked.append((model, outfile, options))
+
+    server = MaskServer(('127.0.0.1', 0), mask_func=fake_mask, root=tmp_path, batch_size=4)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", masked
+    server.shutdown()
+    server.server_close()
+
+
+def test_submit_mask_job(mask_server, tmp_path):
+    url, masked = mask_server
+    outfile = tmp_path / "mask.tif"
+
+    submit_mask_job(url, "net", str(tmp_path / "vv.tif"), str(tmp_path / "vh.tif"), str(outfile), strip_rows=1)
+
+    assert masked == [("net", str(outfile.resolve()), {'batch_size': 4, 'strip_rows': 1})]
+    assert server_status(url)['completed'] == 1
+
+
+def test_job_paths_resolved_under_root(mask_server, tmp_path):
+    url, masked = mask_server
+
+    response = requests.post(f"{url}/jobs", json={
+        'model': 'net', 'vv_path': 'vv.tif', 'vh_path': 'vh.tif', 'outfile': 'masks/mask.tif'
+    })
+
+    assert response.status_code == 200
+    assert masked == [("net", str((tmp_path / "masks" / "mask.tif").resolve()), {'batch_size': 4})]
+
+
+@pytest.mark.parametrize("outfile", ["../mask.tif", "/etc/mask.tif", "masks/../../mask.tif"])
+def test_job_outside_root_is_rejected(mask_server, outfile):
+    url, masked = mask_server
+
+    response = requests.post(f"{url}/jobs", json={
+        'model': 'net', 'vv_path': 'vv.tif', 'vh_path': 'vh.tif', 'outfile': outfile
+    })
+
+    assert response.status_code == 400
+    assert "outside" in response.json()['error']
+    assert masked == []
+
+
+def test_submit_mask_job_error(mask_server, tmp_path):
+    url, _ = mask_server
+
+    with pytest.raises(RuntimeError, match="no such model"):
+        submit_mask_job(url, "broken", str(tmp_path / "vv.tif"), str(tmp_path / "vh.tif"), str(tmp_path / "mask.tif"))
+
+    assert server_status(url)['failed'] == 1
+
+
+def test_bad_job_is_rejected(mask_server):
+    url, _ = mask_server
+
+    response = requests.post(f"{url}/jobs", json={'model': 'net', 'color': 'blue'})
+
+    assert response.status_code == 400
+
+
+def test_models_warmed_with_default_backend():
+    with mock.patch('src.mask_server.get_model') as get_model:
+        server = MaskServer(('127.0.0.1', 0), models=['net'], mask_func=lambda *args, **options: None,
+                            backend='tflite')
+        server.server_close()
+
+    get_model.assert_called_once_with('net', 'tflite')
+
+
+@pytest.mark.parametrize("host", ["0.0.0.0", "192.0.2.1", "example.com"])
+def test_non_loopback_host_is_refused(host):
+    with pytest.raises(ValueError, match="non-loopback"):
+        MaskServer((host, 0), mask_func=lambda *args, **options: None)
+
+
+def test_is_loopback():
+    assert is_loopback('127.0.0.1')
+    assert is_loopback('::1')
+    assert is_loopback('localhost')
+    assert not is_loopback('0.0.0.0')
+    assert not is_loopback('example.com')
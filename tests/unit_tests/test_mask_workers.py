@@ -0,0 +1,180 @@
+"""
+ File Name:    test_mask_workers.py
+ Description:  unit test for functions from mask_workers.py
+"""
+
+import json
+import os
+import threading
+import time
+import zipfile
+from unittest import mock
+
+import pytest
+from src.job_journal import JobJournal
+from src.mask_workers import available_cores, core_slices, longest_first, mask_products_parallel, \
+    mask_products_pipelined
+
+
+@pytest.mark.parametrize("workers, cores, expected", [
+    (2, range(8), [[0, 1, 2, 3], [4, 5, 6, 7]]),
+    (3, range(8), [[0, 1], [2, 3], [4, 5]]),
+    (3, [4, 5], [[4], [5], [4]]),
+])
+def test_core_slices(workers, cores, expected):
+    assert core_slices(workers, cores) == expected
+
+
+def test_longest_first(tmp_path):
+    sizes = {"small.zip": 1, "large.zip": 100, "medium.zip": 10}
+    for name, size in sizes.items():
+        (tmp_path / name).write_bytes(b"0" * size)
+
+    ordered = longest_first([tmp_path / name for name in sizes])
+
+    assert [path.name for path in ordered] == ["large.zip", "medium.zip", "small.zip"]
+
+
+class FakeStore:
+    """Downloads are sleeps writing 100 byte products."""
+
+    def __init__(self, directory, workers):
+        self.directory = directory
+        self.engine = mock.Mock(workers=workers)
+        self.references = {}
+        self.lock = threading.Lock()
+        self.peak = 0
+
+    def acquire(self, urls):
+        for url in urls:
+            time.sleep(0.02)
+            path = self.directory / url
+            path.write_bytes(bytes(100))
+            with self.lock:
+                self.references[path] = 1
+                self.peak = max(self.peak, len(self.references))
+            yield path
+
+    def release(self, path):
+        with self.lock:
+            del self.references[path]
+
+
+@pytest.mark.parametrize("prefetch_bytes, peak", [(None, 6), (100, 2)])
+def test_mask_products_pipelined(tmp_path, prefetch_bytes, peak):
+    store = FakeStore(tmp_path, workers=2)
+    masked = []
+
+    def fake_mask(model, vv_path, vh_path, outfile, **options):
+        time.sleep(0.02)
+        masked.append(outfile)
+
+    with mock.patch("src.mask_workers.get_model"), \
+            mock.patch("src.mask_workers.locate_sar_members", return_value=('vv', 'vh')), \
+            mock.patch("src.mask_workers.create_water_mask", fake_mask):
+        stats = mask_products_pipelined(
+            'model', store, [f"{i}.zip" for i in range(6)], tmp_path, prefetch=2, prefetch_bytes=prefetch_bytes
+        )
+
+    assert masked == [str(tmp_path / f"{i}.tif") for i in range(6)]
+    assert store.references == {}
+    # Products held between download and release are bounded by the byte budget
+    assert store.peak <= peak
+    assert [stage.name for stage in stats] == ['download', 'mask', 'release']
+
+
+def test_mask_products_pipelined_resumes(tmp_path):
+    output_dir = tmp_path / 'masks'
+    output_dir.mkdir()
+    urls = [f"{i}.zip" for i in range(4)]
+
+    def fake_mask(model, vv_path, vh_path, outfile, **options):
+        masked.append(outfile)
+        with open(outfile, 'wb') as f:
+            f.write(b'mask')
+
+    def run():
+        store = FakeStore(tmp_path, workers=2)
+        store.acquire = mock.Mock(wraps=store.acquire)
+        with mock.patch("src.mask_workers.get_model"), \
+                mock.patch("src.mask_workers.locate_sar_members", return_value=('vv', 'vh')), \
+                mock.patch("src.mask_workers.create_water_mask", fake_mask), \
+                mock.patch("src.job_journal.readable_raster", return_value=True):
+            mask_products_pipelined('model', store, urls, output_dir, journal=JobJournal(output_dir))
+        return store
+
+    masked = []
+    run()
+    assert len(masked) == 4
+
+    # A rerun after losing one mask only downloads and masks that one again
+    (output_dir / '2.tif').unlink()
+    masked = []
+    store = run()
+    assert masked == [str(output_dir / '2.tif')]
+    assert store.acquire.call_count == 1
+
+
+class StubModel:
+    """Stands in for a loaded model in the spawned workers."""
+    name = 'stub'
+
+
+def stub_mask(model, vv_path, vh_path, outfile, **options):
+    """Records which worker masked the scene, on which cores and when."""
+    start = time.time()
+    time.sleep(0.2)
+    with open(outfile, 'w') as f:
+        json.dump({
+            'model': model.name,
+            'pid': os.getpid(),
+            'cores': sorted(os.sched_getaffinity(0)),
+            'start': start,
+            'end': time.time(),
+            'options': options
+        }, f)
+
+
+def make_product(directory, name):
+    path = directory / f"S1A_IW_{name}.zip"
+    with zipfile.ZipFile(path, 'w') as zf:
+        for pol in ('VV', 'VH'):
+            zf.writestr(f"S1A_IW_{name}/S1A_IW_{name}_{pol}.tif", b'')
+    return path
+
+
+def test_mask_products_parallel(tmp_path):
+    products = [make_product(tmp_path, f"product{i}") for i in range(4)]
+    output_dir = tmp_path / 'masks'
+    output_dir.mkdir()
+    journal = JobJournal(output_dir)
+
+    with mock.patch("src.job_journal.readable_raster", return_value=True):
+        masks = list(mask_products_parallel(
+            StubModel(), products, output_dir, workers=2, recycle_after=1, journal=journal, mask_func=stub_mask,
+            strip_rows=2
+        ))
+
+        assert sorted(name for name, _ in masks) == sorted(product.stem for product in products)
+        assert journal.summary() == {'verified': 4}
+
+        runs = [json.loads((output_dir / f"{product.stem}.tif").read_text()) for product in products]
+        assert {run['model'] for run in runs} == {'stub'}
+        # Each worker masks on as many threads as its slice has cores
+        assert all(run['options'] == {'strip_rows': 2, 'threads': len(run['cores'])} for run in runs)
+        # Every scene was masked by a worker of its own
+        assert len({run['pid'] for run in runs}) == 4
+
+        slices = core_slices(2)
+        assert all(run['cores'] in slices for run in runs)
+        if len(available_cores()) >= 2:
+            # Workers masking at the same time, replacements included, never share a slice
+            for first in runs:
+                for second in runs:
+                    if first is not second and first['start'] < second['end'] and second['start'] < first['end']:
+                        assert first['cores'] != second['cores']
+
+        # Nothing is left to mask, so no workers are started
+        with mock.patch("src.mask_workers.mp.get_context") as get_context:
+            assert list(mask_products_parallel(StubModel(), products, output_dir, 2, journal=journal)) == []
+        get_context.assert_not_called()
@@ -0,0 +1,59 @@
+"""
+ File Name:    test_mask_writer.py
+ Description:  unit test for functions from mask_writer.py
+"""
+
+import numpy as np
+import pytest
+from osgeo import gdal
+from src.gdal_wrapper import gdal_open
+from src.mask_writer import MaskWriter, creation_options, write_mask_to_file
+
+transform = (0, 10, 0, 0, 0, -10)
+
+
+def test_mask_writer_blocks(tmp_path):
+    outfile = tmp_path / "mask.tif"
+    with MaskWriter(outfile, 1024, 1024, "", transform) as writer:
+        writer.write_block(np.ones((512, 1024), dtype=np.float32), 0, 0)
+        writer.write_block(np.zeros((512, 1024), dtype=np.float32), 0, 512)
+
+    with gdal_open(outfile) as f:
+        band = f.GetRasterBand(1)
+        assert band.DataType == gdal.GDT_Byte
+        assert band.GetNoDataValue() == 0
+        assert band.GetBlockSize() == [512, 512]
+        assert f.GetMetadata('IMAGE_STRUCTURE')['COMPRESSION'] == 'DEFLATE'
+        mask = f.ReadAsArray()
+
+    assert mask[:512].all() and not mask[512:].any()
+
+
+def test_write_mask_to_file(tmp_path):
+    outfile = str(tmp_path / "mask.tif")
+    mask = np.eye(600)
+    write_mask_to_file(mask, outfile, "", transform)
+
+    with gdal_open(outfile) as f:
+        assert f.GetRasterBand(1).GetNoDataValue() is None
+        assert np.array_equal(f.ReadAsArray(), mask)
+
+
+def test_mask_writer_rounds_floats(tmp_path):
+    outfile = tmp_path / "mask.tif"
+    probabilities = np.array([[0.0, 0.49, 0.5, 0.51, 0.99, 1.0, -0.2, 300.0]], dtype=np.float32)
+    with MaskWriter(outfile, 8, 1, "", transform, nodata=None) as writer:
+        writer.write_block(probabilities)
+
+    with gdal_open(outfile) as f:
+        assert f.ReadAsArray().tolist() == [[0, 0, 1, 1, 1, 1, 0, 255]]
+
+
+def test_creation_options_threads():
+    assert 'NUM_THREADS=ALL_CPUS' in creation_options()
+    assert 'NUM_THREADS=3' in creation_options(threads=3)
+
+
+def test_creation_options_unknown_compression():
+    with pytest.raises(ValueError):
+        creation_options('JPEG')
@@ -5,9 +5,13 @@
  Description:  unit test for Product class
 """
 import pytest
-from src.metadata_class import Product, populate_cmr_product_shape, triage_products_newest, get_sub_products
+from src.metadata_class import Product, populate_cmr_product_shape, triage_products_newest, get_sub_products, \
+    get_shapes_cmr, format_points
 from datetime import datetime
 from shapely.geometry import Polygon
+from src.http_cache import ResponseCache
+from tests.cmr_stub import StubCMRServer, random_granules
+from unittest import mock
 
 tp1 = Product(name='S1A_IW_20200624T224520_DVP_RTC10_G_gpuned_8437.zip',
               granule='S1A_IW_GRDH_1SDV_20200624T224520_20200624T224545_033165_03D795_F52E',
@@ -56,3 +60,44 @@ def test_triage_products_date_recent():
 def test_time_bounds():
     assert tp1.time_bounds(datetime(2020, 1, 1, 0, 0, 0), datetime(2020, 12, 30, 0, 0, 0))
     assert not tp1.time_bounds(datetime(2013, 1, 1, 0, 0, 0), datetime(2013, 12, 30, 0, 0, 0))
+
+
+@pytest.fixture
+def cmr_server():
+    with StubCMRServer(random_granules(250)) as server:
+        yield server
+
+
+@pytest.mark.parametrize("batch_size, page_size, expected_requests", [(100, 2000, 3), (250, 100, 4), (50, 20, 16)])
+def test_get_shapes_cmr(cmr_server, batch_size, page_size, expected_requests):
+    products = [Product(name=f"{granule}.zip", granule=granule) for granule in cmr_server.granules]
+    products.append(Product(name='missing.zip', granule='S1A_IW_GRDH_1SDV_20200101T000000_20200101T000025_X'))
+
+    get_shapes_cmr(products, batch_size=batch_size, page_size=page_size, url=cmr_server.url)
+
+    assert cmr_server.requests == expected_requests
+    for product in products[:-1]:
+        assert product.shape == Polygon(format_points(cmr_server.granules[product.granule]))
+    assert products[-1].shape is None
+
+
+def test_get_shapes_cmr_cached(cmr_server, tmp_path):
+    cache = ResponseCache(tmp_path / 'cache.sqlite')
+    for expected_requests in (3, 3):
+        products = [Product(name=f"{granule}.zip", granule=granule) for granule in cmr_server.granules]
+        get_shapes_cmr(products, url=cmr_server.url, cache=cache)
+        assert cmr_server.requests == expected_requests
+        assert all(product.shape is not None for product in products)
+
+
+def test_get_sub_products_cached(tmp_path):
+    api = mock.Mock()
+    api.get_products.return_value = [{'name': tp1.name, 'granule': tp1.granule, 'url': tp1.url, 'id': 1}]
+    login = mock.Mock(return_value=api)
+    cache = ResponseCache(tmp_path / 'cache.sqlite')
+
+    for _ in range(2):
+        products = get_sub_products(login, 42, cache)
+        assert [product.granule for product in products] == [tp1.granule]
+
+    login.assert_called_once()
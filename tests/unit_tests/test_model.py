@@ -10,8 +10,8 @@ from keras.models import Model, Sequential
 
 from src.config import PROJECT_DIR, MODEL_DIR
 from src.model import (
-    ModelType, load_history, load_model, model_type, path_from_model_name,
-    save_history, save_model
+    ModelCache, ModelType, activation_bytes, get_model, load_history,
+    load_model, model_type, path_from_model_name, save_history, save_model
 )
 from src.model.architecture.masked import create_model_masked as create_model
 from src.asf_typing import History
@@ -25,7 +25,7 @@ def model_name(tmpdir: py.path.local):
     shutil.copytree(
         "tests/data/models/sample_model", temp_model_dir.join(model)
     )
-    with mock.patch("src.model.MODEL_DIR", temp_model_dir):
+    with mock.patch("src.model_paths.MODEL_DIR", temp_model_dir):
         yield model
 
 
@@ -166,3 +166,68 @@ def test_model_type(
 
     assert model_type(fake_model_masked) == ModelType.MASKED
     assert model_type(fake_model_other) is None
+
+
+def test_activation_bytes(fake_model_masked: Model):
+    assert activation_bytes(fake_model_masked) == dems * dems * 4
+
+
+def test_model_cache(model_name: str, tmpdir: py.path.local):
+    model_path = tmpdir.join("models", model_name, "latest.h5")
+    model_path.write("")
+    other_path = tmpdir.join("models", model_name, "other.h5")
+    other_path.write("")
+    cache = ModelCache(max_size=1)
+    loader = mock.Mock(side_effect=lambda name: object())
+
+    first = cache.get(model_name, loader)
+    assert cache.get(model_name, loader) is first
+    assert cache.loads == 1
+
+    # Evicted by the size cap
+    cache.get(f"{model_name}:other", loader)
+    assert len(cache) == 1
+    assert cache.get(model_name, loader) is not first
+    assert cache.loads == 3
+
+    # Reloaded when the file changes
+    os.utime(model_path, (0, 0))
+    cache.get(model_name, loader)
+    assert cache.loads == 4
+    assert len(cache) == 1
+
+
+def test_model_cache_inference_export(model_name: str, tmpdir: py.path.local):
+    model_path = tmpdir.join("models", model_name, "latest.h5")
+    model_path.write("")
+    os.utime(model_path, (100, 100))
+    inference_path = tmpdir.join("models", model_name, "latest.inference.h5")
+    cache = ModelCache()
+
+    with mock.patch("src.model.load_inference_model", side_effect=lambda name: object()):
+        cache.get(model_name)
+        inference_path.write("")
+        os.utime(inference_path, (200, 200))
+        cache.get(model_name)
+        assert cache.loads == 2
+
+        # Exported again without the .h5 changing
+        os.utime(inference_path, (300, 300))
+        cache.get(model_name)
+        cache.get(model_name)
+        assert cache.loads == 3
+        assert len(cache) == 1
+
+
+def test_get_model_passes_through_loaded_models(fake_model: Model):
+    assert get_model(fake_model) is fake_model
+
+
+def test_get_model_tflite_threads(model_name: str, tmpdir: py.path.local):
+    tmpdir.join("models", model_name, "latest.tflite").write("")
+
+    with mock.patch("src.model.MODEL_CACHE", ModelCache()), \
+            mock.patch("src.model.tflite.TFLiteModel") as tflite_model:
+        get_model(model_name, 'tflite', threads=3)
+
+    assert tflite_model.call_args.kwargs['num_threads'] == 3
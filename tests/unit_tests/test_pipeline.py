@@ -0,0 +1,58 @@
+"""
+ File Name:    test_pipeline.py
+ Description:  unit test for functions from pipeline.py
+"""
+
+import threading
+import time
+
+import pytest
+from src.pipeline import ByteBudget, run_pipeline
+
+
+def slow_read(item):
+    # Later items finish reading first to check that order is preserved
+    time.sleep(0.01 * (5 - item))
+    return item
+
+
+@pytest.mark.parametrize("readers, queue_depth", [(1, 1), (3, 2)])
+def test_run_pipeline_preserves_order(readers, queue_depth):
+    written = []
+    stats = run_pipeline(
+        range(5), slow_read, lambda x: x * 2, written.append, readers=readers, queue_depth=queue_depth
+    )
+
+    assert written == [0, 2, 4, 6, 8]
+    assert [stage.name for stage in stats] == ['read', 'process', 'write']
+    assert all(stage.items == 5 for stage in stats)
+    assert all(0 <= stage.utilisation <= 1 for stage in stats)
+
+
+def fail(item):
+    raise ValueError(item)
+
+
+@pytest.mark.parametrize("stage", [0, 1, 2])
+def test_run_pipeline_raises_stage_errors(stage):
+    funcs = [lambda x: x, lambda x: x, lambda x: None]
+    funcs[stage] = fail
+
+    with pytest.raises(ValueError):
+        run_pipeline(range(20), *funcs, queue_depth=1)
+
+
+def test_byte_budget():
+    budget = ByteBudget(100)
+    stop = threading.Event()
+    assert budget.wait(stop)
+
+    budget.add(100)
+    threading.Timer(0.05, budget.remove, (100, )).start()
+    start = time.perf_counter()
+    assert budget.wait(stop)
+    assert time.perf_counter() - start >= 0.04
+
+    budget.add(100)
+    stop.set()
+    assert not budget.wait(stop)
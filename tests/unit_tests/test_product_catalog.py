@@ -0,0 +1,127 @@
+"""
+ File Name:    test_product_catalog.py
+ Description:  unit tests for the columnar product catalog
+"""
+
+import random
+from datetime import datetime
+
+import numpy as np
+from shapely.geometry import Polygon, box
+
+from src.metadata_class import Product, format_points, triage_products_newest
+from src.product_catalog import ProductCatalog, get_sub_catalog, granule_time_arrays, parse_stamps
+from tests.cmr_stub import StubCMRServer, random_granules
+
+
+def listing(n, seed=0):
+    rng = random.Random(seed)
+    products = []
+    for i, granule in enumerate(random_granules(n, seed)):
+        # Shuffle the start days so sorting has something to do
+        day = rng.randrange(1, 29)
+        granule = granule.replace('20200101', f"202001{day:02d}", 2)
+        products.append({'name': f"{granule}_{i}.zip", 'granule': granule, 'url': f"https://example.com/{i}.zip"})
+    return products
+
+
+def test_parse_stamps():
+    stamps = ['20200624T224520', '19991231T235959', '20200229T000001']
+    expected = [datetime(2020, 6, 24, 22, 45, 20), datetime(1999, 12, 31, 23, 59, 59), datetime(2020, 2, 29, 0, 0, 1)]
+
+    assert [time.item() for time in parse_stamps(stamps)] == expected
+    assert len(parse_stamps([])) == 0
+
+
+def test_granule_time_arrays_match_product():
+    products = listing(200)
+    start, end = granule_time_arrays([product['granule'] for product in products])
+
+    for product, product_start, product_end in zip(products, start, end):
+        expected = Product(product['name'], product['granule'], product['url'])
+        assert (product_start.item(), product_end.item()) == (expected.start, expected.end)
+
+
+def test_catalog_materialises_products():
+    products = listing(10)
+    catalog = ProductCatalog.from_listing(products)
+
+    assert len(catalog) == 10
+    assert catalog[3] == Product(products[3]['name'], products[3]['granule'], products[3]['url'])
+    assert [product.name for product in catalog] == [product['name'] for product in products]
+
+
+def test_catalog_within_matches_time_bounds():
+    products = listing(300)
+    catalog = ProductCatalog.from_listing(products)
+    start, end = datetime(2020, 1, 5), datetime(2020, 1, 20, 12)
+
+    expected = [
+        product['name'] for product in products
+        if Product(product['name'], product['granule']).time_bounds(start, end)
+    ]
+    assert 0 < len(expected) < len(products)
+    assert list(catalog.within(start, end).names) == expected
+
+
+def test_catalog_sorted_matches_triage():
+    products = listing(300)
+    catalog = ProductCatalog.from_listing(products)
+    expected = triage_products_newest([Product(p['name'], p['granule'], p['url']) for p in products])
+
+    assert catalog.sorted_by_start().products() == expected
+
+
+def test_catalog_fill_shapes_and_intersecting():
+    products = listing(120)
+    footprints = random_granules(120).values()
+    granules = {product['granule']: points for product, points in zip(products, footprints)}
+    with StubCMRServer(granules) as server:
+        catalog = ProductCatalog.from_listing(products[:100] + [
+            {'name': 'missing.zip', 'granule': 'S1A_IW_GRDH_1SDV_20200101T000000_20200101T000025_X'}
+        ])
+        catalog.fill_shapes(url=server.url)
+
+    assert catalog.shapes[-1] is None
+    for shape, granule in zip(catalog.shapes[:-1], granules):
+        assert shape == Polygon(format_points(granules[granule]))
+
+    aoi = box(-20, -20, 20, 20)
+    hits = catalog.intersecting(aoi)
+    assert list(hits.names) == [
+        name for name, shape in zip(catalog.names, catalog.shapes) if shape is not None and shape.intersects(aoi)
+    ]
+    assert len(catalog.intersecting(box(500, 500, 501, 501))) == 0
+
+
+def test_catalog_from_products():
+    products = [Product(p['name'], p['granule'], p['url']) for p in listing(5)]
+    products[2].shape = box(0, 0, 1, 1)
+    catalog = ProductCatalog.from_products(products)
+
+    assert catalog.products() == products
+    assert np.array_equal(catalog.has_shape, [False, False, True, False, False])
+
+
+def test_catalog_interns_names():
+    products = listing(3)
+    # Equal but distinct strings, as parsed from two listings
+    copies = [{key: ''.join(value) for key, value in product.items()} for product in products]
+    catalog = ProductCatalog.from_listing(products + copies)
+
+    assert catalog.granules[0] is catalog.granules[3]
+
+
+def test_get_sub_catalog():
+    products = listing(4)
+    catalog = get_sub_catalog(lambda: FakeAPI(products), 7)
+
+    assert list(catalog.urls) == [product['url'] for product in products]
+
+
+class FakeAPI:
+    def __init__(self, products):
+        self.products = products
+
+    def get_products(self, sub_id):
+        return self.products
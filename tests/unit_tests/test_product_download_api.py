@@ -5,12 +5,22 @@
  Description:  unit test for functions from product_download_api.py
 """
 
+import os
+import re
+import threading
+import time
+import zipfile
+from urllib.parse import urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import pytest
-from src.product_download_api import metalink_to_list, download_product, MetalinkProduct, metalink_product_generator, get_netrc_credentials, credentials, download_metalink_products
+from src.product_download_api import metalink_to_list, download_product, MetalinkProduct, metalink_product_generator, get_netrc_credentials, credentials, download_metalink_products, \
+    fetch_product_members, DownloadEngine, ChecksumMismatch
 from pathlib import Path
 import responses
 from unittest.mock import mock_open, patch, MagicMock
 import functools
+import hashlib
 
 
 # TODO: Move to conftest.py because DRY.
@@ -107,7 +117,7 @@ def test_download_product():
     save_directory = Path.cwd()
     expected_name = save_directory / test_product_1.name
 
-    with patch("builtins.open", open_mock):
+    with patch("builtins.open", open_mock), patch.object(Path, "replace") as replace_mock:
 
         responses.add(responses.GET, url=test_product_1.url, status=401)
         responses.add(responses.GET, status=200)
@@ -115,7 +125,9 @@ def test_download_product():
         # CHANGE SO CREDS ARE INPUT VIA THIRD VARIABLE
         download_product(test_product_1.url, save_directory, test_creds)
 
-    open_mock.assert_called_with(expected_name, "wb")
+    # Downloads stream into a .part file which is renamed once complete
+    open_mock.assert_called_with(expected_name.with_name(f"{expected_name.name}.part"), "wb")
+    replace_mock.assert_called_with(expected_name)
 
 
 
@@ -128,21 +140,226 @@ def test_download_metalink_products():
     input_matalink_path = Path.cwd() / "products.metalink"
     save_directory_path = Path.cwd()
 
-    download_mock = MagicMock()
+    download_mock = MagicMock(return_value=input_matalink_path)
     with patch("src.product_download_api.download_product", download_mock):
         download_metalink_products(input_matalink_path, save_directory_path, test_creds)
 
     download_mock.assert_called()
 
 
+PRODUCT_NAME = 'S1A_IW_20200101T000000_DVP_RTC30_G_gpuned_0000'
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves the server's product zip, honouring single byte ranges unless
+    the server has ranges turned off."""
+
+    def do_GET(self):
+        data = self.server.data
+        start, end = 0, len(data) - 1
+        byte_range = self.headers.get('Range')
+        if byte_range and self.server.ranges:
+            first, last = re.fullmatch(r'bytes=(\d*)-(\d*)', byte_range).groups()
+            if not first:
+                start = max(len(data) - int(last), 0)
+            else:
+                start, end = int(first), min(int(last or end), end)
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range', f"bytes */{len(data)}")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{end}/{len(data)}")
+        else:
+            self.send_response(200)
+
+        body = data[start:end + 1]
+        self.server.bytes_served += len(body)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def product_server(tmp_path):
+    """A product zip whose DEM dwarfs its VV and VH tifs, served over http."""
+    members = {
+        f"{PRODUCT_NAME}/{PRODUCT_NAME}_VV.tif": os.urandom(50_000),
+        f"{PRODUCT_NAME}/{PRODUCT_NAME}_VH.tif": bytes(100_000),
+        f"{PRODUCT_NAME}/{PRODUCT_NAME}_dem.tif": os.urandom(1_000_000),
+        f"{PRODUCT_NAME}/{PRODUCT_NAME}.README.md.txt": b'readme',
+    }
+    zip_path = tmp_path / 'source' / f"{PRODUCT_NAME}.zip"
+    zip_path.parent.mkdir()
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    server.data = zip_path.read_bytes()
+    server.ranges = True
+    server.bytes_served = 0
+    server.members = members
+    server.url = f"http://127.0.0.1:{server.server_port}/{zip_path.name}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_product_members(product_server, tmp_path):
+    save_directory = tmp_path / 'partial'
+    save_directory.mkdir()
+
+    save_path = fetch_product_members(product_server.url, save_directory, test_creds)
+
+    assert save_path == save_directory / f"{PRODUCT_NAME}.zip"
+    assert os.listdir(save_directory) == [save_path.name]
+    with zipfile.ZipFile(save_path) as zf:
+        fetched = {info.filename: zf.read(info) for info in zf.infolist()}
+        assert all(info.compress_type == zipfile.ZIP_STORED for info in zf.infolist())
+
+    assert fetched == {name: data for name, data in product_server.members.items() if re.search(r'_V[VH]\.tif$', name)}
+    # Only the VV and VH members and the central directory were transferred
+    assert product_server.bytes_served < len(product_server.data) / 4
+
+
+def test_download_product_sar_only_falls_back(product_server, tmp_path):
+    product_server.ranges = False
+    save_directory = tmp_path / 'full'
+    save_directory.mkdir()
+
+    download_product(product_server.url, save_directory, test_creds, sar_only=True)
+
+    assert (save_directory / f"{PRODUCT_NAME}.zip").read_bytes() == product_server.data
+
+
+def test_download_engine(product_server, tmp_path):
+    host, name = product_server.url.rsplit('/', 1)
+    urls = [f"{host}/{i}_{name}" for i in range(3)]
+
+    engine = DownloadEngine(test_creds, workers=3)
+    paths = list(engine.download(urls, tmp_path / 'downloads'))
+
+    assert len(paths) == 3
+    assert engine.stats.products == 3 and engine.stats.failed == 0
+    assert engine.stats.bytes == 3 * len(product_server.data)
+
+
+def test_download_engine_caps_per_host(tmp_path):
+    lock = threading.Lock()
+    active = {}
+    peak = {}
+
+    def fake_download(url, save_directory, creds, sar_only, session, size, hash):
+        host = urlsplit(url).netloc
+        with lock:
+            active[host] = active.get(host, 0) + 1
+            peak[host] = max(peak.get(host, 0), active[host])
+        time.sleep(0.05)
+        with lock:
+            active[host] -= 1
+        if url.endswith('bad.zip'):
+            raise ConnectionError(url)
+
+        save_path = save_directory / url.split('/')[-1]
+        save_path.write_bytes(b'product')
+        return save_path
+
+    urls = [f"https://{host}/{host}_{i}.zip" for host in ('a.example', 'b.example') for i in range(5)]
+    urls.append('https://a.example/bad.zip')
+
+    engine = DownloadEngine(test_creds, workers=8, per_host=2)
+    with patch("src.product_download_api.download_product", fake_download):
+        paths = list(engine.download(urls, tmp_path))
+
+    assert len(paths) == 10
+    assert peak == {'a.example': 2, 'b.example': 2}
+    assert engine.stats.failed == 1 and engine.failures[0][0] == 'https://a.example/bad.zip'
+    assert engine.stats.bytes == 10 * len(b'product')
+
+
+def test_download_engine_dedupes_products(tmp_path):
+    saved = []
+
+    def fake_download(url, save_directory, creds, sar_only, session, size, hash):
+        time.sleep(0.05)
+        saved.append(url)
+        save_path = save_directory / url.split('/')[-1]
+        save_path.write_bytes(b'product')
+        return save_path
+
+    engine = DownloadEngine(test_creds, workers=4)
+    with patch("src.product_download_api.download_product", fake_download):
+        # The same product twice, and from a mirror, would share one .part file
+        paths = list(engine.download(
+            ['https://a.example/0.zip', 'https://a.example/0.zip', 'https://b.example/0.zip'], tmp_path
+        ))
+        wall = engine.stats.wall
+        list(engine.download(['https://a.example/1.zip'], tmp_path))
+
+    assert paths == [tmp_path / '0.zip']
+    assert saved == ['https://a.example/0.zip', 'https://a.example/1.zip']
+    # Time adds up over calls
+    assert engine.stats.wall >= wall + 0.05
+
+
+def test_download_product_resumes(product_server, tmp_path):
+    data = product_server.data
+    save_path = tmp_path / f"{PRODUCT_NAME}.zip"
+    part_path = tmp_path / f"{PRODUCT_NAME}.zip.part"
+    part_path.write_bytes(data[:len(data) // 2])
+
+    size, hash = len(data), hashlib.sha512(data).hexdigest()
+    assert download_product(product_server.url, tmp_path, test_creds, size=size, hash=hash) == save_path
 
+    assert save_path.read_bytes() == data
+    assert not part_path.exists()
+    # Only the missing half and the redirect check were transferred
+    assert product_server.bytes_served == len(data) - len(data) // 2 + 1
 
+    # Complete, matching products are skipped
+    download_product(product_server.url, tmp_path, test_creds, size=size, hash=hash)
+    assert product_server.bytes_served == len(data) - len(data) // 2 + 1
 
 
+@pytest.mark.parametrize("with_size", [True, False])
+def test_download_product_restarts_overlong_part(product_server, tmp_path, with_size):
+    data = product_server.data
+    save_path = tmp_path / f"{PRODUCT_NAME}.zip"
+    part_path = tmp_path / f"{PRODUCT_NAME}.zip.part"
+    # Say a bad append left the .part longer than the product
+    part_path.write_bytes(data + b'appended')
 
+    size, hash = (len(data), hashlib.sha512(data).hexdigest()) if with_size else (None, None)
+    assert download_product(product_server.url, tmp_path, test_creds, size=size, hash=hash) == save_path
 
+    assert save_path.read_bytes() == data
+    assert not part_path.exists()
 
 
+def test_download_product_restarts_after_range_not_satisfiable(product_server, tmp_path):
+    data = product_server.data
+    part_path = tmp_path / f"{PRODUCT_NAME}.zip.part"
+    part_path.write_bytes(data + b'appended')
+    # The listed size is out of date, so the .part looks short of it
+    size = len(data) + 100
 
+    with pytest.raises(IOError, match="incomplete"):
+        download_product(product_server.url, tmp_path, test_creds, size=size)
+
+    # Downloaded again from the start rather than kept
+    assert part_path.read_bytes() == data
 
 
+def test_download_product_checksum_mismatch(product_server, tmp_path):
+    with pytest.raises(ChecksumMismatch):
+        download_product(product_server.url, tmp_path, test_creds, size=len(product_server.data), hash='0' * 128)
+
+    assert os.listdir(tmp_path) == ['source']
@@ -0,0 +1,169 @@
+"""
+ File Name:    test_product_store.py
+ Description:  unit tests for the shared product store
+"""
+
+import multiprocessing
+import os
+import time
+from unittest import mock
+
+import pytest
+
+from src.product_download_api import DownloadEngine, credentials, digest_path
+from src.product_store import ProductStore
+
+URL = 'https://example.com/data/{}.zip'
+
+
+@pytest.fixture
+def downloads():
+    """Patches download_product to write 100 byte products, recording the urls
+    it actually had to fetch."""
+    fetched = []
+
+    def fake_download(url, save_directory, creds, sar_only, session, size, hash):
+        save_path = save_directory / url.split('/')[-1]
+        if not save_path.is_file():
+            fetched.append(url)
+            save_path.write_bytes(bytes(100))
+            digest_path(save_path).write_text('0' * 128)
+        return save_path
+
+    with mock.patch("src.product_download_api.download_product", fake_download):
+        yield fetched
+
+
+def make_store(directory, max_bytes=1000, sar_only=False):
+    return ProductStore(DownloadEngine(credentials('user', 'password'), sar_only=sar_only), directory, max_bytes)
+
+
+def test_acquire_downloads_once(tmp_path, downloads):
+    store = make_store(tmp_path)
+    for _ in range(2):
+        for path in store.acquire([URL.format('a'), URL.format('b')]):
+            store.release(path)
+
+    assert sorted(downloads) == [URL.format('a'), URL.format('b')]
+    assert store.references == {}
+
+
+def test_evicts_least_recently_used(tmp_path, downloads):
+    store = make_store(tmp_path, max_bytes=250)
+    for name in 'abc':
+        for path in store.acquire([URL.format(name)]):
+            store.release(path)
+        # mtime resolution
+        time.sleep(0.01)
+
+    assert sorted(os.listdir(tmp_path)) == ['b.zip', 'b.zip.sha512', 'c.zip', 'c.zip.sha512']
+
+
+def test_referenced_products_are_kept(tmp_path, downloads):
+    store = make_store(tmp_path, max_bytes=150)
+    held = next(store.acquire([URL.format('a')]))
+    time.sleep(0.01)
+    for path in store.acquire([URL.format('b')]):
+        store.release(path)
+
+    # 'a' is older but still in use, so 'b' is the only one that can go
+    assert held.is_file()
+    assert not (tmp_path / 'b.zip').exists()
+
+    store.release(held)
+    for path in store.acquire([URL.format('c')]):
+        store.release(path)
+    assert not held.exists()
+
+
+def test_sar_only_kept_apart(tmp_path, downloads):
+    make_store(tmp_path).acquire([URL.format('a')]).__next__()
+    path = next(make_store(tmp_path, sar_only=True).acquire([URL.format('a')]))
+
+    assert path == tmp_path / 'sar_only' / 'a.zip'
+    assert len(downloads) == 2
+
+
+def test_export(tmp_path, downloads):
+    store = make_store(tmp_path / 'store')
+    exported = list(store.export([URL.format('a')], tmp_path / 'sub'))
+
+    assert exported == [tmp_path / 'sub' / 'a.zip']
+    assert exported[0].read_bytes() == (tmp_path / 'store' / 'a.zip').read_bytes()
+    assert store.references == {}
+
+
+def hold_product(directory, acquired, done):
+    store = make_store(directory, max_bytes=150)
+    path = next(store.acquire([URL.format('a')]))
+    acquired.set()
+    done.wait(10)
+    store.release(path)
+
+
+def test_products_leased_by_other_processes_are_kept(tmp_path, downloads):
+    # fork, so the child keeps the patched download_product
+    context = multiprocessing.get_context('fork')
+    acquired, done = context.Event(), context.Event()
+    holder = context.Process(target=hold_product, args=(tmp_path, acquired, done))
+    holder.start()
+    try:
+        assert acquired.wait(10)
+        time.sleep(0.01)
+        store = make_store(tmp_path, max_bytes=150)
+        for path in store.acquire([URL.format('b')]):
+            store.release(path)
+
+        # 'a' is older, but still leased by the other process
+        assert (tmp_path / 'a.zip').is_file()
+        assert not (tmp_path / 'b.zip').exists()
+    finally:
+        done.set()
+        holder.join(10)
+
+    for path in store.acquire([URL.format('c')]):
+        store.release(path)
+    assert not (tmp_path / 'a.zip').exists()
+
+
+def slow_download(url, save_directory, creds, sar_only, session, size, hash):
+    save_path = save_directory / url.split('/')[-1]
+    if not save_path.is_file():
+        with open(save_directory / 'fetched', 'a') as f:
+            f.write(f"{os.getpid()}\n")
+        part_path = save_path.with_name(f"{save_path.name}.part")
+        for _ in range(10):
+            with open(part_path, 'ab') as f:
+                f.write(bytes(10))
+            time.sleep(0.01)
+        part_path.replace(save_path)
+    return save_path
+
+
+def acquire_in_process(directory):
+    store = make_store(directory)
+    for path in store.acquire([URL.format('a')]):
+        store.release(path)
+
+
+def test_processes_download_a_product_once(tmp_path):
+    context = multiprocessing.get_context('fork')
+    with mock.patch("src.product_download_api._download_product", slow_download):
+        processes = [context.Process(target=acquire_in_process, args=(tmp_path, )) for _ in range(2)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(10)
+
+    assert [process.exitcode for process in processes] == [0, 0]
+    assert len((tmp_path / 'fetched').read_text().split()) == 1
+    assert (tmp_path / 'a.zip').stat().st_size == 100
+
+
+def test_failed_downloads_are_released(tmp_path):
+    store = make_store(tmp_path)
+    with mock.patch("src.product_download_api.download_product", side_effect=IOError("refused")):
+        assert list(store.acquire([URL.format('a')])) == []
+
+    assert store.references == {}
+    assert store._leases == {}
@@ -0,0 +1,86 @@
+"""
+ File Name:    test_spatial.py
+ Description:  unit tests for spatial queries over product footprints
+"""
+
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from shapely.geometry import Point, Polygon, box
+from shapely.ops import unary_union
+
+from src.metadata_class import Product, get_min_granule_coverage
+from src.spatial import intersecting, minimum_coverage, products_intersecting
+
+GRANULE = 'S1A_IW_GRDH_1SDV_20200624T224520_20200624T224545_033165_03D795_F52E'
+
+
+def random_boxes(n, seed=0):
+    rng = random.Random(seed)
+    boxes = []
+    for _ in range(n):
+        x, y = rng.uniform(0, 100), rng.uniform(0, 100)
+        boxes.append(box(x, y, x + rng.uniform(1, 5), y + rng.uniform(1, 5)))
+    return boxes
+
+
+def test_intersecting_matches_loop():
+    shapes = random_boxes(500)
+    # A concave, many sided aoi whose bounding box covers most shapes
+    aoi = Point(50, 50).buffer(40, 64).difference(Point(50, 50).buffer(25, 64))
+
+    assert intersecting(shapes, aoi) == [i for i, shape in enumerate(shapes) if shape.intersects(aoi)]
+
+
+def test_intersecting_empty():
+    assert intersecting([], box(0, 0, 1, 1)) == []
+
+
+def test_products_intersecting():
+    products = [Product(name=f"{i}.zip", granule=GRANULE) for i in range(4)]
+    products[0].shape = box(0, 0, 1, 1)
+    products[1].shape = box(5, 5, 6, 6)
+    products[3].shape = Polygon([(0.5, 0.5), (3, 0.5), (3, 3)])
+
+    assert products_intersecting(products, box(0.5, 0, 2, 2)) == [products[0], products[3]]
+
+
+def random_products(n, size, seed):
+    rng = random.Random(seed)
+    products = []
+    for i, shape in enumerate(random_boxes(n, seed)):
+        product = Product(name=f"{i}.zip", granule=GRANULE)
+        product.start = datetime(2020, 1, 1) + timedelta(hours=rng.randrange(10000))
+        x, y = shape.bounds[:2]
+        product.shape = box(x, y, x + size, y + size * 0.8)
+        products.append(product)
+    return products
+
+
+def uncovered(products, aoi):
+    return aoi.difference(unary_union([product.shape for product in products])).area / aoi.area
+
+
+@pytest.mark.parametrize("n, size, seed", [(60, 10, 0), (300, 12, 1), (300, 3, 2)])
+def test_minimum_coverage_matches_get_min_granule_coverage(n, size, seed):
+    products = random_products(n, size, seed)
+    aoi = Point(50, 50).buffer(35, 64)
+
+    expected = get_min_granule_coverage(products, aoi)
+    selected = minimum_coverage(products, aoi)
+
+    # The same area is covered, without products that only touch it along an edge
+    assert set(map(id, selected)) <= set(map(id, expected))
+    assert uncovered(selected, aoi) == pytest.approx(uncovered(expected, aoi), abs=1e-9)
+    assert [product.start for product in selected] == sorted(product.start for product in selected)
+
+
+def test_minimum_coverage_grid():
+    products = random_products(300, 12, 1)
+    aoi = Point(50, 50).buffer(35, 64)
+
+    selected = minimum_coverage(products, aoi, cell_size=0.5)
+
+    assert uncovered(selected, aoi) <= uncovered(minimum_coverage(products, aoi), aoi) + 0.01
+    assert len(selected) <= len(get_min_granule_coverage(products, aoi))
@@ -0,0 +1,139 @@
+"""
+ File Name:    test_subscription_stream.py
+ Description:  unit tests for paging through subscriptions incrementally
+"""
+
+from datetime import datetime
+
+from src.http_cache import ResponseCache
+from src.product_catalog import ProductCatalog
+from src.subscription_stream import HighWaterMark, IncrementalRun, load_high_water_mark, mark_path, \
+    save_high_water_mark, sub_pages
+from tests.hyp3_stub import PagedAPI, granule, listing
+
+
+def test_sub_pages_streams_pages():
+    api = PagedAPI(listing([granule(day) for day in range(1, 24)]))
+    pages = sub_pages(api, 1, page_size=10)
+
+    first = next(pages)
+    assert api.requests == 1
+    assert len(first) == 10
+
+    assert [len(page) for page in pages] == [10, 3]
+    assert api.requests == 3
+
+
+def test_sub_pages_ends_on_empty_page():
+    api = PagedAPI(listing([granule(day) for day in range(1, 21)]))
+
+    assert [len(page) for page in sub_pages(api, 1, page_size=10)] == [10, 10, 0]
+
+
+def test_sub_pages_since():
+    granules = [granule(day) for day in range(1, 21)]
+
+    pages = list(sub_pages(PagedAPI(listing(granules)), 1, HighWaterMark(14), page_size=8))
+
+    assert [g for page in pages for g in page.granules] == granules[15:]
+
+
+def test_sub_pages_cached(tmp_path):
+    api = PagedAPI(listing([granule(day) for day in range(1, 13)]))
+    cache = ResponseCache(tmp_path / 'cache.sqlite')
+
+    first = [list(page.granules) for page in sub_pages(lambda: api, 1, page_size=5, cache=cache)]
+    second = [list(page.granules) for page in sub_pages(lambda: api, 1, page_size=5, cache=cache)]
+
+    assert first == second
+    assert api.requests == 3
+
+
+def test_high_water_mark():
+    products = ProductCatalog.from_listing(listing([granule(day) for day in range(1, 6)]))
+    newest = HighWaterMark.newest([products[:2], products[2:], products[:0]])
+
+    assert newest == HighWaterMark(4)
+    assert HighWaterMark.newest([]) is None
+    assert len(newest.newer(products)) == 0
+    assert list(HighWaterMark(2).newer(products).granules) == [granule(4), granule(5)]
+
+    # Products listed without an id are always handed out
+    unnumbered = ProductCatalog.from_listing([{'name': 'a.zip', 'granule': granule(1), 'url': 'a'}])
+    assert HighWaterMark.newest([unnumbered]) is None
+    assert len(newest.newer(unnumbered)) == 1
+
+
+def test_save_load_high_water_mark(tmp_path):
+    mark = HighWaterMark(12)
+
+    assert load_high_water_mark(tmp_path, 7) is None
+    save_high_water_mark(tmp_path, 7, mark)
+    assert load_high_water_mark(tmp_path, 7) == mark
+    assert load_high_water_mark(tmp_path, 8) is None
+
+    # Marks kept by acquisition time are dropped
+    mark_path(tmp_path, 7).write_text('{"start": "2020-01-05T12:30:00", "granule": "S1A"}')
+    assert load_high_water_mark(tmp_path, 7) is None
+
+
+def test_incremental_run(tmp_path):
+    granules = [granule(day) for day in range(1, 11)]
+    api = PagedAPI(listing(granules))
+
+    run = IncrementalRun(tmp_path, 1)
+    assert [g for page in run.track(sub_pages(api, 1, run.since, page_size=4)) for g in page.granules] == granules
+    assert run.commit() == HighWaterMark(9)
+
+    # A rerun only sees the products added since
+    api.products = listing(granules + [granule(day) for day in range(11, 14)])
+    run = IncrementalRun(tmp_path, 1)
+    assert [g for page in run.track(sub_pages(api, 1, run.since, page_size=4)) for g in page.granules] == [
+        granule(day) for day in range(11, 14)
+    ]
+    run.commit()
+
+    # Nothing new leaves the mark where it was
+    run = IncrementalRun(tmp_path, 1)
+    assert sum(len(page) for page in run.track(sub_pages(api, 1, run.since))) == 0
+    assert run.commit() == HighWaterMark(12)
+
+    rescan = IncrementalRun(tmp_path, 1, rescan=True)
+    assert sum(len(page) for page in sub_pages(api, 1, rescan.since)) == 13
+
+
+def test_incremental_run_backfill(tmp_path):
+    granules = [granule(day) for day in range(10, 20)]
+    api = PagedAPI(listing(granules))
+    run = IncrementalRun(tmp_path, 1)
+    for _ in run.track(sub_pages(api, 1, run.since, page_size=4)):
+        pass
+    run.commit()
+
+    # Products acquired before any already processed, but processed after the run
+    backfill = [granule(day) for day in range(1, 4)]
+    api.products = listing(granules + backfill)
+    run = IncrementalRun(tmp_path, 1)
+
+    assert [g for page in run.track(sub_pages(api, 1, run.since, page_size=4)) for g in page.granules] == backfill
+
+
+def test_incremental_run_forgets_mark_for_other_selection(tmp_path):
+    granules = [granule(day) for day in range(1, 21)]
+    api = PagedAPI(listing(granules))
+
+    def run_within(start, end):
+        run = IncrementalRun(tmp_path, 1, settings={'date_start': start, 'date_end': end, 'aoi': None})
+        selected = [
+            g for page in run.track(page.within(start, end) for page in sub_pages(api, 1, run.since, page_size=8))
+            for g in page.granules
+        ]
+        run.commit()
+        return selected
+
+    assert run_within(datetime(2020, 1, 10), datetime(2020, 1, 21)) == granules[10:]
+    assert run_within(datetime(2020, 1, 10), datetime(2020, 1, 21)) == []
+
+    # Widening the date range brings back the products the first run left out
+    assert run_within(datetime(2019, 12, 31), datetime(2020, 1, 21)) == granules
+    assert run_within(datetime(2019, 12, 31), datetime(2020, 1, 21)) == []
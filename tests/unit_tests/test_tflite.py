@@ -0,0 +1,54 @@
+"""
+ File Name:    test_tflite.py
+ Description:  unit test for functions from model/tflite.py
+"""
+
+import numpy as np
+import pytest
+from keras.layers import Conv2D
+from keras.models import Model, Sequential
+
+from src.model import activation_bytes
+from src.model.tflite import TFLiteModel, convert_to_tflite, iou
+
+
+@pytest.fixture
+def small_model() -> Model:
+    return Sequential([Conv2D(1, (1, 1), activation='sigmoid', input_shape=(8, 8, 2))])
+
+
+@pytest.fixture
+def tiles() -> np.ndarray:
+    return np.random.default_rng(0).random((5, 8, 8, 2), dtype=np.float32)
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 5])
+def test_tflite_model_matches_keras(small_model: Model, tiles: np.ndarray, batch_size: int):
+    tflite_model = TFLiteModel(model_content=convert_to_tflite(small_model, 'none'))
+
+    predictions = tflite_model.predict(tiles, batch_size=batch_size)
+
+    assert predictions.shape == (5, 8, 8, 1)
+    assert np.allclose(predictions, small_model.predict(tiles), atol=1e-5)
+
+
+def test_int8_tflite_model(small_model: Model, tiles: np.ndarray):
+    flatbuffer = convert_to_tflite(small_model, 'int8', lambda: (tile[np.newaxis] for tile in tiles))
+    tflite_model = TFLiteModel(model_content=flatbuffer)
+
+    predictions = tflite_model.predict(tiles, batch_size=2)
+
+    assert np.allclose(predictions, small_model.predict(tiles), atol=0.05)
+    assert activation_bytes(tflite_model) > 0
+
+
+def test_int8_needs_representative_data(small_model: Model):
+    with pytest.raises(ValueError):
+        convert_to_tflite(small_model, 'int8')
+
+
+def test_iou():
+    a = np.array([1, 1, 0, 0])
+    b = np.array([1, 0, 1, 0])
+    assert iou(a, b) == pytest.approx(1 / 3)
+    assert iou(np.zeros(4), np.zeros(4)) == 1.0
@@ -0,0 +1,87 @@
+"""
+ File Name:    test_tile_cache.py
+ Description:  unit test for functions from tile_cache.py
+"""
+
+import os
+from pathlib import Path
+
+import mock
+import numpy as np
+from src.geo_utility import MaskStats, predict_strip
+from src.tile_cache import TileCache
+
+
+def test_tile_cache_round_trip(tmp_path):
+    cache = TileCache(tmp_path)
+    tile = np.eye(512)
+    key = cache.key("model", tile, tile)
+
+    assert cache.get(key, (512, 512)) is None
+    cache.put(key, tile)
+
+    assert np.array_equal(cache.get(key, (512, 512)), tile)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.size == TileCache(tmp_path).size > 0
+
+
+def test_tile_cache_keys():
+    tile = np.ones((4, 4))
+    key = TileCache.key("model", tile, tile)
+
+    assert key == TileCache.key("model", tile.copy(), tile.copy())
+    assert key != TileCache.key("other_model", tile, tile)
+    assert key != TileCache.key("model", tile, tile * 2)
+
+
+def test_tile_cache_evicts_least_recently_used(tmp_path):
+    cache = TileCache(tmp_path, max_bytes=10**9)
+    keys = [cache.key("model", np.full(4, i), np.full(4, i)) for i in range(4)]
+    for i, key in enumerate(keys):
+        cache.put(key, np.eye(64))
+        os.utime(cache._path(key), (i, i))
+
+    cache.max_bytes = cache.size // 2
+    cache.evict()
+
+    assert cache.get(keys[0], (64, 64)) is None
+    assert cache.get(keys[3], (64, 64)) is not None
+
+
+def test_tile_cache_shared(tmp_path):
+    first, second = TileCache(tmp_path), TileCache(tmp_path)
+    key = first.key("model", np.ones(4), np.ones(4))
+    first.put(key, np.eye(64))
+
+    assert list(tmp_path.glob('*/*.part')) == []
+    assert np.array_equal(second.get(key, (64, 64)), np.eye(64))
+
+    # A tile loaded just before the other process evicts it is still a hit
+    with mock.patch('src.tile_cache.os.utime', side_effect=FileNotFoundError):
+        assert first.get(key, (64, 64)) is not None
+
+    second.max_bytes = 0
+    second.evict()
+    assert first.get(key, (64, 64)) is None
+
+    # Tiles listed but evicted by the other process before they are looked at
+    with mock.patch.object(Path, 'glob', return_value=[first._path(key)]):
+        first.max_bytes = 0
+        first.evict()
+    assert first.size == 0
+
+
+def test_predict_strip_uses_cache(tmp_path):
+    model = mock.Mock()
+    model.predict.side_effect = lambda x, **kwargs: (x[..., :1] < x[..., 1:]).astype('float32')
+    vv = np.random.default_rng(0).random((512, 1024))
+    vh = np.random.default_rng(1).random((512, 1024))
+    cache = TileCache(tmp_path)
+
+    first = predict_strip(model, vv, vh, cache=cache, digest="model")
+    stats = MaskStats()
+    second = predict_strip(model, vv, vh, cache=cache, digest="model", stats=stats)
+
+    assert model.predict.call_count == 1
+    assert stats.cached == 2
+    assert np.array_equal(first, second)